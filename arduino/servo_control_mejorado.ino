@@ -1,22 +1,35 @@
 /*
  * servo_control_mejorado.ino - Arduino Uno
- * 
+ *
  * SOLUCIONES IMPLEMENTADAS:
  * 1. Watchdog timer para evitar bloqueos
- * 2. Flush del buffer serial para evitar comandos acumulados
+ * 2. Protocolo de tramas con número de secuencia y CRC8 (ver rpi5/arduino_protocol.py)
  * 3. LED de estado para debugging visual
- * 4. Timeout en espera de comandos
- * 5. Confirmación mejorada con ACK
- * 
+ * 4. Servo no bloqueante (máquina de estados con millis, sin delay)
+ * 5. Cola de comandos: varios comandos en vuelo a la vez
+ * 6. Varias compuertas (servos) independientes, cada una con su cola
+ *
  * Conexiones:
  * - Arduino TX (Pin 1) -> Level Converter HV2
  * - Arduino RX (Pin 0) -> Level Converter HV1
- * - Servo Signal -> Pin 9
+ * - Servo Signal -> Pin 9 (compuerta 0), Pin 10 (compuerta 1)
  * - Servo VCC -> Fuente externa 5V (NO al Arduino!)
  * - Servo GND -> GND común (Arduino + Fuente + Level Converter)
  * - LED interno -> Pin 13 (built-in)
- * 
- * Protocolo mejorado:
+ *
+ * Protocolo de tramas:
+ *   SYNC (0xA5) | SEQ | OP | LEN | PAYLOAD | CRC8 (poly 0x07 sobre SEQ..PAYLOAD)
+ * - ACTIVATE (0x01) [ángulo, espera_ms L, espera_ms H, ángulo_retorno, (servo)]
+ *     -> ACK al encolar, DONE al terminar el movimiento
+ * - RESET (0x02) [ángulo, (servo)]  -> ACK al encolar, DONE al terminar
+ * - STATUS (0x03) [(servo)]         -> ACK [estado, posición, en_cola]
+ *   (servo opcional: 0 si falta)
+ * - SET_BAUD (0x04) [baudios u32 LE] -> ACK a la velocidad actual y cambio;
+ *     sin trama válida en BAUD_CONFIRM_TIMEOUT se vuelve a la anterior
+ * - Errores -> NACK [código]; logs -> tramas LOG (SEQ 0)
+ *
+ * Protocolo antiguo (se mantiene para diagnostico_arduino.py y la Pico;
+ * solo controla la compuerta 0):
  * - Recibe 'A' -> Activa servo -> Responde 'D' (Done)
  * - Recibe 'R' -> Reset -> Responde 'K' (OK)
  * - Recibe 'S' -> Status -> Responde estado actual
@@ -26,29 +39,51 @@
 #include <avr/wdt.h>  // Watchdog timer para evitar bloqueos
 
 // ========== CONFIGURACIÓN ==========
-Servo myServo;
-const int SERVO_PIN = 9;
+const byte NUM_SERVOS = 2;
+const int SERVO_PINS[NUM_SERVOS] = {9, 10};
 const int LED_PIN = LED_BUILTIN;  // Pin 13
 
 // Posiciones del servo
 const int POS_INICIAL = 0;
 const int POS_ACTIVO = 180;
 
+// Velocidad serie (rpi5/serial_config.py: BAUDRATE)
+const unsigned long BAUD_INICIAL = 9600;
+const unsigned long BAUD_CONFIRM_TIMEOUT = 1000;  // ms para confirmar SET_BAUD
+
 // Tiempos (milisegundos)
-const unsigned long SERVO_DELAY = 500;        // Delay entre movimientos
-const unsigned long SERIAL_TIMEOUT = 100;     // Timeout lectura serial
+const unsigned long SERVO_DELAY = 500;        // Tiempo para llegar a posición
+const unsigned long SERIAL_TIMEOUT = 100;     // Timeout de trama a medio recibir
 const unsigned long HEARTBEAT_INTERVAL = 5000; // Intervalo de "latido" (opcional)
 
-// Comandos del protocolo
+// Comandos del protocolo antiguo
 const char CMD_ACTIVATE = 'A';  // Activar servo
 const char CMD_RESET = 'R';     // Reset a posición inicial
 const char CMD_STATUS = 'S';    // Solicitar estado
 
-// Respuestas
+// Respuestas del protocolo antiguo
 const char RESP_DONE = 'D';     // Secuencia completada
 const char RESP_OK = 'K';       // Comando OK
 const char RESP_ERROR = 'E';    // Error
 
+// Protocolo de tramas
+const byte SYNC = 0xA5;
+const byte OP_ACTIVATE = 0x01;
+const byte OP_RESET = 0x02;
+const byte OP_STATUS = 0x03;
+const byte OP_SET_BAUD = 0x04;
+const byte OP_ACK = 0x80;
+const byte OP_DONE = 0x81;
+const byte OP_NACK = 0x82;
+const byte OP_LOG = 0x83;
+
+const byte NACK_CRC = 1;
+const byte NACK_UNKNOWN_OP = 2;
+const byte NACK_QUEUE_FULL = 3;
+const byte NACK_BAD_PAYLOAD = 4;
+
+const byte MAX_PAYLOAD = 64;
+
 // Estados
 enum Estado {
   IDLE,
@@ -56,38 +91,87 @@ enum Estado {
   ERROR_STATE
 };
 
-Estado estadoActual = IDLE;
+// Fases del movimiento en curso
+enum Fase {
+  FASE_IR,      // Yendo al ángulo del comando
+  FASE_VOLVER   // Volviendo al ángulo de retorno (solo ACTIVATE)
+};
+
+// Movimiento encolado
+struct Movimiento {
+  byte seq;
+  bool trama;           // false = comando antiguo de un carácter
+  byte op;
+  byte angulo;
+  unsigned int esperaMs;
+  byte anguloRetorno;
+};
+
+const byte COLA_MAX = 4;
+
+// Cola y máquina de estados de cada compuerta
+struct CanalServo {
+  Servo servo;
+  Movimiento cola[COLA_MAX];
+  byte colaInicio;
+  byte colaLongitud;
+  Movimiento actual;
+  Estado estado;
+  Fase fase;
+  unsigned long inicioFase;
+  unsigned long duracionFase;
+};
+
+CanalServo canales[NUM_SERVOS];
+
+Estado estadoActual = IDLE;  // EJECUTANDO si alguna compuerta se mueve
 unsigned long lastHeartbeat = 0;
+bool ledHeartbeat = false;
+
+// Negociación de velocidad
+unsigned long baudActual = BAUD_INICIAL;
+unsigned long baudAnterior = BAUD_INICIAL;
+bool confirmacionBaud = false;
+unsigned long inicioConfirmacion = 0;
+
+// Recepción de tramas
+byte rxBuffer[4 + MAX_PAYLOAD + 1];
+byte rxLongitud = 0;
+unsigned long rxUltimoByte = 0;
 
 // ========== SETUP ==========
 void setup() {
   // Deshabilitar watchdog al inicio (por si quedó activo)
   wdt_disable();
-  
+
   // Configurar LED
   pinMode(LED_PIN, OUTPUT);
   digitalWrite(LED_PIN, LOW);
-  
-  // Inicializar serial con timeout
-  Serial.begin(9600);
-  Serial.setTimeout(SERIAL_TIMEOUT);
-  
+
+  // Inicializar serial
+  Serial.begin(BAUD_INICIAL);
+
   // Esperar estabilización del puerto serial
   delay(100);
-  
+
   // Limpiar buffer serial
   while (Serial.available() > 0) {
     Serial.read();
   }
-  
-  // Inicializar servo
-  myServo.attach(SERVO_PIN);
-  myServo.write(POS_INICIAL);
-  delay(500);  // Esperar que llegue a posición
-  
+
+  // Inicializar servos
+  for (byte i = 0; i < NUM_SERVOS; i++) {
+    canales[i].servo.attach(SERVO_PINS[i]);
+    canales[i].servo.write(POS_INICIAL);
+    canales[i].colaInicio = 0;
+    canales[i].colaLongitud = 0;
+    canales[i].estado = IDLE;
+  }
+  delay(500);  // Esperar que lleguen a posición
+
   // Habilitar watchdog (8 segundos)
   wdt_enable(WDTO_8S);
-  
+
   // Señal de inicio (3 parpadeos)
   for (int i = 0; i < 3; i++) {
     digitalWrite(LED_PIN, HIGH);
@@ -95,11 +179,11 @@ void setup() {
     digitalWrite(LED_PIN, LOW);
     delay(200);
   }
-  
+
   // Mensaje de inicio
   Serial.println("ARDUINO_READY");
   Serial.flush();
-  
+
   estadoActual = IDLE;
   lastHeartbeat = millis();
 }
@@ -108,116 +192,264 @@ void setup() {
 void loop() {
   // Resetear watchdog (mantener sistema vivo)
   wdt_reset();
-  
-  // Heartbeat opcional (para debugging)
-  unsigned long currentMillis = millis();
-  if (currentMillis - lastHeartbeat >= HEARTBEAT_INTERVAL) {
-    // Parpadeo corto cada 5 segundos
-    digitalWrite(LED_PIN, HIGH);
-    delay(50);
-    digitalWrite(LED_PIN, LOW);
-    lastHeartbeat = currentMillis;
-  }
-  
-  // Procesar comandos seriales
-  if (Serial.available() > 0) {
-    char comando = Serial.read();
-    
-    // Limpiar buffer de entrada (evitar acumulación)
-    delay(10);
-    while (Serial.available() > 0) {
-      Serial.read();
+
+  unsigned long ahora = millis();
+
+  // Heartbeat opcional (parpadeo corto cada 5 segundos, sin delay)
+  if (estadoActual == IDLE) {
+    if (!ledHeartbeat && ahora - lastHeartbeat >= HEARTBEAT_INTERVAL) {
+      ledHeartbeat = true;
+      lastHeartbeat = ahora;
+    } else if (ledHeartbeat && ahora - lastHeartbeat >= 50) {
+      ledHeartbeat = false;
+    }
+  }
+
+  // Procesar todos los bytes disponibles
+  while (Serial.available() > 0) {
+    recibirByte(Serial.read());
+  }
+
+  // Descartar tramas incompletas (byte perdido en la línea)
+  if (rxLongitud > 0 && ahora - rxUltimoByte > SERIAL_TIMEOUT) {
+    rxLongitud = 0;
+  }
+
+  // SET_BAUD sin confirmar: volver a la velocidad anterior
+  if (confirmacionBaud && ahora - inicioConfirmacion > BAUD_CONFIRM_TIMEOUT) {
+    cambiarBaudios(baudAnterior);
+    confirmacionBaud = false;
+  }
+
+  // Avanzar la máquina de estados de cada compuerta
+  estadoActual = IDLE;
+  for (byte i = 0; i < NUM_SERVOS; i++) {
+    actualizarServo(canales[i], ahora);
+    if (canales[i].estado == EJECUTANDO) {
+      estadoActual = EJECUTANDO;
+    }
+  }
+  // LED encendido durante la ejecución o el latido
+  digitalWrite(LED_PIN, estadoActual == EJECUTANDO || ledHeartbeat ? HIGH : LOW);
+}
+
+// ========== RECEPCIÓN ==========
+
+void recibirByte(byte b) {
+  rxUltimoByte = millis();
+
+  if (rxLongitud == 0) {
+    if (b == SYNC) {
+      rxBuffer[rxLongitud++] = b;
+    } else if (confirmacionBaud) {
+      // Probando velocidad nueva: un byte suelto puede ser ruido, no un comando
+    } else if (b == CMD_ACTIVATE || b == CMD_RESET || b == CMD_STATUS) {
+      procesarComando((char)b);
+    } else if (b != '\r' && b != '\n') {
+      Serial.print("ERR: Comando desconocido: ");
+      Serial.println((char)b);
+      Serial.write(RESP_ERROR);
+    }
+    return;
+  }
+
+  rxBuffer[rxLongitud++] = b;
+
+  // Cabecera completa: validar longitud
+  if (rxLongitud == 4 && rxBuffer[3] > MAX_PAYLOAD) {
+    rxLongitud = 0;
+    return;
+  }
+
+  if (rxLongitud >= 4 && rxLongitud == 4 + rxBuffer[3] + 1) {
+    byte crc = crc8(&rxBuffer[1], 3 + rxBuffer[3]);
+    if (crc == rxBuffer[rxLongitud - 1]) {
+      procesarTrama(rxBuffer[1], rxBuffer[2], &rxBuffer[4], rxBuffer[3]);
+    } else {
+      byte codigo = NACK_CRC;
+      enviarTrama(rxBuffer[1], OP_NACK, &codigo, 1);
     }
-    
-    // Procesar comando
-    procesarComando(comando);
+    rxLongitud = 0;
   }
-  
-  // Delay corto para no saturar CPU
-  delay(10);
 }
 
-// ========== FUNCIONES ==========
+// ========== PROTOCOLO DE TRAMAS ==========
+
+bool baudiosSoportados(unsigned long baud) {
+  return baud == 9600 || baud == 57600 || baud == 115200 ||
+         baud == 250000 || baud == 500000 || baud == 1000000;
+}
+
+void cambiarBaudios(unsigned long baud) {
+  Serial.flush();  // Terminar de enviar a la velocidad actual
+  Serial.end();
+  Serial.begin(baud);
+  baudActual = baud;
+  rxLongitud = 0;
+}
+
+byte crc8(const byte *datos, byte longitud) {
+  byte crc = 0;
+  for (byte i = 0; i < longitud; i++) {
+    crc ^= datos[i];
+    for (byte bit = 0; bit < 8; bit++) {
+      crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : (crc << 1);
+    }
+  }
+  return crc;
+}
+
+void enviarTrama(byte seq, byte op, const byte *payload, byte longitud) {
+  byte cabecera[4] = {SYNC, seq, op, longitud};
+  byte crc = crc8(&cabecera[1], 3);
+  for (byte i = 0; i < longitud; i++) {
+    crc ^= payload[i];
+    for (byte bit = 0; bit < 8; bit++) {
+      crc = (crc & 0x80) ? (crc << 1) ^ 0x07 : (crc << 1);
+    }
+  }
+  Serial.write(cabecera, 4);
+  if (longitud > 0) {
+    Serial.write(payload, longitud);
+  }
+  Serial.write(crc);
+}
+
+void enviarLog(bool trama, const char *texto) {
+  if (trama) {
+    enviarTrama(0, OP_LOG, (const byte *)texto, min(strlen(texto), (size_t)MAX_PAYLOAD));
+  } else {
+    Serial.println(texto);
+  }
+}
+
+// Byte de servo opcional en la posición `indice` del payload (0 si falta)
+byte servoDePayload(const byte *payload, byte longitud, byte indice) {
+  return longitud > indice ? payload[indice] : 0;
+}
+
+void procesarTrama(byte seq, byte op, const byte *payload, byte longitud) {
+  // Cualquier trama válida confirma la velocidad negociada
+  confirmacionBaud = false;
+
+  Movimiento m;
+  m.seq = seq;
+  m.trama = true;
+  m.op = op;
+  byte servo = 0;
+  byte codigo = NACK_BAD_PAYLOAD;
+
+  switch (op) {
+    case OP_ACTIVATE:
+      if (longitud == 0) {
+        m.angulo = POS_ACTIVO;
+        m.esperaMs = SERVO_DELAY;
+        m.anguloRetorno = POS_INICIAL;
+      } else if (longitud == 4 || longitud == 5) {
+        m.angulo = payload[0];
+        m.esperaMs = payload[1] | ((unsigned int)payload[2] << 8);
+        m.anguloRetorno = payload[3];
+        servo = servoDePayload(payload, longitud, 4);
+      } else {
+        enviarTrama(seq, OP_NACK, &codigo, 1);
+        return;
+      }
+      break;
+
+    case OP_RESET:
+      m.angulo = longitud > 0 ? payload[0] : POS_INICIAL;
+      m.esperaMs = SERVO_DELAY;
+      m.anguloRetorno = m.angulo;
+      servo = servoDePayload(payload, longitud, 1);
+      break;
+
+    case OP_STATUS: {
+      servo = servoDePayload(payload, longitud, 0);
+      if (servo >= NUM_SERVOS) {
+        enviarTrama(seq, OP_NACK, &codigo, 1);
+        return;
+      }
+      CanalServo &canal = canales[servo];
+      byte estado[3] = {(byte)canal.estado, (byte)canal.servo.read(), canal.colaLongitud};
+      enviarTrama(seq, OP_ACK, estado, 3);
+      return;
+    }
+
+    case OP_SET_BAUD: {
+      unsigned long baud = 0;
+      if (longitud == 4) {
+        baud = (unsigned long)payload[0] | ((unsigned long)payload[1] << 8) |
+               ((unsigned long)payload[2] << 16) | ((unsigned long)payload[3] << 24);
+      }
+      if (!baudiosSoportados(baud)) {
+        byte codigo = NACK_BAD_PAYLOAD;
+        enviarTrama(seq, OP_NACK, &codigo, 1);
+        return;
+      }
+      enviarTrama(seq, OP_ACK, NULL, 0);
+      baudAnterior = baudActual;
+      cambiarBaudios(baud);
+      confirmacionBaud = true;
+      inicioConfirmacion = millis();
+      return;
+    }
+
+    default:
+      codigo = NACK_UNKNOWN_OP;
+      enviarTrama(seq, OP_NACK, &codigo, 1);
+      return;
+  }
+
+  if (servo >= NUM_SERVOS) {
+    enviarTrama(seq, OP_NACK, &codigo, 1);
+  } else if (encolar(canales[servo], m)) {
+    enviarTrama(seq, OP_ACK, NULL, 0);
+  } else {
+    codigo = NACK_QUEUE_FULL;
+    enviarTrama(seq, OP_NACK, &codigo, 1);
+  }
+}
+
+// ========== PROTOCOLO ANTIGUO ==========
 
 void procesarComando(char cmd) {
   Serial.print("CMD_RX: ");
   Serial.println(cmd);
-  
+
+  Movimiento m;
+  m.seq = 0;
+  m.trama = false;
+
   switch (cmd) {
     case CMD_ACTIVATE:
-      if (estadoActual == IDLE) {
-        ejecutarSecuenciaServo();
-      } else {
-        Serial.println("WARN: Sistema ocupado");
-        Serial.write(RESP_ERROR);
-      }
+      m.op = OP_ACTIVATE;
+      m.angulo = POS_ACTIVO;
+      m.esperaMs = SERVO_DELAY;
+      m.anguloRetorno = POS_INICIAL;
       break;
-      
+
     case CMD_RESET:
-      resetearServo();
+      m.op = OP_RESET;
+      m.angulo = POS_INICIAL;
+      m.esperaMs = SERVO_DELAY;
+      m.anguloRetorno = POS_INICIAL;
       break;
-      
+
     case CMD_STATUS:
       enviarEstado();
-      break;
-      
-    default:
-      Serial.print("ERR: Comando desconocido: ");
-      Serial.println(cmd);
-      Serial.write(RESP_ERROR);
-      break;
+      return;
   }
-  
-  Serial.flush();
-}
 
-void ejecutarSecuenciaServo() {
-  estadoActual = EJECUTANDO;
-  digitalWrite(LED_PIN, HIGH);  // LED ON durante ejecución
-  
-  Serial.println("SERVO_START");
-  
-  // Secuencia: 0° -> 180° -> 0°
-  Serial.println("POS: 0");
-  myServo.write(POS_INICIAL);
-  wdt_reset();  // Reset watchdog durante operación larga
-  delay(SERVO_DELAY);
-  
-  Serial.println("POS: 180");
-  myServo.write(POS_ACTIVO);
-  wdt_reset();
-  delay(SERVO_DELAY);
-  
-  Serial.println("POS: 0");
-  myServo.write(POS_INICIAL);
-  wdt_reset();
-  delay(SERVO_DELAY);
-  
-  Serial.println("SERVO_DONE");
-  
-  // Enviar confirmación
-  Serial.write(RESP_DONE);
-  Serial.flush();
-  
-  digitalWrite(LED_PIN, LOW);  // LED OFF
-  estadoActual = IDLE;
-}
-
-void resetearServo() {
-  Serial.println("RESET");
-  myServo.write(POS_INICIAL);
-  delay(SERVO_DELAY);
-  estadoActual = IDLE;
-  digitalWrite(LED_PIN, LOW);
-  
-  Serial.write(RESP_OK);
-  Serial.flush();
+  if (!encolar(canales[0], m)) {
+    Serial.println("WARN: Cola llena");
+    Serial.write(RESP_ERROR);
+  }
 }
 
 void enviarEstado() {
   Serial.print("STATUS: ");
-  
-  switch (estadoActual) {
+
+  switch (canales[0].estado) {
     case IDLE:
       Serial.println("IDLE");
       break;
@@ -231,10 +463,68 @@ void enviarEstado() {
       Serial.println("DESCONOCIDO");
       break;
   }
-  
+
   Serial.print("SERVO_POS: ");
-  Serial.println(myServo.read());
-  
+  Serial.println(canales[0].servo.read());
+
   Serial.write(RESP_OK);
-  Serial.flush();
+}
+
+// ========== COLA Y SERVO ==========
+
+bool encolar(CanalServo &canal, const Movimiento &m) {
+  if (canal.colaLongitud >= COLA_MAX) {
+    return false;
+  }
+  canal.cola[(canal.colaInicio + canal.colaLongitud) % COLA_MAX] = m;
+  canal.colaLongitud++;
+  return true;
+}
+
+void actualizarServo(CanalServo &canal, unsigned long ahora) {
+  if (canal.estado != EJECUTANDO) {
+    if (canal.colaLongitud == 0) {
+      return;
+    }
+
+    // Siguiente movimiento de la cola
+    canal.actual = canal.cola[canal.colaInicio];
+    canal.colaInicio = (canal.colaInicio + 1) % COLA_MAX;
+    canal.colaLongitud--;
+
+    canal.estado = EJECUTANDO;
+
+    Movimiento &actual = canal.actual;
+    canal.servo.write(actual.angulo);
+    canal.fase = FASE_IR;
+    canal.inicioFase = ahora;
+    canal.duracionFase = actual.op == OP_ACTIVATE ? actual.esperaMs : SERVO_DELAY;
+    enviarLog(actual.trama, actual.op == OP_ACTIVATE ? "SERVO_START" : "RESET");
+    return;
+  }
+
+  if (ahora - canal.inicioFase < canal.duracionFase) {
+    return;
+  }
+
+  Movimiento &actual = canal.actual;
+  if (canal.fase == FASE_IR && actual.op == OP_ACTIVATE) {
+    canal.servo.write(actual.anguloRetorno);
+    canal.fase = FASE_VOLVER;
+    canal.inicioFase = ahora;
+    canal.duracionFase = SERVO_DELAY;
+    return;
+  }
+
+  // Movimiento terminado
+  canal.estado = IDLE;
+
+  if (actual.trama) {
+    enviarTrama(actual.seq, OP_DONE, NULL, 0);
+  } else if (actual.op == OP_ACTIVATE) {
+    Serial.println("SERVO_DONE");
+    Serial.write(RESP_DONE);
+  } else {
+    Serial.write(RESP_OK);
+  }
 }
@@ -0,0 +1,57 @@
+# benchmark_payload.py (MicroPython para Pico W)
+#
+# Coste de parsear un mensaje de detección en la Pico: ujson.loads del JSON
+# frente a payload_codec.decode del binario bin1, y la ruta rápida de
+# main_mejorado.py (payload_codec.count_valid, posiciones fijas). Mide µs
+# por mensaje y bytes asignados en el heap (presión sobre el GC).
+#
+# Uso: copiar payload_codec.py y este archivo a la Pico y ejecutar desde
+# Thonny. El lado RPi5 se mide con rpi5/benchmark_payload.py.
+
+import gc
+import struct
+import time
+import ujson
+
+import payload_codec
+
+REPETICIONES = 1000
+
+JSON_SAMPLE = (b'{"objeto":"pistachio","clase_id":0,"confianza":0.873,'
+               b'"timestamp":"2026-01-01T12:00:00.123456","captura_ts":1767268800.1234,'
+               b'"seq":48213,"bbox":[212,180,268,231],"track_id":1734,'
+               b'"llegada_ts":1767268800.6021,"velocidad_px_s":812.4,"camara":"cam0"}')
+
+BINARY_SAMPLE = struct.pack(
+    payload_codec.HEADER, payload_codec.MAGIC, payload_codec.VERSION, 0x1F, 0, 8730,
+    48213, 1734, 1767268800123, 1767268800602, 812, 212, 180, 268, 231) + b"cam0"
+
+
+def measure(name, function, data):
+    # Tiempo con el GC activo (incluye sus pausas, como en main_mejorado.py)
+    gc.collect()
+    start = time.ticks_us()
+    for _ in range(REPETICIONES):
+        function(data)
+    elapsed = time.ticks_diff(time.ticks_us(), start)
+
+    # Memoria de una sola llamada, sin recolecciones en medio
+    gc.collect()
+    gc.disable()
+    before = gc.mem_alloc()
+    function(data)
+    allocated = gc.mem_alloc() - before
+    gc.enable()
+
+    print("%-8s %4d bytes  %7.1f us/msg  %6d bytes heap/msg" % (
+        name, len(data), elapsed / REPETICIONES, allocated))
+
+
+def main():
+    print("Parseo de %d mensajes de detección" % REPETICIONES)
+    measure("json", ujson.loads, JSON_SAMPLE)
+    measure("bin1", payload_codec.decode, BINARY_SAMPLE)
+    measure("rápida", lambda msg: payload_codec.count_valid(msg, 6000), BINARY_SAMPLE)
+
+
+main()
@@ -7,6 +7,18 @@
 # 4. Heartbeat para verificar conexión
 # 5. Timeouts configurables
 # 6. Logs detallados para debugging
+# 7. Mensajes en JSON o binario compacto (payload_codec.py, copiar a la Pico),
+#    con una detección o un lote (todas las de un frame)
+# 8. Bucle cooperativo sin esperas: el callback MQTT solo escribe 'A' en el
+#    UART y anota el comando en una tabla de pendientes con plazo; las
+#    respuestas se leen a un buffer circular y se emparejan en el bucle
+#    principal, que llama a check_msg() en cada vuelta. Una ráfaga de
+#    detecciones se reenvía en milisegundos (antes: hasta 3 s por mensaje)
+# 9. Ruta rápida por mensaje: sin decodificar topic ni payload, el binario
+#    se valida leyendo posiciones fijas (payload_codec.count_valid), buffers
+#    preasignados, logs por mensaje solo con DEBUG (const: el compilador
+#    elimina el bloque) y GC en los momentos de reposo. PROFILE = 1 mide
+#    µs y bytes de heap por mensaje (resumen en el heartbeat)
 #
 # Conexiones:
 # - Pico W GP4 (Pin 6, TX) -> Level Converter LV1 -> Arduino RX
@@ -14,17 +26,20 @@
 # - Pico W 3V3 (Pin 36) -> Level Converter LV
 # - Pico W GND (Pin 38) -> Level Converter GND
 
+import gc
 import time
 import network
-import ujson
+from micropython import const
 from umqtt.simple import MQTTClient
 from machine import UART, Pin, reset
+import payload_codec
 import secrets
 
 # ========== CONFIGURACIÓN ==========
 # UART
 UART_ID = 1
-UART_BAUDRATE = 9600
+UART_BAUDRATE = 9600  # = BAUD_INICIAL del sketch (rpi5/serial_config.py); la Pico no negocia SET_BAUD
+UART_STOP_BITS = 2
 UART_TX_PIN = 4  # GP4
 UART_RX_PIN = 5  # GP5
 
@@ -34,13 +49,29 @@ QOS = 1
 
 # Umbral de confianza
 CONFIDENCE_THRESHOLD = 0.6  # 60%
+MIN_CONFIDENCE = round(CONFIDENCE_THRESHOLD * 10000)  # En la escala de bin1 (x10000)
 
 # Timeouts (milisegundos)
 WIFI_TIMEOUT = 15000
 MQTT_TIMEOUT = 10000
-ARDUINO_TIMEOUT = 3000
+ARDUINO_TIMEOUT = 3000  # Por comando, desde que el anterior terminó
 HEARTBEAT_INTERVAL = 10000
 
+# Relé no bloqueante
+MAX_EN_VUELO = 4  # Comandos 'A' sin 'D' (el sketch encola 1 en curso + COLA_MAX=4)
+MAX_EN_ESPERA = 8  # Activaciones retenidas con la tabla llena (se envían al liberar)
+RX_RING_SIZE = 256  # Buffer circular de recepción UART (bytes)
+RX_LINE_MAX = 80  # Longitud máxima de una línea de log del Arduino
+PARSE_BUDGET = 64  # Bytes del buffer procesados por vuelta del bucle
+RX_IDLE_MS = 5  # Silencio que decide una 'E' ambigua (unos 5 bytes a 9600 baudios)
+LOOP_IDLE_MS = 1  # Pausa del bucle solo cuando no hubo nada que hacer
+
+# Rendimiento (const: con 0 el compilador elimina los bloques `if DEBUG:`,
+# los textos de log ni se construyen)
+DEBUG = const(0)  # 1 = logs por mensaje y por línea del Arduino
+PROFILE = const(0)  # 1 = µs y bytes de heap por mensaje, resumen en el heartbeat
+GC_IDLE_FREE = 16384  # Con menos heap libre se recolecta en reposo, no en un mensaje
+
 # Reintentos
 MAX_RECONNECT_ATTEMPTS = 5
 RECONNECT_DELAY = 5000  # ms
@@ -55,6 +86,44 @@ mqtt_client = None
 last_heartbeat = 0
 reconnect_count = 0
 
+# Buffer circular de recepción UART
+rx_ring = bytearray(RX_RING_SIZE)
+rx_chunk = bytearray(64)
+rx_head = 0  # Siguiente byte a leer
+rx_count = 0
+rx_line = bytearray(RX_LINE_MAX)
+rx_line_len = 0
+rx_pending_e = False  # 'E' a inicio de línea: respuesta o "ERR: ..." (decide el siguiente byte)
+rx_last = 0  # ticks_ms del último byte recibido
+
+# Tabla de comandos pendientes (FIFO: el sketch responde en orden)
+pend_cmd = bytearray(MAX_EN_VUELO)
+pend_sent = [0] * MAX_EN_VUELO
+pend_deadline = [0] * MAX_EN_VUELO
+pend_head = 0
+pend_count = 0
+en_espera = 0  # Activaciones que esperan hueco en la tabla
+
+# LED sin bloqueo
+led_toggles = 0
+led_period = 0
+led_next = 0
+
+# Estadísticas del relé
+stats_enviados = 0
+stats_completados = 0
+stats_timeouts = 0
+stats_errores = 0
+stats_desbordes = 0
+stats_latencia_max = 0
+
+# Perfil por mensaje (PROFILE)
+prof_mensajes = 0
+prof_us_total = 0
+prof_us_max = 0
+prof_bytes_total = 0
+prof_gc = 0  # Mensajes durante los que saltó el GC
+
 # ========== FUNCIONES DE UTILIDAD ==========
 def log(msg, level="INFO"):
     """Imprime log con timestamp"""
@@ -79,6 +148,22 @@ def blink_success():
     time.sleep_ms(500)
     led.off()
 
+def led_signal(times=1, period_ms=100):
+    """Parpadeo sin bloquear: lo ejecuta service_led() desde el bucle"""
+    global led_toggles, led_period, led_next
+    led_toggles = times * 2
+    led_period = period_ms
+    led_next = time.ticks_ms()
+
+def service_led(now):
+    global led_toggles, led_next
+    if led_toggles and time.ticks_diff(now, led_next) >= 0:
+        led.toggle()
+        led_toggles -= 1
+        led_next = time.ticks_add(now, led_period)
+        if not led_toggles:
+            led.off()
+
 # ========== INICIALIZACIÓN UART ==========
 def init_uart():
     """Inicializa comunicación UART con Arduino"""
@@ -87,7 +172,7 @@ def init_uart():
     try:
         log("Inicializando UART...")
         uart = UART(UART_ID, baudrate=UART_BAUDRATE, tx=Pin(UART_TX_PIN), rx=Pin(UART_RX_PIN))
-        uart.init(bits=8, parity=None, stop=2)
+        uart.init(bits=8, parity=None, stop=UART_STOP_BITS)
         
         # Limpiar buffer
         time.sleep_ms(100)
@@ -112,8 +197,6 @@ def send_to_arduino(command):
     Returns:
         bool: True si se envió correctamente
     """
-    global uart
-    
     if uart is None:
         log("UART no inicializado", "ERROR")
         return False
@@ -123,44 +206,173 @@ def send_to_arduino(command):
             command = command.encode()
         
         uart.write(command)
-        log(f"Comando enviado a Arduino: {command}")
+        if DEBUG:
+            log(f"Comando enviado a Arduino: {command}", "DEBUG")
         return True
         
     except Exception as e:
         log(f"Error enviando a Arduino: {e}", "ERROR")
         return False
 
-def wait_arduino_response(expected_response=b'D', timeout_ms=ARDUINO_TIMEOUT):
-    """Espera respuesta del Arduino con timeout
+# ========== RECEPCIÓN UART Y COMANDOS PENDIENTES ==========
+def poll_uart():
+    """Copia al buffer circular lo que haya en el UART (sin esperar)
     
-    Args:
-        expected_response: Respuesta esperada (bytes)
-        timeout_ms: Timeout en milisegundos
-        
     Returns:
-        bool: True si se recibió la respuesta esperada
+        int: Bytes leídos
     """
-    global uart
-    
-    if uart is None:
-        return False
+    global rx_count, rx_last, stats_desbordes
+    
+    if uart is None or not uart.any():
+        return 0
+    n = uart.readinto(rx_chunk) or 0
+    rx_last = time.ticks_ms()
+    for i in range(n):
+        if rx_count == RX_RING_SIZE:
+            # Lleno: se pierde el byte más antiguo
+            discard_rx(1)
+            stats_desbordes += 1
+        rx_ring[(rx_head + rx_count) % RX_RING_SIZE] = rx_chunk[i]
+        rx_count += 1
+    return n
+
+def discard_rx(n):
+    global rx_head, rx_count
+    rx_head = (rx_head + n) % RX_RING_SIZE
+    rx_count -= n
+
+def parse_uart(budget=PARSE_BUDGET):
+    """Separa respuestas ('D', 'K', 'E') y líneas de log del Arduino
     
-    start_time = time.ticks_ms()
+    Como ResponseParser de rpi5/serial_channel.py: solo es respuesta un
+    byte al inicio de línea; una 'E' seguida de 'R' es el principio de
+    "ERR: ...". Procesa como mucho `budget` bytes por llamada.
+    """
+    global rx_line_len, rx_pending_e
     
-    while time.ticks_diff(time.ticks_ms(), start_time) < timeout_ms:
-        if uart.any():
-            data = uart.read()
-            if data:
-                log(f"Respuesta Arduino: {data}")
-                
-                if expected_response in data:
-                    log("✓ Respuesta correcta recibida")
-                    return True
+    while rx_count and budget:
+        byte = rx_ring[rx_head]
+        discard_rx(1)
+        budget -= 1
+        
+        if rx_pending_e:
+            rx_pending_e = False
+            if byte == 0x52:  # 'R'
+                rx_line[0] = 0x45
+                rx_line[1] = 0x52
+                rx_line_len = 2
+                continue
+            on_response(0x45)
+        
+        if rx_line_len == 0:
+            if byte in (0x44, 0x4B):  # 'D', 'K'
+                on_response(byte)
+                continue
+            if byte == 0x45:  # 'E'
+                rx_pending_e = True
+                continue
+            if byte in (0x0D, 0x0A):
+                continue
         
-        time.sleep_ms(50)
+        if byte == 0x0A:
+            if DEBUG:
+                log(f"Arduino: {bytes(rx_line[:rx_line_len]).decode().rstrip()}", "DEBUG")
+            rx_line_len = 0
+        elif rx_line_len < RX_LINE_MAX:
+            rx_line[rx_line_len] = byte
+            rx_line_len += 1
+
+def uart_idle(now):
+    """UART en silencio: una 'E' pendiente era una respuesta"""
+    global rx_pending_e
+    if rx_pending_e and not rx_count and time.ticks_diff(now, rx_last) >= RX_IDLE_MS:
+        rx_pending_e = False
+        on_response(0x45)
+
+def on_response(byte):
+    """Empareja una respuesta del Arduino con la tabla de pendientes"""
+    global stats_completados, stats_errores, stats_latencia_max
     
-    log(f"⚠ Timeout esperando respuesta de Arduino ({timeout_ms}ms)", "WARN")
-    return False
+    if byte == 0x44:  # 'D': terminó el comando más antiguo
+        if not pend_count:
+            log("Respuesta 'D' sin comando pendiente", "WARN")
+            return
+        latencia = time.ticks_diff(time.ticks_ms(), pend_sent[pend_head])
+        stats_latencia_max = max(stats_latencia_max, latencia)
+        pop_pending()
+        stats_completados += 1
+        if DEBUG:
+            log(f"✓ Arduino completó secuencia ({latencia}ms, {pend_count} pendientes)", "DEBUG")
+        led_signal(1, 250)
+    elif byte == 0x45:  # 'E': rechazo inmediato (cola llena), es el último enviado
+        stats_errores += 1
+        if pend_count:
+            drop_newest_pending()
+        log("✗ Arduino rechazó el comando", "ERROR")
+        led_signal(3, 100)
+    elif DEBUG:
+        log(f"Respuesta Arduino: {chr(byte)}", "DEBUG")
+
+def push_pending(cmd, now):
+    global pend_count
+    i = (pend_head + pend_count) % MAX_EN_VUELO
+    pend_cmd[i] = cmd
+    pend_sent[i] = now
+    # Plazo desde que el sketch empiece este comando (ver pop_pending)
+    pend_deadline[i] = time.ticks_add(now, ARDUINO_TIMEOUT)
+    pend_count += 1
+
+def pop_pending():
+    """Libera el comando más antiguo y da su plazo completo al siguiente"""
+    global pend_head, pend_count
+    pend_head = (pend_head + 1) % MAX_EN_VUELO
+    pend_count -= 1
+    if pend_count:
+        pend_deadline[pend_head] = time.ticks_add(time.ticks_ms(), ARDUINO_TIMEOUT)
+    flush_waiting()
+
+def drop_newest_pending():
+    global pend_count
+    pend_count -= 1
+
+def check_pending(now):
+    """Vence el comando más antiguo si el Arduino no respondió a tiempo"""
+    global stats_timeouts
+    if pend_count and time.ticks_diff(now, pend_deadline[pend_head]) >= 0:
+        stats_timeouts += 1
+        log(f"⚠ Timeout esperando respuesta de Arduino ({ARDUINO_TIMEOUT}ms)", "WARN")
+        led_signal(3, 100)
+        pop_pending()
+
+def relay_activation():
+    """Envía 'A' sin esperar el 'D' (o lo retiene si la tabla está llena)"""
+    global en_espera
+    if pend_count >= MAX_EN_VUELO:
+        if en_espera < MAX_EN_ESPERA:
+            en_espera += 1
+            log(f"Tabla llena: activación en espera ({en_espera})", "WARN")
+        else:
+            log("Tabla y espera llenas: activación descartada", "WARN")
+        return False
+    return send_activation()
+
+def send_activation():
+    global stats_enviados
+    if not send_to_arduino(b'A'):
+        led_signal(3, 100)
+        return False
+    push_pending(0x41, time.ticks_ms())
+    stats_enviados += 1
+    led_signal(2, 50)  # Parpadeo de confirmación
+    return True
+
+def flush_waiting():
+    """Envía las activaciones retenidas mientras haya hueco"""
+    global en_espera
+    while en_espera and pend_count < MAX_EN_VUELO:
+        en_espera -= 1
+        if not send_activation():
+            break
 
 # ========== CONEXIÓN WIFI ==========
 def connect_wifi():
@@ -225,6 +437,10 @@ def connect_mqtt():
             keepalive=60
         )
         
+        # Anuncio de formatos: lo borra el broker si la Pico se cae
+        formats_topic = payload_codec.FORMATS_TOPIC + b"/" + client_id
+        mqtt_client.set_last_will(formats_topic, b"", retain=True, qos=1)
+        
         mqtt_client.set_callback(mqtt_callback)
         mqtt_client.connect()
         
@@ -234,6 +450,9 @@ def connect_mqtt():
         mqtt_client.subscribe(TOPIC_DETECCION)
         log(f"Suscrito a: {TOPIC_DETECCION}")
         
+        # La Pico entiende JSON y binario: el detector puede usar bin1
+        mqtt_client.publish(formats_topic, payload_codec.FORMATS_ANNOUNCEMENT, retain=True)
+        
         blink_success()
         return mqtt_client
         
@@ -244,72 +463,66 @@ def connect_mqtt():
 
 # ========== CALLBACK MQTT ==========
 def mqtt_callback(topic, msg):
-    """Procesa mensajes MQTT recibidos
+    """Procesa mensajes MQTT recibidos (ruta rápida, sin esperar al Arduino)
     
     Args:
         topic: Topic del mensaje (bytes)
         msg: Payload del mensaje (bytes)
     """
+    if PROFILE:
+        inicio = time.ticks_us()
+        heap = gc.mem_free()
+    
     try:
-        log(f"\n{'='*40}")
-        log(f"Mensaje MQTT recibido")
-        log(f"Topic: {topic.decode()}")
-        log(f"Payload: {msg.decode()}")
-        
-        # Parsear JSON
-        payload = ujson.loads(msg)
+        # Una detección o un lote (JSON o bin1): pistachos con confianza
+        # suficiente, leyendo el binario en posiciones fijas
+        validos, total = payload_codec.count_valid(msg, MIN_CONFIDENCE)
+        if DEBUG:
+            log(f"MQTT {topic.decode()} ({len(msg)} bytes): "
+                f"{validos} de {total} detecciones válidas", "DEBUG")
         
-        # Validar estructura
-        if 'objeto' not in payload or 'confianza' not in payload:
-            log("Payload sin campos requeridos", "WARN")
-            return
-        
-        objeto = payload['objeto']
-        confianza = float(payload['confianza'])
-        
-        log(f"Objeto: {objeto}")
-        log(f"Confianza: {confianza:.2%}")
-        
-        # VALIDACIÓN DE UMBRAL
-        if confianza < CONFIDENCE_THRESHOLD:
-            log(f"⚠ Confianza {confianza:.2%} < {CONFIDENCE_THRESHOLD:.0%} - IGNORADO", "WARN")
-            return
-        
-        # VALIDACIÓN DE CLASE
-        if "pistachio" not in objeto.lower():
-            log(f"Objeto '{objeto}' no es pistacho - IGNORADO")
-            return
-        
-        # ACTIVAR ARDUINO
-        log(f"🎯 PISTACHO VÁLIDO detectado ({confianza:.2%})")
-        log("Enviando comando ACTIVATE al Arduino...")
-        
-        if send_to_arduino(b'A'):
-            blink_led(2, 100)  # Parpadeo de confirmación
-            
-            # Esperar respuesta
-            if wait_arduino_response(b'D', ARDUINO_TIMEOUT):
-                log("✓ Arduino completó secuencia exitosamente")
-                blink_success()
-            else:
-                log("✗ Arduino no respondió", "ERROR")
-                blink_error()
-        else:
-            log("✗ Error enviando comando a Arduino", "ERROR")
-            blink_error()
-        
-        log(f"{'='*40}\n")
+        # ACTIVAR ARDUINO: un solo barrido por mensaje (los pistachos de un
+        # mismo frame pasan juntos por la compuerta). Sin esperar el 'D':
+        # lo empareja parse_uart() desde el bucle principal
+        if validos:
+            relay_activation()
         
     except ValueError as e:
-        log(f"Error parseando JSON: {e}", "ERROR")
+        log(f"Error decodificando mensaje: {e}", "ERROR")
     except Exception as e:
         log(f"Error en callback: {e}", "ERROR")
-        blink_error()
+        led_signal(3, 100)
+    
+    if PROFILE:
+        profile_record(time.ticks_diff(time.ticks_us(), inicio), heap - gc.mem_free())
+
+# ========== PERFIL ==========
+def profile_record(us, allocated):
+    """Acumula el coste de un mensaje (allocated < 0: el GC saltó en medio)"""
+    global prof_mensajes, prof_us_total, prof_us_max, prof_bytes_total, prof_gc
+    prof_mensajes += 1
+    prof_us_total += us
+    prof_us_max = max(prof_us_max, us)
+    if allocated < 0:
+        prof_gc += 1
+    else:
+        prof_bytes_total += allocated
+
+def profile_report():
+    """Resumen desde el último informe y reinicio de los contadores"""
+    global prof_mensajes, prof_us_total, prof_us_max, prof_bytes_total, prof_gc
+    if not prof_mensajes:
+        return
+    medidos = prof_mensajes - prof_gc
+    log(f"Perfil: {prof_mensajes} mensajes, {prof_us_total // prof_mensajes}us media, "
+        f"{prof_us_max}us máx, {prof_bytes_total // medidos if medidos else 0} bytes/msg, "
+        f"GC en {prof_gc}, heap libre {gc.mem_free()}")
+    prof_mensajes = prof_us_total = prof_us_max = prof_bytes_total = prof_gc = 0
 
 # ========== HEARTBEAT ==========
 def check_heartbeat():
     """Verifica conexiones periódicamente"""
-    global last_heartbeat, wlan, mqtt_client
+    global last_heartbeat, mqtt_client
     
     current_time = time.ticks_ms()
     
@@ -332,15 +545,23 @@ def check_heartbeat():
             if mqtt_client is None:
                 return False
         
+        log(f"Relé: {stats_enviados} enviados, {stats_completados} completados, "
+            f"{stats_timeouts} timeouts, {stats_errores} rechazos, {pend_count} pendientes, "
+            f"{en_espera} en espera, latencia máx {stats_latencia_max}ms, "
+            f"{stats_desbordes} bytes UART perdidos")
+        
+        if PROFILE:
+            profile_report()
+        
         last_heartbeat = current_time
-        blink_led(1, 50)  # Parpadeo corto de heartbeat
+        led_signal(1, 50)  # Parpadeo corto de heartbeat
     
     return True
 
 # ========== LOOP PRINCIPAL ==========
 def main():
     """Función principal del sistema"""
-    global mqtt_client, wlan, last_heartbeat, reconnect_count
+    global mqtt_client, last_heartbeat
     
     log("="*50)
     log("Sistema Pico W - Control de Servo con IA")
@@ -383,7 +604,7 @@ def main():
                 time.sleep_ms(RECONNECT_DELAY)
                 continue
             
-            # Procesar mensajes MQTT
+            # Procesar mensajes MQTT (en cada vuelta: nunca queda sin atender)
             if mqtt_client:
                 try:
                     mqtt_client.check_msg()
@@ -391,8 +612,20 @@ def main():
                     log(f"Error MQTT: {e}", "ERROR")
                     mqtt_client = connect_mqtt()
             
-            # Delay corto
-            time.sleep_ms(100)
+            # Respuestas del Arduino, plazos y LED
+            leidos = poll_uart()
+            parse_uart()
+            now = time.ticks_ms()
+            uart_idle(now)
+            check_pending(now)
+            service_led(now)
+            
+            # Pausa mínima solo si no quedó nada por procesar; el GC se
+            # adelanta aquí para que no salte dentro de un mensaje
+            if not leidos and not rx_count:
+                if gc.mem_free() < GC_IDLE_FREE:
+                    gc.collect()
+                time.sleep_ms(LOOP_IDLE_MS)
             
         except KeyboardInterrupt:
             log("\n⚠ Interrupción por usuario")
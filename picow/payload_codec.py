@@ -0,0 +1,139 @@
+# payload_codec.py (MicroPython para Pico W)
+#
+# Decodificador de los mensajes de detección: binario compacto "bin1" o JSON.
+# Mismo formato que rpi5/payload_codec.py (ver allí la descripción completa);
+# aquí solo se decodifica, sin asignaciones innecesarias:
+#
+#   MAGIC (0xD7) | VERSIÓN (1) | FLAGS u8 | CLASE u8 | CONFIANZA u16 (x10000)
+#   | SEQ u32 | TRACK u32 | CAPTURA_MS u64 | LLEGADA_MS u64 | VELOCIDAD i16
+#   | BBOX 4 x u16 | CÁMARA (utf-8, resto del mensaje)
+#
+# Lote (todas las detecciones de un frame en un mensaje):
+#
+#   MAGIC_LOTE (0xD8) | VERSIÓN | N u8 | N cabeceras de 40 bytes | CÁMARA
+#
+# o en JSON {"detecciones": [...]}.
+#
+# Copiar a la Pico junto a main_mejorado.py.
+
+import struct
+import ujson
+from micropython import const
+
+MAGIC = const(0xD7)
+MAGIC_LOTE = const(0xD8)
+VERSION = const(1)
+
+FORMATS_TOPIC = b"robot/formatos"  # Anuncio retenido: FORMATS_TOPIC/<cliente>
+FORMATS_ANNOUNCEMENT = b"bin1,json"
+
+HEADER = '<BBBBHIIQQh4H'
+HEADER_SIZE = const(40)
+BATCH_HEADER_SIZE = const(3)
+BATCH_KEY = "detecciones"
+
+FLAG_PISTACHIO = const(0x01)
+FLAG_TRACK = const(0x02)
+FLAG_LLEGADA = const(0x04)
+
+
+def _decode_record(msg, offset):
+    # Solo los campos que usa la Pico (objeto, confianza, seq, track_id, llegada)
+    if msg[offset] != MAGIC:
+        raise ValueError("Formato de mensaje desconocido")
+    if msg[offset + 1] != VERSION:
+        raise ValueError("Versión de formato no soportada: %d" % msg[offset + 1])
+
+    flags = msg[offset + 2]
+    confidence, seq, track_id = struct.unpack_from('<HII', msg, offset + 4)
+    payload = {
+        "objeto": "pistachio" if flags & FLAG_PISTACHIO else "clase_%d" % msg[offset + 3],
+        "confianza": confidence / 10000,
+        "seq": seq,
+    }
+    if flags & FLAG_TRACK:
+        payload["track_id"] = track_id
+    if flags & FLAG_LLEGADA:
+        # Epoch en ms como entero: el float de la Pico (32 bits) no tiene precisión
+        payload["llegada_ms"] = struct.unpack_from('<Q', msg, offset + 22)[0]
+    return payload
+
+
+def decode(msg):
+    """Mensaje MQTT (bytes) -> dict con las claves del JSON
+
+    Del binario solo se extraen los campos que usa la Pico (objeto,
+    confianza, seq, track_id, llegada_ms).
+
+    Raises:
+        ValueError: Mensaje que no es JSON ni bin1 válido
+    """
+    if not msg:
+        raise ValueError("Mensaje vacío")
+    if msg[0] == 0x7B:  # '{'
+        return ujson.loads(msg)
+    if len(msg) < HEADER_SIZE:
+        raise ValueError("Formato de mensaje desconocido")
+    return _decode_record(msg, 0)
+
+
+def decode_detections(msg):
+    """Mensaje MQTT (detección suelta o lote) -> lista de dicts
+
+    Raises:
+        ValueError: Mensaje que no es JSON ni bin1 válido
+    """
+    if msg and msg[0] == MAGIC_LOTE:
+        if len(msg) < BATCH_HEADER_SIZE or msg[1] != VERSION:
+            raise ValueError("Lote binario no soportado")
+        end = BATCH_HEADER_SIZE + msg[2] * HEADER_SIZE
+        if len(msg) < end:
+            raise ValueError("Lote binario incompleto")
+        return [_decode_record(msg, offset)
+                for offset in range(BATCH_HEADER_SIZE, end, HEADER_SIZE)]
+    payload = decode(msg)
+    if BATCH_KEY in payload:
+        return payload[BATCH_KEY]
+    return [payload]
+
+
+def count_valid(msg, min_confidence):
+    """Pistachos con confianza >= min_confidence en un mensaje (ruta rápida)
+
+    En binario lee FLAGS y CONFIANZA en posiciones fijas de cada cabecera,
+    sin crear dicts ni floats: no asigna memoria en el heap. min_confidence
+    va en la escala del formato (x10000, entero). Un JSON pasa por
+    decode_detections().
+
+    Returns:
+        tuple: (pistachos válidos, detecciones en el mensaje)
+
+    Raises:
+        ValueError: Mensaje que no es JSON ni bin1 válido
+    """
+    n = len(msg)
+    if n >= HEADER_SIZE and msg[0] == MAGIC:
+        start = 0
+        end = HEADER_SIZE
+    elif n >= BATCH_HEADER_SIZE and msg[0] == MAGIC_LOTE:
+        start = BATCH_HEADER_SIZE
+        end = BATCH_HEADER_SIZE + msg[2] * HEADER_SIZE
+        if msg[1] != VERSION or n < end:
+            raise ValueError("Lote binario no soportado")
+    else:
+        valid = 0
+        detections = decode_detections(msg)
+        for payload in detections:
+            if ("pistachio" in payload.get("objeto", "").lower()
+                    and payload.get("confianza", 0) * 10000 >= min_confidence):
+                valid += 1
+        return valid, len(detections)
+
+    valid = 0
+    for offset in range(start, end, HEADER_SIZE):
+        if msg[offset] != MAGIC or msg[offset + 1] != VERSION:
+            raise ValueError("Formato de mensaje desconocido")
+        if (msg[offset + 2] & FLAG_PISTACHIO
+                and (msg[offset + 4] | msg[offset + 5] << 8) >= min_confidence):
+            valid += 1
+    return valid, (end - start) // HEADER_SIZE
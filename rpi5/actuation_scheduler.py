@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+actuation_scheduler.py
+Cola de activaciones de una compuerta
+
+Sustituye al cooldown fijo (que descartaba todo pistacho llegado en los 5 s
+siguientes a un movimiento) por una cola que avanza al ritmo real del servo:
+- Si el servo está libre, la activación se envía en el acto
+- Si está moviéndose, la activación se encola y se envía en cuanto el
+  Arduino responde DONE (SERVO_DONE) al movimiento anterior
+- Activaciones solapadas se agrupan: si la compuerta ya está abierta (o
+  hay una activación en cola) para un instante a menos de `coalesce`
+  segundos, ese barrido desvía también el nuevo pistacho
+- Con la cola llena, o si una activación espera más de `max_wait` (el
+  pistacho ya pasó la compuerta), se descarta y se cuenta
+"""
+
+import logging
+import threading
+import time
+from collections import deque, namedtuple
+
+logger = logging.getLogger(__name__)
+
+# Resultado de trigger()
+EXECUTED = "ejecutada"
+QUEUED = "encolada"
+COALESCED = "agrupada"
+DROPPED = "descartada"
+
+Trigger = namedtuple('Trigger', ['time', 'confidence', 'track_id'])
+
+
+class ActuationScheduler:
+    """Serializa las activaciones de un servo sobre su confirmación DONE"""
+
+    def __init__(self, name, fire, queue_size=8, coalesce=0.5, max_wait=2.0, on_idle=None):
+        """
+        Args:
+            name: Nombre para logs
+            fire: Función trigger -> Future que envía la activación; el Future
+                  se completa cuando el servo termina (DONE), falla o expira
+            queue_size: Activaciones en espera como máximo
+            coalesce: Segundos en los que un barrido cubre a otro pistacho
+                      (tiempo que la compuerta permanece abierta)
+            max_wait: Segundos máximos en cola antes de descartar
+            on_idle: Función sin argumentos llamada cuando el servo queda
+                     libre y la cola vacía
+        """
+        self.name = name
+        self._fire = fire
+        self.queue_size = queue_size
+        self.coalesce = coalesce
+        self.max_wait = max_wait
+        self._on_idle = on_idle
+
+        self._lock = threading.Lock()
+        self._queue = deque()
+        self._current = None  # Trigger en ejecución (None = servo libre)
+
+        # Estadísticas
+        self.executed = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.max_queue_wait = 0.0
+
+    def trigger(self, confidence=None, track_id=None):
+        """Pide una activación sin bloquear
+
+        Returns:
+            str: EXECUTED, QUEUED, COALESCED o DROPPED
+        """
+        trigger = Trigger(time.monotonic(), confidence, track_id)
+        with self._lock:
+            if self._current is not None:
+                return self._enqueue(trigger)
+            self._current = trigger
+            self.executed += 1
+        self._start(trigger)
+        return EXECUTED
+
+    def _enqueue(self, trigger):
+        # Con el lock tomado
+        last = self._queue[-1] if self._queue else self._current
+        if trigger.time - last.time <= self.coalesce:
+            self.coalesced += 1
+            return COALESCED
+        if len(self._queue) >= self.queue_size:
+            self.dropped += 1
+            return DROPPED
+        self._queue.append(trigger)
+        self.max_depth = max(self.max_depth, len(self._queue))
+        return QUEUED
+
+    def _start(self, trigger):
+        # Fuera del lock: si el canal está detenido el Future ya viene
+        # completado y el callback se ejecuta aquí mismo
+        try:
+            future = self._fire(trigger)
+        except Exception as e:
+            logger.error(f"[{self.name}] Error enviando activación: {e}")
+            self._on_done(None)
+            return
+        future.add_done_callback(self._on_done)
+
+    def _on_done(self, future):
+        """Servo libre (DONE, NACK o timeout): enviar la siguiente activación"""
+        now = time.monotonic()
+        with self._lock:
+            trigger = None
+            while self._queue:
+                candidate = self._queue.popleft()
+                waited = now - candidate.time
+                if waited <= self.max_wait:
+                    trigger = candidate
+                    self.max_queue_wait = max(self.max_queue_wait, waited)
+                    break
+                self.dropped += 1
+                logger.warning(f"[{self.name}] Activación descartada tras "
+                               f"{waited:.1f}s en cola (el pistacho ya pasó)")
+            self._current = trigger
+            if trigger is not None:
+                self.executed += 1
+        if trigger is not None:
+            self._start(trigger)
+        elif self._on_idle:
+            self._on_idle()
+
+    def depth(self):
+        """Activaciones en espera (sin contar la que se está ejecutando)"""
+        with self._lock:
+            return len(self._queue)
+
+    def busy(self):
+        """True si el servo está moviéndose o hay activaciones en cola"""
+        with self._lock:
+            return self._current is not None
+
+    def summary(self):
+        with self._lock:
+            return {
+                'ejecutadas': self.executed,
+                'agrupadas': self.coalesced,
+                'descartadas': self.dropped,
+                'en_cola': len(self._queue),
+                'cola_max': self.max_depth,
+                'espera_max_ms': round(self.max_queue_wait * 1000, 1),
+            }
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+actuators.py
+Registro de actuadores (compuertas desviadoras) del controlador
+
+Cada actuador es un servo con su propio estado (cola de activaciones,
+última detección) y su propio carril de comandos. Puede tener un puerto serie propio o ser un
+servo más de un Arduino compartido (byte de servo del protocolo de tramas):
+los comandos de cada actuador viajan en su carril, así que una compuerta
+lenta no retiene a las demás, y los puertos distintos tienen hilos de E/S
+independientes.
+
+Vuelta a reposo sin polling: cada detección mueve el vencimiento de 'sin
+detección' y un temporizador (DeadlineScheduler) despierta solo en ese
+instante. Si al vencer quedan activaciones pendientes, el reset se hace
+cuando la cola de activaciones se vacía.
+
+Enrutado de mensajes MQTT:
+- Por topic: cada actuador escucha uno o varios topics
+- Por carril: si el actuador tiene `lane`, solo atiende los mensajes cuyo
+  campo "carril" (o "camara", si no hay carril) coincide
+"""
+
+import logging
+import threading
+import time
+
+import actuation_scheduler
+import arduino_protocol as proto
+from actuation_scheduler import ActuationScheduler
+from serial_channel import SerialTimeout
+
+logger = logging.getLogger(__name__)
+
+# Comandos (protocolo de un carácter; en tramas se traducen a opcodes)
+CMD_ACTIVATE = b'A'  # Mover a 180° (pistacho detectado)
+CMD_RESET = b'R'     # Mover a 0° (sin detección)
+CMD_STATUS = b'S'
+
+# Estados de la vuelta a reposo
+STATE_REST = "REPOSO"              # En reposo, sin temporizador
+STATE_DETECTING = "DETECTANDO"     # Hay detecciones; temporizador armado
+STATE_RESET_PENDING = "RESET_PENDIENTE"  # Venció con activaciones en curso
+
+
+class Actuator:
+    """Una compuerta: canal serie, servo y estado propios"""
+
+    def __init__(self, name, channel, servo=0, topics=(), lane=None,
+                 angle_active=180, angle_rest=0, hold_ms=500, queue_size=8, max_wait=2.0,
+                 timer=None, no_detection_timeout=5.0):
+        """
+        Args:
+            name: Nombre para logs y estadísticas
+            channel: SerialChannel o FramedSerialChannel, o sus equivalentes
+                     asyncio (compartible entre actuadores del mismo
+                     Arduino solo con tramas)
+            servo: Índice del servo en el Arduino
+            topics: Topics MQTT que atiende
+            lane: Clave de carril/cámara (None = todos los mensajes de sus topics)
+            angle_active, angle_rest, hold_ms: Parámetros del movimiento (solo tramas)
+            queue_size: Activaciones en espera mientras el servo se mueve
+            max_wait: Segundos máximos de una activación en cola
+            timer: DeadlineScheduler (o cualquier objeto con call_at sobre
+                   time.monotonic()) para la vuelta a reposo (None = sin reset
+                   automático)
+            no_detection_timeout: Segundos sin detección antes del reset
+        """
+        self.name = name
+        self.channel = channel
+        self.servo = servo
+        self.topics = tuple(topics)
+        self.lane = lane
+        self.angle_active = angle_active
+        self.angle_rest = angle_rest
+        self.hold_ms = hold_ms
+        self.framed = channel.framed
+
+        if servo and not self.framed:
+            raise ValueError(f"{name}: el protocolo de texto solo controla el servo 0")
+
+        self.timer = timer
+        self.no_detection_timeout = no_detection_timeout
+
+        # Máquina de estados de la vuelta a reposo (protegida por _lock)
+        self._lock = threading.Lock()
+        self.state = STATE_REST
+        self._reset_deadline = 0.0
+        self._reset_call = None
+
+        # Una activación por movimiento del servo; las solapadas con la
+        # compuerta abierta (hold_ms) se agrupan en el mismo barrido
+        self.scheduler = ActuationScheduler(
+            name, lambda trigger: self.send(CMD_ACTIVATE),
+            queue_size=queue_size, coalesce=hold_ms / 1000, max_wait=max_wait,
+            on_idle=self._on_idle)
+
+        # Estadísticas
+        self.failures = 0
+
+    def matches(self, topic, data):
+        """True si el mensaje (topic, payload ya parseado) va para este actuador"""
+        if topic not in self.topics:
+            return False
+        if self.lane is None:
+            return True
+        return str(data.get('carril', data.get('camara'))) == str(self.lane)
+
+    def send(self, command):
+        """Encola un comando sin esperar la respuesta
+
+        Returns:
+            Future: True si el Arduino confirmó, False si lo rechazó
+        """
+        if self.framed:
+            future = self.channel.submit(*self._frame(command), lane=self.servo)
+        else:
+            future = self.channel.submit(command)
+        future.add_done_callback(lambda f: self._log_result(command, f))
+        return future
+
+    def _frame(self, command):
+        """Traduce un comando de un carácter a (opcode, payload) del protocolo de tramas"""
+        if command == CMD_ACTIVATE:
+            return proto.OP_ACTIVATE, proto.encode_activate(
+                self.angle_active, self.hold_ms, self.angle_rest, self.servo)
+        if command == CMD_RESET:
+            return proto.OP_RESET, proto.encode_reset(self.angle_rest, self.servo)
+        return proto.OP_STATUS, proto.encode_status(self.servo)
+
+    def _log_result(self, command, future):
+        """Registra el resultado de un comando (se ejecuta en el hilo del canal)"""
+        try:
+            if future.result():
+                if command == CMD_ACTIVATE:
+                    logger.info(f"✓ [{self.name}] Arduino completó secuencia ACTIVATE "
+                                f"({self.angle_active}°)")
+                elif command == CMD_RESET:
+                    logger.info(f"✓ [{self.name}] Arduino completó RESET ({self.angle_rest}°)")
+            else:
+                self.failures += 1
+                logger.warning(f"[{self.name}] Arduino rechazó el comando {command}")
+        except SerialTimeout as e:
+            self.failures += 1
+            logger.warning(f"[{self.name}] Arduino no respondió como esperado: {e}")
+        except Exception as e:
+            self.failures += 1
+            logger.error(f"[{self.name}] Error enviando comando: {e}")
+
+    def detection(self):
+        """Registra una detección válida (aplaza la vuelta a reposo)
+
+        Solo actualiza el vencimiento: el temporizador armado se reprograma
+        al despertar, así que una ráfaga de detecciones no llena la cola del
+        temporizador de llamadas canceladas.
+        """
+        if self.timer is None:
+            return
+        with self._lock:
+            self._reset_deadline = time.monotonic() + self.no_detection_timeout
+            self.state = STATE_DETECTING
+            if self._reset_call is None:
+                self._reset_call = self.timer.call_at(self._reset_deadline, self._on_deadline)
+
+    def _on_deadline(self):
+        """Vencimiento del temporizador (hilo del DeadlineScheduler)"""
+        with self._lock:
+            self._reset_call = None
+            if self.state != STATE_DETECTING:
+                return
+            if time.monotonic() < self._reset_deadline:
+                # Hubo detecciones después de armarlo: dormir hasta el nuevo vencimiento
+                self._reset_call = self.timer.call_at(self._reset_deadline, self._on_deadline)
+                return
+            if self.scheduler.busy():
+                # No cerrar la compuerta con activaciones pendientes: _on_idle
+                self.state = STATE_RESET_PENDING
+                return
+            self.state = STATE_REST
+
+        logger.info(f"⏱ [{self.name}] {self.no_detection_timeout}s sin detección - "
+                    f"Reseteando servo")
+        self.reset()
+
+    def _on_idle(self):
+        """Cola de activaciones vacía (hilo del canal serie)"""
+        with self._lock:
+            if self.state != STATE_RESET_PENDING:
+                return
+            self.state = STATE_REST
+
+        logger.info(f"⏱ [{self.name}] Activaciones terminadas tras {self.no_detection_timeout}s "
+                    f"sin detección - Reseteando servo")
+        self.reset()
+
+    def activate(self, confidence, track_id=None):
+        """Pide una activación; si el servo está ocupado se encola o se agrupa
+
+        Returns:
+            str: Resultado de ActuationScheduler.trigger()
+        """
+        track_text = f" track #{track_id}" if track_id is not None else ""
+        result = self.scheduler.trigger(confidence, track_id)
+
+        if result == actuation_scheduler.EXECUTED:
+            logger.info(f"🎯 [{self.name}] PISTACHO VÁLIDO ({confidence:.2%}){track_text} "
+                        f"- Activando servo")
+        elif result == actuation_scheduler.QUEUED:
+            logger.info(f"⏳ [{self.name}] Servo ocupado{track_text} - activación en cola "
+                        f"(en cola: {self.scheduler.depth()})")
+        elif result == actuation_scheduler.COALESCED:
+            logger.info(f"🔗 [{self.name}] Agrupado con la activación anterior{track_text}")
+        else:
+            logger.warning(f"[{self.name}] Cola de activaciones llena{track_text} - DESCARTADO")
+        return result
+
+    def reset(self):
+        """Mueve la compuerta a reposo"""
+        logger.info(f"⏸ [{self.name}] SIN DETECCIÓN → Moviendo servo a {self.angle_rest}°")
+        return self.send(CMD_RESET)
+
+    def cancel_reset(self):
+        """Desarma la vuelta a reposo automática (al cerrar)"""
+        with self._lock:
+            if self._reset_call is not None:
+                self._reset_call.cancel()
+                self._reset_call = None
+            self.state = STATE_REST
+
+    def summary(self):
+        return dict(self.scheduler.summary(), fallos=self.failures)
+
+
+class ActuatorRegistry:
+    """Conjunto de actuadores y enrutado de mensajes hacia ellos"""
+
+    def __init__(self):
+        self.actuators = []
+
+    def add(self, actuator):
+        if any(a.name == actuator.name for a in self.actuators):
+            raise ValueError(f"Actuador duplicado: {actuator.name}")
+        self.actuators.append(actuator)
+        return actuator
+
+    def __iter__(self):
+        return iter(self.actuators)
+
+    def __len__(self):
+        return len(self.actuators)
+
+    def topics(self):
+        """Topics MQTT a los que hay que suscribirse"""
+        return sorted({topic for actuator in self.actuators for topic in actuator.topics})
+
+    def route(self, topic, data):
+        """Actuadores a los que va un mensaje"""
+        return [actuator for actuator in self.actuators if actuator.matches(topic, data)]
+
+    def channels(self):
+        """Canales serie distintos (un Arduino puede servir a varios actuadores)"""
+        unique = []
+        for actuator in self.actuators:
+            if all(actuator.channel is not channel for channel in unique):
+                unique.append(actuator.channel)
+        return unique
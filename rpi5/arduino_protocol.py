@@ -0,0 +1,223 @@
+#!/usr/bin/env python3
+"""
+arduino_protocol.py
+Protocolo de tramas binarias RPi5 <-> Arduino
+
+Formato de trama:
+
+    SYNC (0xA5) | SEQ | OP | LEN | PAYLOAD (LEN bytes) | CRC8
+
+- SEQ: número de secuencia (0-255) elegido por el host; las respuestas del
+  Arduino (ACK, DONE, NACK) llevan el SEQ del comando al que responden, lo
+  que permite tener varios comandos en vuelo a la vez
+- CRC8: polinomio 0x07 (CRC-8/SMBUS) sobre SEQ, OP, LEN y PAYLOAD
+- Los logs del Arduino viajan como tramas LOG, separados de las respuestas
+
+Comandos (host -> Arduino):
+- ACTIVATE [ángulo u8, espera_ms u16 LE, ángulo_retorno u8, (servo u8)]: desvío completo
+- RESET [ángulo u8, (servo u8)]: mover a la posición de reposo
+- STATUS [(servo u8)]: estado actual (se responde con ACK + payload de estado)
+
+El byte de servo es opcional (0 si falta): un Arduino puede mover varias
+compuertas, cada una con su propia cola y máquina de estados.
+- SET_BAUD [baudios u32 LE]: el Arduino responde ACK a la velocidad actual
+  y cambia; si no recibe una trama válida a la nueva velocidad en
+  BAUD_CONFIRM_TIMEOUT vuelve a la anterior (ver serial_config.py)
+
+Respuestas (Arduino -> host):
+- ACK: comando aceptado y encolado (STATUS: payload de estado)
+- DONE: movimiento terminado
+- NACK [código u8]: comando rechazado (CRC, cola llena, opcode desconocido...)
+- LOG [texto]: mensaje de depuración, SEQ = 0
+
+El sketch sigue aceptando los comandos de un carácter ('A', 'R', 'S') para
+los scripts antiguos; 0xA5 no es ASCII, así que ambos modos conviven.
+"""
+
+import struct
+from collections import namedtuple
+
+SYNC = 0xA5
+HEADER_SIZE = 4  # SYNC, SEQ, OP, LEN
+MAX_PAYLOAD = 64
+
+# Comandos
+OP_ACTIVATE = 0x01
+OP_RESET = 0x02
+OP_STATUS = 0x03
+OP_SET_BAUD = 0x04
+
+# Respuestas
+OP_ACK = 0x80
+OP_DONE = 0x81
+OP_NACK = 0x82
+OP_LOG = 0x83
+
+OP_NAMES = {
+    OP_ACTIVATE: "ACTIVATE",
+    OP_RESET: "RESET",
+    OP_STATUS: "STATUS",
+    OP_SET_BAUD: "SET_BAUD",
+    OP_ACK: "ACK",
+    OP_DONE: "DONE",
+    OP_NACK: "NACK",
+    OP_LOG: "LOG",
+}
+
+# Códigos de NACK
+NACK_CRC = 1
+NACK_UNKNOWN_OP = 2
+NACK_QUEUE_FULL = 3
+NACK_BAD_PAYLOAD = 4
+
+NACK_NAMES = {
+    NACK_CRC: "CRC inválido",
+    NACK_UNKNOWN_OP: "opcode desconocido",
+    NACK_QUEUE_FULL: "cola llena",
+    NACK_BAD_PAYLOAD: "payload inválido",
+}
+
+# Estados del Arduino (payload de STATUS)
+STATE_NAMES = {0: "IDLE", 1: "EJECUTANDO", 2: "ERROR"}
+
+Frame = namedtuple('Frame', ['seq', 'op', 'payload'])
+
+
+def _crc8_table():
+    table = []
+    for value in range(256):
+        crc = value
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+        table.append(crc)
+    return bytes(table)
+
+
+CRC8_TABLE = _crc8_table()
+
+
+def crc8(data, crc=0):
+    """CRC-8 (polinomio 0x07, valor inicial 0)"""
+    for value in data:
+        crc = CRC8_TABLE[crc ^ value]
+    return crc
+
+
+def encode_frame(seq, op, payload=b''):
+    """Serializa una trama lista para escribir en el puerto"""
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError(f"Payload demasiado largo: {len(payload)} > {MAX_PAYLOAD}")
+    body = bytes((seq & 0xFF, op, len(payload))) + bytes(payload)
+    return bytes((SYNC,)) + body + bytes((crc8(body),))
+
+
+def _servo_suffix(servo):
+    # Servo 0 se omite: las tramas siguen siendo válidas para sketches de un solo servo
+    return bytes((servo,)) if servo else b''
+
+
+def encode_activate(angle=180, hold_ms=500, return_angle=0, servo=0):
+    """Payload de ACTIVATE"""
+    return struct.pack('<BHB', angle, hold_ms, return_angle) + _servo_suffix(servo)
+
+
+def encode_reset(angle=0, servo=0):
+    """Payload de RESET"""
+    return bytes((angle,)) + _servo_suffix(servo)
+
+
+def encode_status(servo=0):
+    """Payload de STATUS"""
+    return _servo_suffix(servo)
+
+
+def encode_set_baud(baudrate):
+    """Payload de SET_BAUD"""
+    return struct.pack('<I', baudrate)
+
+
+def decode_status(payload):
+    """Payload de STATUS -> dict (estado, posición, comandos en cola)"""
+    if len(payload) < 3:
+        raise ValueError(f"Payload de STATUS incompleto: {payload!r}")
+    state, position, queued = payload[:3]
+    return {
+        'estado': STATE_NAMES.get(state, f"DESCONOCIDO({state})"),
+        'posicion': position,
+        'en_cola': queued,
+    }
+
+
+def describe(frame):
+    """Texto legible de una trama (para logs)"""
+    name = OP_NAMES.get(frame.op, f"0x{frame.op:02X}")
+    if frame.op == OP_LOG:
+        return f"LOG: {frame.payload.decode('utf-8', errors='ignore')}"
+    if frame.op == OP_NACK and frame.payload:
+        return f"NACK #{frame.seq}: {NACK_NAMES.get(frame.payload[0], frame.payload[0])}"
+    return f"{name} #{frame.seq}"
+
+
+class FrameDecoder:
+    """Decodificador incremental: admite lecturas parciales y bytes sueltos
+
+    Los bytes fuera de trama (texto del modo antiguo, ruido, tramas con CRC
+    inválido) se descartan y se cuentan en `discarded`, resincronizando en
+    el siguiente SYNC.
+    """
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self.discarded = 0
+        self.crc_errors = 0
+        self.crc_error_seq = None  # SEQ de la última trama con CRC inválido
+
+    @property
+    def buffered(self):
+        """Bytes de una trama a medio recibir"""
+        return len(self._buffer)
+
+    def feed(self, data):
+        """Añade bytes recibidos y devuelve las tramas completas
+
+        Returns:
+            list: Tramas (Frame) válidas en orden de llegada
+        """
+        self._buffer += data
+        frames = []
+        buffer = self._buffer
+
+        while True:
+            start = buffer.find(SYNC)
+            if start < 0:
+                self.discarded += len(buffer)
+                buffer.clear()
+                break
+            if start:
+                self.discarded += start
+                del buffer[:start]
+
+            if len(buffer) < HEADER_SIZE:
+                break
+            length = buffer[3]
+            if length > MAX_PAYLOAD:
+                # Cabecera imposible: el SYNC era un byte de datos
+                self.discarded += 1
+                del buffer[0]
+                continue
+
+            end = HEADER_SIZE + length + 1
+            if len(buffer) < end:
+                break
+
+            if crc8(buffer[1:end - 1]) != buffer[end - 1]:
+                self.crc_errors += 1
+                self.crc_error_seq = buffer[1]
+                self.discarded += 1
+                del buffer[0]
+                continue
+
+            frames.append(Frame(buffer[1], buffer[2], bytes(buffer[HEADER_SIZE:end - 1])))
+            del buffer[:end]
+
+        return frames
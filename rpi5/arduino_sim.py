@@ -0,0 +1,362 @@
+#!/usr/bin/env python3
+"""
+arduino_sim.py
+Simulador del Arduino (servo_control_mejorado.ino) sobre un pseudo-terminal
+
+Crea un par pty y atiende el extremo maestro con la misma lógica que el
+sketch: tramas de arduino_protocol.py y comandos antiguos de un carácter,
+cola de movimientos y tiempos de servo simulados. El extremo esclavo se
+abre como un puerto serie normal, así que el controlador y los canales se
+prueban sin hardware:
+
+    python3 arduino_sim.py            # imprime el puerto (/dev/pts/N)
+    SERIAL_PORT = "/dev/pts/N"        # en control_servo_directo.py
+
+Con simulate_baud=True el simulador reproduce el tiempo de línea de la
+velocidad actual (11 bits por byte) y atiende SET_BAUD como el sketch,
+incluida la vuelta atrás si la velocidad supera `max_baudrate`.
+
+Uso desde Python:
+
+    with ArduinoSimulator() as sim:
+        port = serial.Serial(sim.port, timeout=0.1)
+"""
+
+import argparse
+import logging
+import os
+import select
+import struct
+import threading
+import time
+import tty
+from collections import deque
+
+import arduino_protocol as proto
+import serial_config
+
+logger = logging.getLogger(__name__)
+
+# Mismos valores que el sketch
+POS_INICIAL = 0
+POS_ACTIVO = 180
+SERVO_DELAY = 0.5  # Segundos que tarda el servo en llegar a posición
+COLA_MAX = 4
+NUM_SERVOS = 2
+BAUDRATES_SOPORTADOS = (9600, 57600, 115200, 250000, 500000, 1000000)
+BITS_POR_BYTE = 11  # Inicio + 8 datos + 2 stop
+
+IDLE, EJECUTANDO = 0, 1
+
+
+class _Move:
+    """Movimiento en cola (mismo esquema que el struct del sketch)"""
+
+    __slots__ = ('seq', 'framed', 'op', 'angle', 'hold', 'return_angle')
+
+    def __init__(self, seq, framed, op, angle, hold=0.0, return_angle=None):
+        self.seq = seq
+        self.framed = framed
+        self.op = op
+        self.angle = angle
+        self.hold = hold
+        self.return_angle = return_angle
+
+
+class _Servo:
+    """Cola y máquina de estados de una compuerta (como CanalServo del sketch)"""
+
+    def __init__(self, delay):
+        self.delay = delay
+        self.queue = deque()
+        self.current = None
+        self.phase = None
+        self.phase_end = None
+        self.position = POS_INICIAL
+
+
+class ArduinoSimulator:
+    """Arduino virtual accesible en `port` (/dev/pts/N)"""
+
+    def __init__(self, servo_delay=SERVO_DELAY, queue_size=COLA_MAX, ready_message=True,
+                 simulate_baud=False, max_baudrate=None, num_servos=NUM_SERVOS, on_command=None):
+        """
+        Args:
+            servo_delay: Segundos por movimiento del servo (0 = instantáneo, para
+                         benchmarks); una lista da un retardo distinto a cada servo
+            queue_size: Movimientos que admite la cola antes de responder NACK/E
+            ready_message: Enviar "ARDUINO_READY" al arrancar
+            simulate_baud: Retrasar cada byte según la velocidad actual
+            max_baudrate: Velocidad máxima que "aguanta el cable"; por encima
+                          los bytes se pierden (None = sin límite)
+            num_servos: Compuertas conectadas al Arduino
+            on_command: Función opcode -> None llamada al recibir cada comando,
+                        en el hilo del simulador (benchmarks de latencia)
+        """
+        delays = servo_delay if isinstance(servo_delay, (list, tuple)) else [servo_delay] * num_servos
+        self.servos = [_Servo(delay) for delay in delays]
+        self.servo_delay = delays[0]
+        self.queue_size = queue_size
+        self.ready_message = ready_message
+        self.simulate_baud = simulate_baud
+        self.max_baudrate = max_baudrate
+        self.on_command = on_command
+
+        self.baudrate = serial_config.BAUDRATE
+        self._previous_baudrate = None
+        self._confirm_deadline = None
+
+        self._master, self._slave = os.openpty()
+        tty.setraw(self._slave)
+        self.port = os.ttyname(self._slave)
+
+        self._decoder = proto.FrameDecoder()
+        self._running = False
+        self._thread = None
+
+        self.received = 0
+        self.moves = 0
+
+    @property
+    def position(self):
+        """Ángulo del servo 0"""
+        return self.servos[0].position
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name="arduino-sim", daemon=True)
+        self._thread.start()
+        if self.ready_message:
+            self._write(b"ARDUINO_READY\r\n")
+        return self
+
+    def stop(self):
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=2)
+            self._thread = None
+        for fd in (self._master, self._slave):
+            try:
+                os.close(fd)
+            except OSError:
+                pass
+
+    # ---------- E/S ----------
+
+    def _line_ok(self):
+        return self.max_baudrate is None or self.baudrate <= self.max_baudrate
+
+    def _wire_time(self, size):
+        if self.simulate_baud:
+            time.sleep(size * BITS_POR_BYTE / self.baudrate)
+
+    def _write(self, data):
+        if not self._line_ok():
+            return  # El host no entiende nada a esta velocidad
+        self._wire_time(len(data))
+        try:
+            os.write(self._master, data)
+        except OSError:
+            pass
+
+    def _reply(self, move_or_seq, op, payload=b''):
+        seq = move_or_seq.seq if isinstance(move_or_seq, _Move) else move_or_seq
+        self._write(proto.encode_frame(seq, op, payload))
+
+    def _log(self, framed, text):
+        if framed:
+            self._write(proto.encode_frame(0, proto.OP_LOG, text.encode()[:proto.MAX_PAYLOAD]))
+        else:
+            self._write(text.encode() + b"\r\n")
+
+    def _run(self):
+        while self._running:
+            timeout = 0.05
+            for servo in self.servos:
+                if servo.phase_end is not None:
+                    timeout = min(timeout, max(0.0, servo.phase_end - time.monotonic()))
+            readable, _, _ = select.select([self._master], [], [], timeout)
+            if readable:
+                try:
+                    data = os.read(self._master, 4096)
+                except OSError:
+                    break
+                self._wire_time(len(data))
+                if self._line_ok():
+                    self._receive(data)
+            self._check_baud_confirm()
+            for servo in self.servos:
+                self._step(servo)
+
+    def _receive(self, data):
+        # Byte a byte, como el sketch: fuera de trama, 'A'/'R'/'S' son comandos antiguos
+        for value in data:
+            if not self._decoder.buffered and chr(value) in "ARS":
+                self._legacy(chr(value))
+                continue
+            errors = self._decoder.crc_errors
+            for frame in self._decoder.feed(bytes((value,))):
+                self._framed(frame)
+            if self._decoder.crc_errors > errors:
+                # Como el sketch: NACK con el SEQ recibido, para que el host
+                # falle el comando al momento en vez de esperar su plazo
+                self._reply(self._decoder.crc_error_seq, proto.OP_NACK, bytes((proto.NACK_CRC,)))
+
+    # ---------- Comandos ----------
+
+    def _enqueue(self, servo, move):
+        if len(servo.queue) >= self.queue_size:
+            return False
+        servo.queue.append(move)
+        return True
+
+    def _servo(self, payload, index):
+        """Servo indicado en el byte opcional del payload (None si no existe)"""
+        number = payload[index] if len(payload) > index else 0
+        return self.servos[number] if number < len(self.servos) else None
+
+    def _legacy(self, cmd):
+        self.received += 1
+        if self.on_command:
+            self.on_command({'A': proto.OP_ACTIVATE, 'R': proto.OP_RESET}.get(cmd, proto.OP_STATUS))
+        self._log(False, f"CMD_RX: {cmd}")
+        servo = self.servos[0]  # El protocolo antiguo solo controla el servo 0
+        if cmd == 'S':
+            estado = "EJECUTANDO" if servo.current else "IDLE"
+            self._log(False, f"STATUS: {estado}")
+            self._log(False, f"SERVO_POS: {servo.position}")
+            self._write(b'K')
+            return
+        if cmd == 'A':
+            move = _Move(None, False, proto.OP_ACTIVATE, POS_ACTIVO, self.servo_delay, POS_INICIAL)
+        else:
+            move = _Move(None, False, proto.OP_RESET, POS_INICIAL)
+        if not self._enqueue(servo, move):
+            self._log(False, "WARN: Cola llena")
+            self._write(b'E')
+
+    def _check_baud_confirm(self):
+        """Sin trama válida a la nueva velocidad: volver a la anterior (como el sketch)"""
+        if self._confirm_deadline is not None and time.monotonic() > self._confirm_deadline:
+            logger.debug(f"Sin confirmación a {self.baudrate}: vuelta a {self._previous_baudrate}")
+            self.baudrate = self._previous_baudrate
+            self._confirm_deadline = None
+            self._decoder = proto.FrameDecoder()
+
+    def _framed(self, frame):
+        self.received += 1
+        if self.on_command:
+            self.on_command(frame.op)
+        self._confirm_deadline = None  # Cualquier trama válida confirma la velocidad
+
+        if frame.op == proto.OP_SET_BAUD:
+            baudrate = struct.unpack('<I', frame.payload)[0] if len(frame.payload) == 4 else 0
+            if baudrate not in BAUDRATES_SOPORTADOS:
+                self._reply(frame.seq, proto.OP_NACK, bytes((proto.NACK_BAD_PAYLOAD,)))
+                return
+            self._reply(frame.seq, proto.OP_ACK)
+            self._previous_baudrate, self.baudrate = self.baudrate, baudrate
+            self._confirm_deadline = time.monotonic() + serial_config.BAUD_CONFIRM_TIMEOUT
+            return
+        payload = frame.payload
+        if frame.op == proto.OP_STATUS:
+            servo = self._servo(payload, 0)
+            if servo is None:
+                self._reply(frame.seq, proto.OP_NACK, bytes((proto.NACK_BAD_PAYLOAD,)))
+                return
+            state = EJECUTANDO if servo.current else IDLE
+            self._reply(frame.seq, proto.OP_ACK, bytes((state, servo.position, len(servo.queue))))
+            return
+
+        if frame.op == proto.OP_ACTIVATE:
+            if not payload:
+                payload = proto.encode_activate(POS_ACTIVO, int(self.servo_delay * 1000), POS_INICIAL)
+            servo = self._servo(payload, 4)
+            if len(payload) not in (4, 5) or servo is None:
+                self._reply(frame.seq, proto.OP_NACK, bytes((proto.NACK_BAD_PAYLOAD,)))
+                return
+            angle, hold_ms, return_angle = struct.unpack('<BHB', payload[:4])
+            move = _Move(frame.seq, True, frame.op, angle, hold_ms / 1000.0, return_angle)
+        elif frame.op == proto.OP_RESET:
+            servo = self._servo(payload, 1)
+            if servo is None:
+                self._reply(frame.seq, proto.OP_NACK, bytes((proto.NACK_BAD_PAYLOAD,)))
+                return
+            move = _Move(frame.seq, True, frame.op, payload[0] if payload else POS_INICIAL)
+        else:
+            self._reply(frame.seq, proto.OP_NACK, bytes((proto.NACK_UNKNOWN_OP,)))
+            return
+
+        if self._enqueue(servo, move):
+            self._reply(frame.seq, proto.OP_ACK)
+        else:
+            self._reply(frame.seq, proto.OP_NACK, bytes((proto.NACK_QUEUE_FULL,)))
+
+    # ---------- Máquina de estados del servo ----------
+
+    def _step(self, servo):
+        now = time.monotonic()
+        if servo.current is None:
+            if not servo.queue:
+                return
+            move = servo.current = servo.queue.popleft()
+            servo.position = move.angle
+            servo.phase = 'ir'
+            servo.phase_end = now + (servo.delay if move.op == proto.OP_RESET else move.hold)
+            self._log(move.framed, "SERVO_START" if move.op == proto.OP_ACTIVATE else "RESET")
+            return
+
+        if now < servo.phase_end:
+            return
+
+        move = servo.current
+        if servo.phase == 'ir' and move.op == proto.OP_ACTIVATE:
+            servo.position = move.return_angle
+            servo.phase = 'volver'
+            servo.phase_end = now + servo.delay
+            return
+
+        # Movimiento terminado
+        self.moves += 1
+        servo.current = None
+        servo.phase = servo.phase_end = None
+        if move.framed:
+            self._reply(move, proto.OP_DONE)
+        elif move.op == proto.OP_ACTIVATE:
+            self._log(False, "SERVO_DONE")
+            self._write(b'D')
+        else:
+            self._write(b'K')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Arduino simulado sobre un pty")
+    parser.add_argument("--servo-delay", type=float, default=SERVO_DELAY,
+                        help="Segundos por movimiento del servo")
+    parser.add_argument("--cola", type=int, default=COLA_MAX, help="Tamaño de la cola por servo")
+    parser.add_argument("--servos", type=int, default=NUM_SERVOS, help="Compuertas simuladas")
+    parser.add_argument("--simular-baudios", action="store_true",
+                        help="Reproducir el tiempo de línea de la velocidad actual")
+    parser.add_argument("--max-baudios", type=int, default=None,
+                        help="Velocidad máxima que soporta el enlace simulado")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    with ArduinoSimulator(args.servo_delay, args.cola, simulate_baud=args.simular_baudios,
+                          max_baudrate=args.max_baudios, num_servos=args.servos) as sim:
+        logger.info(f"Arduino simulado en {sim.port} (Ctrl+C para salir)")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            logger.info(f"Comandos recibidos: {sim.received}, movimientos: {sim.moves}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+backends.py
+Backends de inferencia intercambiables para PistachioDetector
+
+Backends disponibles:
+- pytorch: best.pt con ultralytics (PyTorch en la CPU del Pi 5)
+- onnx: ONNX Runtime directo, sin cargar torch en memoria
+- openvino: modelo exportado por ultralytics (best_openvino_model/)
+- ncnn: modelo exportado por ultralytics (best_ncnn_model/)
+
+Si el modelo exportado no existe (o es más antiguo que best.pt) se exporta
+desde best.pt la primera vez y se guarda junto a él para las siguientes. La
+resolución forma parte del nombre (best_640.onnx, best_320_ncnn_model/...):
+cambiar INFERENCE_IMGSZ exporta de nuevo en vez de reutilizar otro tamaño.
+
+El backend onnx admite además modelos cuantizados (precisión "int8" o
+"fp16") generados con quantize_model.py.
+
+Todos los backends exponen la misma interfaz:
+- names: dict {class_id: nombre}
+- predict(images): lista de arrays (N, 6) [x1, y1, x2, y2, conf, cls] por imagen
+"""
+
+import ast
+import logging
+import os
+import shutil
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("pytorch", "onnx", "openvino", "ncnn")
+PRECISIONS = ("fp32", "fp16", "int8")
+
+# Nombre del artefacto que genera ultralytics para cada formato (relativo a best.pt)
+EXPORT_SUFFIXES = {
+    "onnx": ".onnx",
+    "openvino": "_openvino_model",
+    "ncnn": "_ncnn_model",
+}
+
+# Umbral mínimo previo a NMS en ONNX Runtime (el filtro fino lo hace el detector)
+ONNX_MIN_CONFIDENCE = 0.25
+ONNX_IOU_THRESHOLD = 0.45
+
+
+# ============ EXPORTACIÓN Y CACHÉ ============
+def exported_model_path(pt_path, fmt, imgsz=640):
+    """Ruta del modelo exportado en formato `fmt` a resolución `imgsz` (caché)"""
+    base, _ = os.path.splitext(pt_path)
+    return f"{base}_{imgsz}{EXPORT_SUFFIXES[fmt]}"
+
+
+def quantized_model_path(pt_path, precision, imgsz=640):
+    """Ruta del ONNX cuantizado que genera quantize_model.py (best_640_int8.onnx...)"""
+    base, _ = os.path.splitext(pt_path)
+    return f"{base}_{imgsz}_{precision}.onnx"
+
+
+def export_model(pt_path, fmt, imgsz=640, **export_args):
+    """Exporta best.pt a `fmt` si no hay una exportación válida en caché
+
+    Returns:
+        str: Ruta del modelo exportado
+    """
+    target = exported_model_path(pt_path, fmt, imgsz)
+    if os.path.exists(target) and os.path.getmtime(target) >= os.path.getmtime(pt_path):
+        logger.info(f"Usando modelo {fmt} en caché: {target}")
+        return target
+
+    # Solo aquí se necesita ultralytics/torch (una vez, en la primera ejecución)
+    from ultralytics import YOLO
+
+    logger.info(f"Exportando {pt_path} a {fmt} (imgsz={imgsz}). Solo ocurre la primera vez...")
+    exported = YOLO(pt_path).export(format=fmt, imgsz=imgsz, **export_args)
+    exported = str(exported)
+    if os.path.abspath(exported) != os.path.abspath(target) and os.path.exists(exported):
+        # Una exportación anterior (más antigua que best.pt) se sustituye entera
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        os.replace(exported, target)
+    logger.info(f"✓ Modelo exportado: {target}")
+    return target
+
+
+# ============ BACKEND ULTRALYTICS ============
+class UltralyticsBackend:
+    """best.pt u otro formato exportado cargado con ultralytics.YOLO"""
+
+    def __init__(self, model_path, imgsz=640, batched=True):
+        """
+        Args:
+            model_path: Ruta al .pt o al modelo exportado
+            imgsz: Resolución de inferencia
+            batched: False para modelos exportados con batch fijo = 1
+        """
+        from ultralytics import YOLO
+
+        self.model = YOLO(model_path, task="detect")
+        self.names = self.model.names
+        self.imgsz = imgsz
+        self.batched = batched
+
+    def predict(self, images):
+        images = list(images)
+        if self.batched:
+            results = self.model(images, imgsz=self.imgsz, verbose=False)
+        else:
+            results = [self.model(image, imgsz=self.imgsz, verbose=False)[0] for image in images]
+
+        return [self._to_numpy(result.boxes.data) for result in results]
+
+    @staticmethod
+    def _to_numpy(data):
+        if hasattr(data, 'cpu'):
+            data = data.cpu().numpy()
+        return np.asarray(data, dtype=np.float32)
+
+
+# ============ BACKEND ONNX RUNTIME ============
+def _imgsz_pair(imgsz):
+    """640 o [640, 640] -> (640, 640)"""
+    return tuple(imgsz) if isinstance(imgsz, (list, tuple)) else (imgsz, imgsz)
+
+
+def preprocess_image(image, imgsz):
+    """Letterbox + normalización como ultralytics
+
+    Args:
+        image: Imagen BGR
+        imgsz: (alto, ancho) de entrada del modelo
+
+    Returns:
+        tuple: (blob NCHW float32 RGB en [0, 1], escala, (pad_x, pad_y))
+    """
+    height, width = image.shape[:2]
+    target_h, target_w = imgsz
+    ratio = min(target_w / width, target_h / height)
+    new_w, new_h = int(round(width * ratio)), int(round(height * ratio))
+    pad_x, pad_y = (target_w - new_w) / 2, (target_h - new_h) / 2
+
+    resized = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top, left = int(round(pad_y - 0.1)), int(round(pad_x - 0.1))
+    bottom, right = target_h - new_h - top, target_w - new_w - left
+    padded = cv2.copyMakeBorder(resized, top, bottom, left, right,
+                                cv2.BORDER_CONSTANT, value=(114, 114, 114))
+    blob = cv2.dnn.blobFromImage(padded, 1 / 255.0, swapRB=True)
+    return blob, ratio, (left, top)
+
+
+class OnnxRuntimeBackend:
+    """Modelo YOLO exportado a ONNX ejecutado con ONNX Runtime (sin torch)
+
+    Implementa el preprocesado (letterbox) y el postprocesado (decodificación
+    + NMS) que normalmente hace ultralytics.
+    """
+
+    def __init__(self, model_path, imgsz=640, min_confidence=ONNX_MIN_CONFIDENCE,
+                 iou_threshold=ONNX_IOU_THRESHOLD):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("Backend 'onnx' requiere onnxruntime: pip install onnxruntime") from e
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, options,
+                                            providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.min_confidence = min_confidence
+        self.iou_threshold = iou_threshold
+
+        # Ultralytics guarda nombres e imgsz en los metadatos del ONNX
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names = ast.literal_eval(metadata["names"]) if "names" in metadata else {0: "pistachio"}
+        configured = _imgsz_pair(imgsz)
+        self.imgsz = configured
+        if "imgsz" in metadata:
+            # La entrada del ONNX es fija: manda la resolución con la que se exportó
+            self.imgsz = _imgsz_pair(ast.literal_eval(metadata["imgsz"]))
+            if self.imgsz != configured:
+                logger.warning(f"⚠ {model_path} se exportó con imgsz={self.imgsz}, "
+                               f"no {configured}: se usa la del modelo")
+
+    def _preprocess(self, image):
+        return preprocess_image(image, self.imgsz)
+
+    def _postprocess(self, output, ratio, pad, shape):
+        # Salida YOLOv8: (1, 4 + nc, anchors) -> (anchors, 4 + nc)
+        predictions = output[0].T
+        scores = predictions[:, 4:]
+        class_ids = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(scores)), class_ids]
+
+        keep = confidences >= self.min_confidence
+        if not keep.any():
+            return np.empty((0, 6), dtype=np.float32)
+        predictions, class_ids, confidences = predictions[keep], class_ids[keep], confidences[keep]
+
+        # cx, cy, w, h -> x1, y1, x2, y2 en coordenadas del frame original
+        boxes = np.empty((len(predictions), 4), dtype=np.float32)
+        boxes[:, 0] = predictions[:, 0] - predictions[:, 2] / 2
+        boxes[:, 1] = predictions[:, 1] - predictions[:, 3] / 2
+        boxes[:, 2] = predictions[:, 0] + predictions[:, 2] / 2
+        boxes[:, 3] = predictions[:, 1] + predictions[:, 3] / 2
+        boxes[:, [0, 2]] = (boxes[:, [0, 2]] - pad[0]) / ratio
+        boxes[:, [1, 3]] = (boxes[:, [1, 3]] - pad[1]) / ratio
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, shape[1])
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, shape[0])
+
+        # NMS por clase: desplazar cada clase para que no se solapen entre sí
+        offsets = class_ids[:, None].astype(np.float32) * 4096
+        nms_boxes = boxes + offsets
+        xywh = np.column_stack([nms_boxes[:, :2], nms_boxes[:, 2:] - nms_boxes[:, :2]])
+        indices = cv2.dnn.NMSBoxes(xywh.tolist(), confidences.tolist(),
+                                   self.min_confidence, self.iou_threshold)
+        indices = np.asarray(indices, dtype=np.int64).reshape(-1)
+
+        return np.column_stack([
+            boxes[indices], confidences[indices], class_ids[indices]
+        ]).astype(np.float32)
+
+    def predict(self, images):
+        outputs = []
+        for image in images:
+            blob, ratio, pad = self._preprocess(image)
+            output = self.session.run(None, {self.input_name: blob})[0]
+            outputs.append(self._postprocess(output, ratio, pad, image.shape))
+        return outputs
+
+
+# ============ SELECCIÓN DE BACKEND ============
+def create_backend(name, pt_path, imgsz=640, precision="fp32"):
+    """Crea el backend `name` a partir de best.pt (exportándolo si hace falta)
+
+    Args:
+        name: Uno de BACKENDS
+        pt_path: Ruta a best.pt
+        imgsz: Resolución de inferencia (y de exportación)
+        precision: Uno de PRECISIONS; fp16/int8 solo con el backend onnx
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Backend desconocido '{name}'. Opciones: {', '.join(BACKENDS)}")
+    if precision not in PRECISIONS:
+        raise ValueError(f"Precisión desconocida '{precision}'. Opciones: {', '.join(PRECISIONS)}")
+    if precision != "fp32" and name != "onnx":
+        raise ValueError(f"La precisión '{precision}' solo está disponible con el backend onnx")
+
+    if not os.path.exists(pt_path):
+        raise FileNotFoundError(f"Modelo no encontrado: {pt_path}")
+
+    if name == "pytorch":
+        logger.info(f"Cargando modelo YOLO (PyTorch) desde {pt_path}...")
+        return UltralyticsBackend(pt_path, imgsz)
+
+    if precision != "fp32":
+        model_path = quantized_model_path(pt_path, precision, imgsz)
+        if not os.path.exists(model_path):
+            raise FileNotFoundError(
+                f"Modelo {precision} no encontrado: {model_path}. "
+                f"Genéralo con: python3 quantize_model.py calibrar --precision {precision} "
+                f"--imgsz {imgsz} --frames <carpeta de frames>")
+        logger.info(f"Cargando modelo YOLO (onnx {precision}) desde {model_path}...")
+        return OnnxRuntimeBackend(model_path, imgsz)
+
+    model_path = export_model(pt_path, name, imgsz)
+    logger.info(f"Cargando modelo YOLO ({name}) desde {model_path}...")
+    if name == "onnx":
+        return OnnxRuntimeBackend(model_path, imgsz)
+    return UltralyticsBackend(model_path, imgsz, batched=False)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+benchmark_backends.py
+Compara FPS y memoria (RSS) de los backends de inferencia sobre el mismo clip
+
+Cada backend se ejecuta en un proceso aparte para que el RSS medido sea solo
+el suyo (torch, onnxruntime, openvino... no se mezclan en memoria).
+
+Uso:
+    python3 benchmark_backends.py --video clip.mp4
+    python3 benchmark_backends.py --video clip.mp4 --backends onnx ncnn --frames 200
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from backends import BACKENDS, create_backend
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MODEL = os.path.join(SCRIPT_DIR, "best.pt")
+WARMUP_FRAMES = 5
+
+
+def read_rss_mb():
+    """Devuelve (RSS actual, pico de RSS) del proceso en MB"""
+    rss = peak = 0.0
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1]) / 1024
+            elif line.startswith("VmHWM:"):
+                peak = int(line.split()[1]) / 1024
+    return rss, peak
+
+
+def run_worker(args):
+    """Mide un único backend e imprime el resultado como JSON"""
+    rss_before, _ = read_rss_mb()
+    load_start = time.perf_counter()
+    backend = create_backend(args.worker, args.model, args.imgsz)
+    load_time = time.perf_counter() - load_start
+    rss_loaded, _ = read_rss_mb()
+
+    cap = cv2.VideoCapture(args.video)
+    if not cap.isOpened():
+        raise RuntimeError(f"No se pudo abrir el clip: {args.video}")
+
+    latencies = []
+    detections = 0
+    frame_index = 0
+    while args.frames <= 0 or len(latencies) < args.frames:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frame_index += 1
+
+        start = time.perf_counter()
+        output = backend.predict([frame])[0]
+        elapsed = time.perf_counter() - start
+
+        # Los primeros frames incluyen inicializaciones perezosas del runtime
+        if frame_index <= WARMUP_FRAMES:
+            continue
+        latencies.append(elapsed)
+        detections += int((output[:, -2] >= args.conf).sum()) if len(output) else 0
+
+    cap.release()
+    rss_end, rss_peak = read_rss_mb()
+
+    latencies = np.array(latencies) * 1000
+    result = {
+        "backend": args.worker,
+        "frames": int(len(latencies)),
+        "fps": float(1000 / latencies.mean()) if len(latencies) else 0.0,
+        "latencia_media_ms": float(latencies.mean()) if len(latencies) else 0.0,
+        "latencia_p95_ms": float(np.percentile(latencies, 95)) if len(latencies) else 0.0,
+        "carga_s": load_time,
+        "rss_base_mb": rss_before,
+        "rss_modelo_mb": rss_loaded,
+        "rss_final_mb": rss_end,
+        "rss_pico_mb": rss_peak,
+        "detecciones": detections,
+    }
+    print(json.dumps(result))
+
+
+def run_benchmark(args):
+    """Lanza un worker por backend y muestra la tabla comparativa"""
+    results = []
+    for backend in args.backends:
+        print(f"▶ {backend}...", flush=True)
+        cmd = [sys.executable, os.path.abspath(__file__), "--worker", backend,
+               "--video", args.video, "--model", args.model, "--imgsz", str(args.imgsz),
+               "--frames", str(args.frames), "--conf", str(args.conf)]
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode != 0:
+            print(f"  ✗ {backend} falló:\n{proc.stderr.strip()[-2000:]}")
+            continue
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+
+    if not results:
+        return 1
+
+    print()
+    print(f"{'Backend':<10} {'Frames':>6} {'FPS':>7} {'Media ms':>9} {'p95 ms':>8} "
+          f"{'RSS MB':>8} {'Pico MB':>8} {'Carga s':>8} {'Det.':>6}")
+    print("-" * 80)
+    for r in results:
+        print(f"{r['backend']:<10} {r['frames']:>6} {r['fps']:>7.1f} {r['latencia_media_ms']:>9.1f} "
+              f"{r['latencia_p95_ms']:>8.1f} {r['rss_final_mb']:>8.0f} {r['rss_pico_mb']:>8.0f} "
+              f"{r['carga_s']:>8.1f} {r['detecciones']:>6}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResultados guardados en {args.json}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de backends de inferencia")
+    parser.add_argument("--video", required=True, help="Clip grabado de la cinta")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="Ruta a best.pt")
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--imgsz", type=int, default=640)
+    parser.add_argument("--frames", type=int, default=0, help="Máximo de frames (0 = todo el clip)")
+    parser.add_argument("--conf", type=float, default=0.6, help="Umbral para contar detecciones")
+    parser.add_argument("--json", help="Guardar resultados en este archivo")
+    parser.add_argument("--worker", choices=BACKENDS, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return 0
+    return run_benchmark(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
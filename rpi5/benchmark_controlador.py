@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+"""
+benchmark_controlador.py
+Latencia MQTT -> Arduino del controlador con hilos frente al de asyncio
+
+Para cada variante (control_servo_directo.py y control_servo_async.py)
+lanza un proceso que arranca el controlador contra arduino_sim.py (pty,
+con el tiempo de línea simulado) y publica --mensajes detecciones en un
+broker local. La latencia de cada detección va desde justo antes de
+publish() hasta que el Arduino simulado recibe el ACTIVATE completo, es
+decir: broker + entrada MQTT + validación + cola de activaciones + canal
+serie. También se mide el tiempo de CPU del proceso durante la ráfaga.
+
+El servo simulado es instantáneo y sin espera en 180° (sin agrupado), así
+que cada detección debería producir un ACTIVATE. Cada ACTIVATE recibido se
+empareja con su detección por track_id: ActuationScheduler lanza una
+activación por servo a la vez, así que el ACTIVATE que llega es el del
+último track disparado. Las detecciones agrupadas, descartadas o perdidas
+no cuentan en la latencia y se informan aparte.
+
+Requiere un broker en --broker:--puerto (sudo docker start mosquitto) o
+--lanzar-broker para arrancar `mosquitto -p PUERTO` durante la prueba.
+
+Uso:
+    python3 benchmark_controlador.py
+    python3 benchmark_controlador.py --mensajes 500 --intervalo 0.01 --json controlador.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from collections import deque
+
+VARIANTES = ("hilos", "asyncio")
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def run_variant(args):
+    """Proceso hijo: controlador + simulador + publicador; imprime el resultado en JSON"""
+    import paho.mqtt.client as mqtt
+
+    import arduino_protocol as proto
+    import control_servo_directo as directo
+    from actuation_scheduler import ActuationScheduler
+    from arduino_sim import ArduinoSimulator
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    disparados = deque()  # track_id de las activaciones enviadas, en orden
+    llegadas = {}  # track_id -> perf_counter() de llegada del ACTIVATE
+    repetidos = []  # ACTIVATE sin activación pendiente (retransmisiones)
+
+    # Anotar el track de cada activación justo antes de enviarla al Arduino
+    start_original = ActuationScheduler._start
+
+    def start_traced(self, trigger):
+        disparados.append(trigger.track_id)
+        start_original(self, trigger)
+
+    ActuationScheduler._start = start_traced
+
+    def on_command(op):
+        if op != proto.OP_ACTIVATE:
+            return
+        now = time.perf_counter()
+        try:
+            llegadas[disparados.popleft()] = now
+        except IndexError:
+            repetidos.append(now)
+
+    sim = ArduinoSimulator(servo_delay=0.0, ready_message=False, simulate_baud=True,
+                           on_command=on_command).start()
+
+    topic = f"benchmark/controlador/{args.variante}/{os.getpid()}"
+    directo.BROKER = args.broker
+    directo.PORT = args.puerto
+    directo.SERVO_ESPERA_MS = 0
+    directo.NO_DETECTION_TIMEOUT = 3600.0
+    directo.ACTUADORES = [
+        {"nombre": "benchmark", "puerto": sim.port, "servo": 0, "topics": [topic], "carril": None},
+    ]
+
+    if args.variante == "hilos":
+        target = directo.main
+    else:
+        import asyncio
+        import control_servo_async
+        target = lambda: asyncio.run(control_servo_async.main_async())
+    threading.Thread(target=target, name="controlador", daemon=True).start()
+
+    publisher = mqtt.Client(client_id=f"benchmark_{os.getpid()}")
+    publisher.connect(args.broker, args.puerto, 60)
+    publisher.loop_start()
+
+    def publish(track_id):
+        payload = json.dumps({"objeto": "pistachio", "confianza": 0.9, "track_id": track_id})
+        publisher.publish(topic, payload)
+
+    # Calentamiento: hasta que el controlador esté suscrito y el enlace negociado
+    limit = time.monotonic() + 20
+    warmup = 0
+    while not llegadas:
+        if time.monotonic() > limit:
+            raise SystemExit(f"{args.variante}: el controlador no respondió")
+        warmup += 1
+        publish(-warmup)
+        time.sleep(0.2)
+    time.sleep(1.0)
+    llegadas.clear()
+    repetidos.clear()
+    descartes_inicio = sum(a.scheduler.coalesced + a.scheduler.dropped for a in directo.registro)
+
+    envios = {}
+    cpu_start = time.process_time()
+    for track_id in range(args.mensajes):
+        envios[track_id] = time.perf_counter()
+        publish(track_id)
+        time.sleep(args.intervalo)
+
+    limit = time.monotonic() + 5
+    while len(llegadas) < args.mensajes and time.monotonic() < limit:
+        time.sleep(0.01)
+    cpu = time.process_time() - cpu_start
+
+    latencies = [(llegadas[track_id] - envio) * 1000
+                 for track_id, envio in envios.items() if track_id in llegadas] or [0.0]
+    descartes = sum(a.scheduler.coalesced + a.scheduler.dropped
+                    for a in directo.registro) - descartes_inicio
+    result = {
+        'variante': args.variante,
+        'mensajes': args.mensajes,
+        'activaciones': len(llegadas),
+        'emparejadas': sum(1 for track_id in envios if track_id in llegadas),
+        'agrupadas_o_descartadas': descartes,
+        'repetidas': len(repetidos),
+        'latencia_p50_ms': statistics.median(latencies),
+        'latencia_p95_ms': percentile(latencies, 0.95),
+        'latencia_p99_ms': percentile(latencies, 0.99),
+        'latencia_max_ms': max(latencies),
+        'cpu_ms': cpu * 1000,
+    }
+    print(json.dumps(result), flush=True)
+    # Los controladores no tienen parada limpia desde otro hilo: salir sin esperarlos
+    os._exit(0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de latencia del controlador de servos")
+    parser.add_argument("--mensajes", type=int, default=200, help="Detecciones por variante")
+    parser.add_argument("--intervalo", type=float, default=0.02,
+                        help="Segundos entre detecciones publicadas")
+    parser.add_argument("--broker", default="localhost")
+    parser.add_argument("--puerto", type=int, default=1883)
+    parser.add_argument("--lanzar-broker", action="store_true",
+                        help="Arrancar mosquitto en --puerto durante la prueba")
+    parser.add_argument("--json", help="Guardar resultados en este archivo")
+    parser.add_argument("--variante", choices=VARIANTES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.variante:
+        return run_variant(args)
+
+    broker = None
+    if args.lanzar_broker:
+        broker = subprocess.Popen(["mosquitto", "-p", str(args.puerto)],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        time.sleep(0.5)
+
+    results = []
+    try:
+        for variante in VARIANTES:
+            print(f"▶ {variante}...", flush=True)
+            child = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--variante", variante,
+                 "--mensajes", str(args.mensajes), "--intervalo", str(args.intervalo),
+                 "--broker", args.broker, "--puerto", str(args.puerto)],
+                capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+            lines = child.stdout.strip().splitlines()
+            if child.returncode or not lines:
+                print(child.stderr[-2000:])
+                print(f"✗ {variante} falló (código {child.returncode})")
+                continue
+            results.append(json.loads(lines[-1]))
+    finally:
+        if broker:
+            broker.terminate()
+
+    print()
+    print(f"{'Variante':<10} {'Msgs':>5} {'Emparej.':>8} {'Perdidas':>8} {'p50 ms':>7} "
+          f"{'p95 ms':>7} {'p99 ms':>7} {'Máx ms':>7} {'CPU ms':>7}")
+    print("-" * 76)
+    for r in results:
+        print(f"{r['variante']:<10} {r['mensajes']:>5} {r['emparejadas']:>8} "
+              f"{r['mensajes'] - r['emparejadas']:>8} "
+              f"{r['latencia_p50_ms']:>7.2f} {r['latencia_p95_ms']:>7.2f} "
+              f"{r['latencia_p99_ms']:>7.2f} {r['latencia_max_ms']:>7.2f} {r['cpu_ms']:>7.0f}")
+        if r['agrupadas_o_descartadas'] or r['repetidas']:
+            print(f"  ⚠ {r['agrupadas_o_descartadas']} agrupadas/descartadas en cola, "
+                  f"{r['repetidas']} ACTIVATE repetidos (fuera de la latencia)")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResultados guardados en {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
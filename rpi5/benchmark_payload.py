@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+benchmark_payload.py
+Coste de serializar y parsear un mensaje de detección: JSON frente a bin1
+
+Mide en CPython (lado RPi5: detector y controlador) el tamaño del mensaje
+y los µs por codificación y decodificación con payload_codec.py. El
+mensaje JSON "antiguo" es el que publicaba el detector antes del formato
+binario (con json.dumps por defecto y la hora ISO como texto).
+
+Con --lote N se compara además publicar N detecciones de un frame como N
+mensajes sueltos o como un único lote (bytes totales y µs de decodificación
+de todo el frame en el consumidor).
+
+El lado de la Pico se mide con picow/benchmark_payload.py en la propia Pico.
+
+Uso:
+    python3 benchmark_payload.py
+    python3 benchmark_payload.py --repeticiones 200000 --lote 8 --json payload.json
+"""
+
+import argparse
+import json
+import timeit
+from datetime import datetime
+
+import payload_codec
+
+SAMPLE = {
+    "objeto": "pistachio",
+    "clase_id": 0,
+    "confianza": 0.873,
+    "timestamp": datetime(2026, 1, 1, 12, 0, 0, 123456).isoformat(),
+    "captura_ts": 1767268800.1234,
+    "seq": 48213,
+    "bbox": [212, 180, 268, 231],
+    "track_id": 1734,
+    "llegada_ts": 1767268800.6021,
+    "velocidad_px_s": 812.4,
+    "camara": "cam0",
+}
+
+
+def measure(function, repetitions):
+    """µs por llamada (mejor de 5 rondas)"""
+    return min(timeit.repeat(function, number=repetitions, repeat=5)) / repetitions * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Coste de los formatos de mensaje de detección")
+    parser.add_argument("--repeticiones", type=int, default=50000)
+    parser.add_argument("--lote", type=int, default=5, help="Detecciones por frame")
+    parser.add_argument("--json", help="Guardar resultados en este archivo")
+    args = parser.parse_args()
+
+    legacy = json.dumps(SAMPLE).encode()
+    compact = payload_codec.encode(SAMPLE, payload_codec.FORMAT_JSON).encode()
+    binary = payload_codec.encode(SAMPLE, payload_codec.FORMAT_BINARY)
+
+    n = args.repeticiones
+    results = [
+        {
+            'formato': 'json (antiguo)',
+            'bytes': len(legacy),
+            'codificar_us': measure(lambda: json.dumps(SAMPLE).encode(), n),
+            'decodificar_us': measure(lambda: json.loads(legacy.decode()), n),
+        },
+        {
+            'formato': payload_codec.FORMAT_JSON,
+            'bytes': len(compact),
+            'codificar_us': measure(
+                lambda: payload_codec.encode(SAMPLE, payload_codec.FORMAT_JSON).encode(), n),
+            'decodificar_us': measure(lambda: payload_codec.decode(compact), n),
+        },
+        {
+            'formato': payload_codec.FORMAT_BINARY,
+            'bytes': len(binary),
+            'codificar_us': measure(
+                lambda: payload_codec.encode(SAMPLE, payload_codec.FORMAT_BINARY), n),
+            'decodificar_us': measure(lambda: payload_codec.decode(binary), n),
+        },
+    ]
+
+    # Un frame con --lote detecciones: N mensajes sueltos frente a un lote
+    frame = [dict(SAMPLE, track_id=SAMPLE["track_id"] + i) for i in range(args.lote)]
+    n_frame = max(1, n // args.lote)
+    for fmt in (payload_codec.FORMAT_JSON, payload_codec.FORMAT_BINARY):
+        singles = [payload_codec.encode(payload, fmt) for payload in frame]
+        singles = [m.encode() if isinstance(m, str) else m for m in singles]
+        batch = payload_codec.encode(frame, fmt)
+        batch = batch.encode() if isinstance(batch, str) else batch
+        results.append({
+            'formato': f'{fmt} x{args.lote}',
+            'bytes': sum(len(m) for m in singles),
+            'codificar_us': measure(
+                lambda: [payload_codec.encode(payload, fmt) for payload in frame], n_frame),
+            'decodificar_us': measure(
+                lambda: [payload_codec.decode_detections(m) for m in singles], n_frame),
+        })
+        results.append({
+            'formato': f'{fmt} lote({args.lote})',
+            'bytes': len(batch),
+            'codificar_us': measure(lambda: payload_codec.encode(frame, fmt), n_frame),
+            'decodificar_us': measure(lambda: payload_codec.decode_detections(batch), n_frame),
+        })
+
+    print(f"{'Formato':<16} {'Bytes':>6} {'Codificar µs':>13} {'Decodificar µs':>15}")
+    print("-" * 54)
+    for r in results:
+        print(f"{r['formato']:<16} {r['bytes']:>6} {r['codificar_us']:>13.2f} "
+              f"{r['decodificar_us']:>15.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResultados guardados en {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
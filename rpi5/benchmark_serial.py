@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+benchmark_serial.py
+Comandos/segundo del enlace con el Arduino sobre un pty (sin hardware)
+
+Ejecuta la misma ráfaga de comandos ACTIVATE contra arduino_sim.py con el
+tiempo de línea simulado y compara:
+- Protocolo de texto a 9600 baudios (un comando cada vez, respuestas verbosas)
+- Tramas a 9600 sin pipelining (ventana 1) y con ventana N
+- Tramas tras negociar 115200 y 1M baudios
+
+El servo simulado es instantáneo por defecto (--servo-delay 0) para medir
+solo el enlace; con el retardo real se ve cuánto ayuda la cola del sketch.
+
+Uso:
+    python3 benchmark_serial.py
+    python3 benchmark_serial.py --comandos 500 --ventana 4 --json serial.json
+"""
+
+import argparse
+import json
+import statistics
+import time
+
+import serial
+
+import arduino_protocol as proto
+import serial_config
+from arduino_sim import ArduinoSimulator
+from serial_channel import FramedSerialChannel, SerialChannel
+
+
+def open_port(sim):
+    return serial.Serial(sim.port, baudrate=serial_config.BAUDRATE, timeout=0.05)
+
+
+def run_scenario(name, args, framed, window=1, baudrate=None):
+    """Envía args.comandos ACTIVATE y devuelve las métricas del escenario"""
+    with ArduinoSimulator(servo_delay=args.servo_delay, queue_size=max(window, 1),
+                          ready_message=False, simulate_baud=True) as sim:
+        port = open_port(sim)
+        if framed:
+            channel = FramedSerialChannel(port, max_in_flight=window).start()
+            if baudrate:
+                channel.negotiate_baudrate([baudrate])
+            submit = lambda: channel.submit(
+                proto.OP_ACTIVATE, proto.encode_activate(180, int(args.servo_delay * 1000), 0))
+        else:
+            channel = SerialChannel(port).start()
+            submit = lambda: channel.submit(b'A')
+
+        start = time.perf_counter()
+        futures = [(time.perf_counter(), submit()) for _ in range(args.comandos)]
+        latencies, failures = [], 0
+        for sent, future in futures:
+            try:
+                if future.result():
+                    latencies.append(time.perf_counter() - sent)
+                else:
+                    failures += 1
+            except Exception:
+                failures += 1
+        elapsed = time.perf_counter() - start
+
+        channel.stop()
+        port.close()
+        final_baud = sim.baudrate
+
+    # Las latencias incluyen la espera en cola del host: la del comando
+    # aislado es la mínima
+    latencies = [latency * 1000 for latency in latencies] or [0.0]
+    return {
+        'escenario': name,
+        'baudios': final_baud,
+        'ventana': window,
+        'comandos': args.comandos,
+        'fallos': failures,
+        'comandos_s': (args.comandos - failures) / elapsed,
+        'latencia_min_ms': min(latencies),
+        'latencia_p50_ms': statistics.median(latencies),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark del enlace serie con el Arduino")
+    parser.add_argument("--comandos", type=int, default=200, help="Comandos por escenario")
+    parser.add_argument("--ventana", type=int, default=4,
+                        help="Comandos en vuelo con pipelining (<= cola del sketch)")
+    parser.add_argument("--servo-delay", type=float, default=0.0,
+                        help="Segundos por movimiento del servo simulado")
+    parser.add_argument("--json", help="Guardar resultados en este archivo")
+    args = parser.parse_args()
+
+    scenarios = [
+        ("texto", dict(framed=False)),
+        ("tramas", dict(framed=True, window=1)),
+        ("tramas+pipeline", dict(framed=True, window=args.ventana)),
+    ] + [
+        (f"tramas+pipeline@{baud}", dict(framed=True, window=args.ventana, baudrate=baud))
+        for baud in sorted(serial_config.BAUDRATES_NEGOCIABLES)
+    ]
+
+    results = []
+    for name, options in scenarios:
+        print(f"▶ {name}...", flush=True)
+        results.append(run_scenario(name, args, **options))
+
+    print()
+    print(f"{'Escenario':<26} {'Baudios':>8} {'Ventana':>7} {'Cmd/s':>8} "
+          f"{'Mín ms':>7} {'p50 ms':>8} {'Fallos':>6}")
+    print("-" * 76)
+    for r in results:
+        print(f"{r['escenario']:<26} {r['baudios']:>8} {r['ventana']:>7} {r['comandos_s']:>8.1f} "
+              f"{r['latencia_min_ms']:>7.2f} {r['latencia_p50_ms']:>8.1f} {r['fallos']:>6}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResultados guardados en {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
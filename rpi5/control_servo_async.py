@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+control_servo_async.py
+Controlador de compuertas sobre asyncio (alternativa a control_servo_directo.py)
+
+Misma lógica y misma configuración que control_servo_directo.py (se
+importan de allí: ACTUADORES, umbrales, protocolo...), pero todo corre en
+un único bucle de eventos con concurrencia estructurada (TaskGroup):
+- Entrada MQTT con aiomqtt (reconexión automática)
+- Una tarea lectora por puerto serie (pyserial-asyncio); la escritura no
+  bloquea y los plazos de los comandos son temporizadores del bucle
+- Activaciones programadas y vueltas a reposo con loop.call_at
+- Métricas periódicas de cada compuerta y canal
+
+Sin hilos de paho, de canal ni del planificador: no hay locks disputados
+ni cambios de contexto entre la llegada del mensaje y la escritura en el
+puerto. Comparar latencias con: python3 benchmark_controlador.py
+
+Requiere Python 3.11+ y:
+    pip install aiomqtt pyserial-asyncio
+
+Uso:
+    python3 control_servo_async.py
+"""
+
+import asyncio
+import logging
+import signal
+import time
+
+import aiomqtt
+import serial
+import serial_asyncio
+
+import control_servo_directo as directo
+import payload_codec
+import serial_config
+from serial_channel_async import AsyncFramedChannel, AsyncSerialChannel
+
+# ============ CONFIGURACIÓN ============
+# El resto de parámetros se comparte con control_servo_directo.py
+MQTT_RECONNECT_DELAY = 2.0  # Segundos entre reintentos de conexión al broker
+METRICS_INTERVAL = 60.0     # Segundos entre resúmenes de métricas (0 = solo al salir)
+ARDUINO_BOOT_TIME = 2.0     # Espera al reset por DTR al abrir el puerto
+
+logger = logging.getLogger(__name__)
+
+
+class LoopTimer:
+    """Temporizador sobre el bucle de eventos con la interfaz de DeadlineScheduler
+
+    Los vencimientos se dan en time.monotonic(), como en DeadlineScheduler;
+    se traducen al reloj del bucle (también monotónico) al programarlos.
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self._handles = []
+
+    def call_at(self, deadline, callback, *args):
+        """Programa callback(*args) en el instante `deadline` (time.monotonic())"""
+        handle = self.loop.call_at(self.loop.time() + deadline - time.monotonic(),
+                                   callback, *args)
+        self._handles.append(handle)
+        if len(self._handles) > 64:
+            self._prune()
+        return handle
+
+    def call_later(self, delay, callback, *args):
+        """Programa callback(*args) dentro de `delay` segundos"""
+        return self.call_at(time.monotonic() + delay, callback, *args)
+
+    def pending(self):
+        """Número de llamadas pendientes (sin contar las canceladas)"""
+        self._prune()
+        return len(self._handles)
+
+    def _prune(self):
+        now = self.loop.time()
+        self._handles = [h for h in self._handles if not h.cancelled() and h.when() > now]
+
+
+# ============ FUNCIONES SERIAL ============
+
+async def conectar_arduino(puerto, tareas):
+    """Abre un Arduino y arranca su tarea lectora en `tareas` (TaskGroup)
+
+    Returns:
+        AsyncSerialChannel/AsyncFramedChannel, o None si falla
+    """
+    try:
+        logger.info(f"Conectando a Arduino en {puerto}...")
+        reader, writer = await serial_asyncio.open_serial_connection(
+            url=puerto,
+            baudrate=directo.BAUDRATE,
+            bytesize=serial.EIGHTBITS,
+            parity=serial.PARITY_NONE,
+            stopbits=serial.STOPBITS_TWO if serial_config.STOPBITS == 2 else serial.STOPBITS_ONE,
+        )
+    except serial.SerialException as e:
+        logger.error(f"✗ Error conectando Arduino: {e}")
+        logger.error(f"Verifica que Arduino esté conectado en {puerto}")
+        return None
+
+    # Esperar inicialización Arduino (reset por DTR) y leer el mensaje de inicio
+    await asyncio.sleep(ARDUINO_BOOT_TIME)
+    try:
+        msg = await asyncio.wait_for(reader.read(1024), 0.1)
+        logger.info(f"Arduino dice: {msg.decode('utf-8', errors='ignore')}")
+    except asyncio.TimeoutError:
+        pass
+
+    nombre = puerto.rsplit('/', 1)[-1]
+    if directo.PROTOCOLO == "tramas":
+        canal = AsyncFramedChannel(reader, writer, name=nombre,
+                                   default_timeout=directo.COMMAND_TIMEOUT,
+                                   max_in_flight=directo.PIPELINE_VENTANA)
+        tareas.create_task(canal.run(), name=f"{nombre}-rx")
+        if directo.NEGOCIAR_BAUDIOS:
+            baudios = await canal.negotiate_baudrate(serial_config.BAUDRATES_NEGOCIABLES)
+            logger.info(f"Velocidad del enlace {puerto}: {baudios} baudios")
+    else:
+        canal = AsyncSerialChannel(reader, writer, name=nombre,
+                                   default_timeout=directo.COMMAND_TIMEOUT)
+        tareas.create_task(canal.run(), name=f"{nombre}-rx")
+
+    logger.info(f"✓ Conexión Arduino establecida en {puerto}")
+    return canal
+
+
+async def crear_actuadores(tareas, temporizador):
+    """Abre cada puerto una sola vez y registra las compuertas de ACTUADORES
+
+    Returns:
+        bool: True si todos los puertos se abrieron
+    """
+    canales = {}
+    for config in directo.ACTUADORES:
+        puerto = config["puerto"]
+        if puerto not in canales:
+            canal = await conectar_arduino(puerto, tareas)
+            if canal is None:
+                return False
+            canales[puerto] = canal
+        directo.registro.add(directo.nuevo_actuador(config, canales[puerto], temporizador))
+    return True
+
+
+async def cerrar_actuadores():
+    """Resetea las compuertas y cierra los canales"""
+    for actuador in directo.registro:
+        actuador.cancel_reset()
+    futuros = [actuador.reset() for actuador in directo.registro]
+    if futuros:
+        await asyncio.wait(futuros, timeout=directo.COMMAND_TIMEOUT)
+    for canal in directo.registro.channels():
+        canal.stop()
+
+
+# ============ TAREAS ============
+
+async def recibir_mqtt(temporizador):
+    """Entrada MQTT: cada mensaje se procesa en el bucle sin bloquear"""
+    while True:
+        try:
+            # Last will: borra el anuncio de formatos si la conexión cae
+            will = aiomqtt.Will(directo.topic_formatos(), b"", qos=1, retain=True)
+            async with aiomqtt.Client(directo.BROKER, directo.PORT, identifier=directo.ID_CLIENTE,
+                                      will=will) as client:
+                logger.info(f"✓ Conectado al broker MQTT en {directo.BROKER}:{directo.PORT}")
+                for topic in directo.registro.topics():
+                    await client.subscribe(topic)
+                    logger.info(f"✓ Suscrito al topic: {topic}")
+                await client.publish(directo.topic_formatos(),
+                                     payload_codec.formats_announcement(), qos=1, retain=True)
+
+                try:
+                    async for message in client.messages:
+                        directo.procesar_mensaje(str(message.topic), message.payload,
+                                                 temporizador)
+                except asyncio.CancelledError:
+                    # Cierre limpio: el last will no se dispara, borrar el anuncio
+                    await client.publish(directo.topic_formatos(), b"", qos=1, retain=True)
+                    raise
+
+        except aiomqtt.MqttError as e:
+            logger.error(f"✗ Conexión MQTT perdida ({e}). Reintentando en "
+                         f"{MQTT_RECONNECT_DELAY}s...")
+            await asyncio.sleep(MQTT_RECONNECT_DELAY)
+
+
+def registrar_metricas():
+    for actuador in directo.registro:
+        logger.info(f"Compuerta {actuador.name}: {actuador.summary()}")
+    for canal in directo.registro.channels():
+        logger.info(f"Canal {canal.name}: {canal.completed} completados, "
+                    f"{canal.timeouts} timeouts, latencia máx {canal.max_latency*1000:.1f}ms")
+
+
+async def metricas_periodicas():
+    while True:
+        await asyncio.sleep(METRICS_INTERVAL)
+        registrar_metricas()
+
+
+# ============ MAIN ============
+
+async def main_async(detener=None):
+    """Función principal asyncio
+
+    Args:
+        detener: asyncio.Event para parar desde fuera (por defecto SIGINT/SIGTERM)
+    """
+    loop = asyncio.get_running_loop()
+    detener = detener or asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, detener.set)
+        except (NotImplementedError, RuntimeError, ValueError):
+            pass  # Fuera del hilo principal (p. ej. benchmark_controlador.py)
+
+    logger.info("=" * 60)
+    logger.info("Control Directo Servo (asyncio) - RPi5 → Arduino")
+    logger.info(f"Broker MQTT: {directo.BROKER}:{directo.PORT}")
+    for config in directo.ACTUADORES:
+        logger.info(f"Compuerta {config['nombre']}: {config['puerto']} servo "
+                    f"{config.get('servo', 0)} @ {directo.BAUDRATE} "
+                    f"(protocolo: {directo.PROTOCOLO})")
+    logger.info("=" * 60)
+
+    temporizador = LoopTimer(loop)
+    async with asyncio.TaskGroup() as tareas:
+        if not await crear_actuadores(tareas, temporizador):
+            logger.error("No se pudo conectar con Arduino. Abortando.")
+            await cerrar_actuadores()
+            return
+
+        logger.info("Posicionando compuertas en estado inicial (0°)...")
+        for actuador in directo.registro:
+            actuador.reset()
+
+        entrada = [tareas.create_task(recibir_mqtt(temporizador), name="mqtt")]
+        if METRICS_INTERVAL > 0:
+            entrada.append(tareas.create_task(metricas_periodicas(), name="metricas"))
+        logger.info("\n🚀 Sistema iniciado. Presiona Ctrl+C para salir.\n")
+
+        await detener.wait()
+
+        # Limpieza: primero dejar de recibir, luego reposo y cierre de canales
+        # (sus tareas lectoras terminan al cerrar el puerto)
+        logger.info("Cerrando conexiones...")
+        for tarea in entrada:
+            tarea.cancel()
+        registrar_metricas()
+        logger.info("Reseteando compuertas a posición inicial...")
+        await cerrar_actuadores()
+
+    logger.info("Sistema detenido correctamente")
+
+
+def main():
+    asyncio.run(main_async())
+
+
+if __name__ == "__main__":
+    main()
@@ -10,17 +10,47 @@ ARQUITECTURA:
 
 FUNCIONAMIENTO:
 - Si detecta pistacho (confianza >= 0.6): Servo a 180° (derecha)
-- Si no detecta nada por 5 segundos: Servo a 0° (izquierda)
-- Movimiento cada 5 segundos máximo
+- Si no detecta nada por 5 segundos: Servo a 0° (izquierda). El reset lo
+  dispara un temporizador exactamente al vencer NO_DETECTION_TIMEOUT, sin
+  bucle de sondeo: en reposo el proceso no se despierta
+- Si el servo está ocupado, la activación se encola y se envía en cuanto
+  el Arduino confirma el movimiento anterior (DONE); las que coinciden con
+  la compuerta abierta se agrupan en el mismo barrido (actuation_scheduler.py)
+- Si el mensaje trae "llegada_ts" (hora prevista de llegada del pistacho a
+  la compuerta), la activación se programa para ese instante exacto con un
+  temporizador monotónico, independiente de la latencia de inferencia/MQTT.
+  Requiere la hora de ambos equipos sincronizada por NTP (ver README).
+- Los comandos al Arduino pasan por un canal serie con hilos propios
+  (serial_channel.py): el callback MQTT solo encola y nunca espera al servo.
+- Con PROTOCOLO = "tramas" se usa el protocolo binario numerado
+  (arduino_protocol.py); "texto" mantiene los comandos de un carácter.
+  En modo tramas se negocia al arrancar una velocidad mayor (hasta 1M
+  baudios, con vuelta atrás segura) y se envían hasta PIPELINE_VENTANA
+  comandos sin esperar el DONE del anterior.
+  Para probar sin hardware: python3 arduino_sim.py y usar el pty que imprime.
+- Varias compuertas (ACTUADORES): cada una con su puerto serie o su servo
+  en un Arduino compartido, su cola de activaciones y sus topics/carril (actuators.py).
+  Los comandos a compuertas distintas se ejecutan en paralelo.
+- Los mensajes pueden llegar en JSON o en binario compacto (payload_codec.py);
+  al conectar se anuncian ambos formatos para que el detector elija. Un
+  mensaje puede traer una detección o un lote (todas las de un frame): cada
+  detección del lote se valida y enruta por separado.
 """
 
 import paho.mqtt.client as mqtt
 import serial
-import json
 import time
 import logging
+import threading
+from collections import OrderedDict
 from datetime import datetime
 
+from actuators import Actuator, ActuatorRegistry
+from deadline_scheduler import DeadlineScheduler
+import payload_codec
+import serial_config
+from serial_channel import FramedSerialChannel, SerialChannel
+
 # ============ CONFIGURACIÓN ============
 # MQTT
 BROKER = "localhost"  # RPi5 ejecuta el broker
@@ -29,16 +59,40 @@ TOPIC = "robot/pico/estado"
 
 # Serial Arduino
 SERIAL_PORT = "/dev/ttyUSB0"  # Cambiar a /dev/ttyACM0 si es necesario
-BAUDRATE = 9600
-TIMEOUT = 2
+BAUDRATE = serial_config.BAUDRATE  # Velocidad de arranque del sketch
+NEGOCIAR_BAUDIOS = True            # Subir a serial_config.BAUDRATES_NEGOCIABLES (solo tramas)
+PIPELINE_VENTANA = 4               # Comandos en vuelo (<= COLA_MAX del sketch)
+READ_TIMEOUT = 0.1     # Granularidad del hilo lector (no añade latencia a las respuestas)
+COMMAND_TIMEOUT = 3.0  # Espera máxima por D/K (la secuencia ACTIVATE dura ~1.5s)
+PROTOCOLO = "tramas"   # "tramas" (servo_control_mejorado.ino) o "texto" (sketches antiguos)
 
 # Detección
 CONFIDENCE_THRESHOLD = 0.6  # 60% mínimo
 NO_DETECTION_TIMEOUT = 5.0  # 5 segundos sin detección
 
-# Comandos Arduino
-CMD_ACTIVATE = b'A'  # Mover a 180° (pistacho detectado)
-CMD_RESET = b'R'     # Mover a 0° (sin detección)
+# Actuación programada
+ACTUATION_LEAD_TIME = 0.15  # Segundos que tarda el servo en llegar (se adelanta el comando)
+MAX_SCHEDULE_AHEAD = 10.0   # Llegadas más lejanas se consideran estimaciones inválidas
+
+# Parámetros del movimiento (solo protocolo de tramas)
+SERVO_ANGULO_ACTIVO = 180
+SERVO_ANGULO_REPOSO = 0
+SERVO_ESPERA_MS = 500  # Tiempo en 180° antes de volver (ventana de agrupado)
+
+# Cola de activaciones por compuerta (sustituye al cooldown fijo de 5s)
+ACTUATION_QUEUE_SIZE = 8   # Activaciones en espera mientras el servo se mueve
+ACTUATION_MAX_WAIT = 2.0   # Más espera en cola = el pistacho ya pasó, se descarta
+
+# Compuertas. Varias pueden compartir "puerto" (servos 0, 1... del mismo
+# Arduino; requiere PROTOCOLO = "tramas"). Con "carril" solo se atienden los
+# mensajes cuyo campo "carril" (o "camara") coincide. Cada una tiene su
+# propia cola de activaciones.
+ACTUADORES = [
+    {"nombre": "compuerta1", "puerto": SERIAL_PORT, "servo": 0, "topics": [TOPIC], "carril": None},
+    # {"nombre": "compuerta2", "puerto": SERIAL_PORT, "servo": 1, "topics": [TOPIC], "carril": 1},
+    # {"nombre": "compuerta3", "puerto": "/dev/ttyUSB1", "servo": 0,
+    #  "topics": ["robot/linea2/estado"], "carril": None},
+]
 
 # Logging
 logging.basicConfig(
@@ -48,27 +102,38 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 # ============ VARIABLES GLOBALES ============
-arduino_serial = None
-last_detection_time = None
-last_movement_time = 0
-MOVEMENT_COOLDOWN = 5.0  # Mover servo cada 5 segundos como máximo
+puertos_serie = {}  # Puerto -> serial.Serial abierto
+registro = ActuatorRegistry()
+scheduler = DeadlineScheduler("actuacion")  # Actuaciones programadas y vueltas a reposo
+detener = threading.Event()
+tracks_lock = threading.Lock()
+tracks_recientes = OrderedDict()  # (cámara, track_id) -> time.monotonic() de llegada
+MAX_TRACKS_RECIENTES = 256
+# Ventana de duplicados: los reenvíos de QoS 1 llegan en segundos. Pasada la
+# ventana un track_id repetido es otro pistacho (p. ej. el detector se reinició
+# y volvió a numerar desde 1)
+VENTANA_TRACK_REPETIDO = 5.0
+ID_CLIENTE = f"rpi5_control_{int(time.time())}"
 
 # ============ FUNCIONES SERIAL ============
 
-def conectar_arduino():
-    """Conecta con Arduino por serial USB"""
-    global arduino_serial
+def conectar_arduino(puerto):
+    """Conecta con un Arduino por serial USB
     
+    Returns:
+        SerialChannel/FramedSerialChannel arrancado, o None si falla
+    """
     try:
-        logger.info(f"Conectando a Arduino en {SERIAL_PORT}...")
+        logger.info(f"Conectando a Arduino en {puerto}...")
         arduino_serial = serial.Serial(
-            port=SERIAL_PORT,
+            port=puerto,
             baudrate=BAUDRATE,
             bytesize=serial.EIGHTBITS,
             parity=serial.PARITY_NONE,
-            stopbits=serial.STOPBITS_TWO,
-            timeout=TIMEOUT
+            stopbits=serial.STOPBITS_TWO if serial_config.STOPBITS == 2 else serial.STOPBITS_ONE,
+            timeout=READ_TIMEOUT
         )
+        puertos_serie[puerto] = arduino_serial
         
         # Esperar inicialización Arduino (reset por DTR)
         time.sleep(2)
@@ -78,175 +143,244 @@ def conectar_arduino():
             msg = arduino_serial.read(arduino_serial.in_waiting)
             logger.info(f"Arduino dice: {msg.decode('utf-8', errors='ignore')}")
         
-        logger.info("✓ Conexión Arduino establecida")
-        return True
+        nombre = puerto.rsplit('/', 1)[-1]
+        if PROTOCOLO == "tramas":
+            canal = FramedSerialChannel(arduino_serial, name=nombre, default_timeout=COMMAND_TIMEOUT,
+                                        max_in_flight=PIPELINE_VENTANA).start()
+            if NEGOCIAR_BAUDIOS:
+                baudios = canal.negotiate_baudrate(serial_config.BAUDRATES_NEGOCIABLES)
+                logger.info(f"Velocidad del enlace {puerto}: {baudios} baudios")
+        else:
+            canal = SerialChannel(arduino_serial, name=nombre, default_timeout=COMMAND_TIMEOUT).start()
+        
+        logger.info(f"✓ Conexión Arduino establecida en {puerto}")
+        return canal
         
     except serial.SerialException as e:
         logger.error(f"✗ Error conectando Arduino: {e}")
-        logger.error(f"Verifica que Arduino esté conectado en {SERIAL_PORT}")
+        logger.error(f"Verifica que Arduino esté conectado en {puerto}")
         logger.error("Ejecuta: ls -l /dev/ttyUSB* /dev/ttyACM*")
-        return False
+        return None
 
-def enviar_comando(comando):
-    """Envía comando al Arduino y espera respuesta
+def crear_actuadores():
+    """Abre cada puerto una sola vez y registra las compuertas de ACTUADORES
     
-    Args:
-        comando (bytes): Comando a enviar (b'A', b'R', b'S')
-        
     Returns:
-        bool: True si se ejecutó correctamente
+        bool: True si todos los puertos se abrieron
     """
-    global arduino_serial
+    canales = {}
+    for config in ACTUADORES:
+        puerto = config["puerto"]
+        if puerto not in canales:
+            canal = conectar_arduino(puerto)
+            if canal is None:
+                return False
+            canales[puerto] = canal
+        
+        registro.add(nuevo_actuador(config, canales[puerto], scheduler))
+    return True
+
+def nuevo_actuador(config, canal, temporizador):
+    """Actuator de una entrada de ACTUADORES con los parámetros de este módulo"""
+    return Actuator(
+        config["nombre"], canal,
+        servo=config.get("servo", 0),
+        topics=config.get("topics", [TOPIC]),
+        lane=config.get("carril"),
+        angle_active=SERVO_ANGULO_ACTIVO,
+        angle_rest=SERVO_ANGULO_REPOSO,
+        hold_ms=SERVO_ESPERA_MS,
+        queue_size=ACTUATION_QUEUE_SIZE,
+        max_wait=ACTUATION_MAX_WAIT,
+        timer=temporizador,
+        no_detection_timeout=NO_DETECTION_TIMEOUT,
+    )
+
+def cerrar_actuadores():
+    """Resetea las compuertas y cierra canales y puertos"""
+    for actuador in registro:
+        actuador.cancel_reset()
+    futuros = [actuador.reset() for actuador in registro]
+    for futuro in futuros:
+        try:
+            futuro.result(timeout=COMMAND_TIMEOUT)
+        except Exception:
+            pass
+    
+    for canal in registro.channels():
+        canal.stop()
+    for arduino_serial in puertos_serie.values():
+        if arduino_serial.is_open:
+            arduino_serial.close()
+    puertos_serie.clear()
+
+# ============ FUNCIONES MQTT ============
+
+def es_track_repetido(data):
+    """True si ya se procesó este track (QoS 1 puede entregar duplicados)
     
-    if arduino_serial is None or not arduino_serial.is_open:
-        logger.error("Arduino no conectado")
+    El detector publica un único evento por pistacho con su track_id; si el
+    mensaje no trae track_id no se deduplica. Solo cuenta como duplicado si
+    llega dentro de VENTANA_TRACK_REPETIDO segundos del original.
+    """
+    if 'track_id' not in data:
         return False
     
-    try:
-        # Limpiar buffer
-        arduino_serial.reset_input_buffer()
-        
-        # Enviar comando
-        arduino_serial.write(comando)
-        arduino_serial.flush()
-        
-        logger.debug(f"Comando enviado: {comando}")
-        
-        # Esperar respuesta (timeout 2 segundos)
-        time.sleep(0.5)
-        
-        if arduino_serial.in_waiting > 0:
-            respuesta = arduino_serial.read(arduino_serial.in_waiting)
-            logger.debug(f"Arduino responde: {respuesta}")
+    clave = (data.get('camara'), data['track_id'])
+    ahora = time.monotonic()
+    with tracks_lock:
+        # Olvidar los tracks fuera de la ventana (el más antiguo va primero)
+        while tracks_recientes:
+            mas_antiguo, llegada = next(iter(tracks_recientes.items()))
+            if ahora - llegada <= VENTANA_TRACK_REPETIDO:
+                break
+            del tracks_recientes[mas_antiguo]
             
-            # Verificar respuesta esperada
-            if comando == CMD_ACTIVATE and b'D' in respuesta:
-                logger.info("✓ Arduino completó secuencia ACTIVATE (180°)")
-                return True
-            elif comando == CMD_RESET and b'K' in respuesta:
-                logger.info("✓ Arduino completó RESET (0°)")
-                return True
+        if clave in tracks_recientes:
+            return True
         
-        logger.warning("Arduino no respondió como esperado")
-        return True  # Comando enviado aunque no haya confirmación
-        
-    except Exception as e:
-        logger.error(f"Error enviando comando: {e}")
-        return False
-
-def mover_servo_pistacho():
-    """Mueve servo a posición de pistacho detectado (180°)"""
-    logger.info("🥜 PISTACHO DETECTADO → Moviendo servo a 180°")
-    return enviar_comando(CMD_ACTIVATE)
+        tracks_recientes[clave] = ahora
+        if len(tracks_recientes) > MAX_TRACKS_RECIENTES:
+            tracks_recientes.popitem(last=False)
+    return False
 
-def mover_servo_default():
-    """Mueve servo a posición por defecto (0°) - Sin detección"""
-    logger.info("⏸ SIN DETECCIÓN → Moviendo servo a 0°")
-    return enviar_comando(CMD_RESET)
-
-# ============ FUNCIONES MQTT ============
+def topic_formatos():
+    """Topic retenido donde este controlador anuncia sus formatos de mensaje"""
+    return f"{payload_codec.FORMATS_TOPIC}/{ID_CLIENTE}"
 
 def on_connect(client, userdata, flags, rc):
     """Callback cuando se conecta al broker MQTT"""
     if rc == 0:
         logger.info(f"✓ Conectado al broker MQTT en {BROKER}:{PORT}")
-        client.subscribe(TOPIC)
-        logger.info(f"✓ Suscrito al topic: {TOPIC}")
+        for topic in registro.topics():
+            client.subscribe(topic)
+            logger.info(f"✓ Suscrito al topic: {topic}")
+        # Formatos que entiende este consumidor (lo borra el last will al caer)
+        client.publish(topic_formatos(), payload_codec.formats_announcement(), qos=1, retain=True)
     else:
         logger.error(f"✗ Error de conexión MQTT. Código: {rc}")
 
+def programar_activacion(actuador, llegada_ts, confianza, track_id=None, temporizador=scheduler):
+    """Programa la activación para que la compuerta actúe cuando llega el pistacho
+    
+    Args:
+        actuador: Actuator que debe moverse
+        llegada_ts: Hora prevista de llegada a la compuerta (epoch del detector)
+        confianza: Confianza de la detección
+        track_id: ID del track (solo para logs)
+        temporizador: DeadlineScheduler (o equivalente con call_at/pending)
+    """
+    # Pasar de reloj de pared a monotónico una sola vez, al recibir el mensaje
+    retraso = llegada_ts - time.time() - ACTUATION_LEAD_TIME
+    
+    if retraso > MAX_SCHEDULE_AHEAD:
+        logger.warning(f"Llegada prevista dentro de {retraso:.1f}s: estimación descartada, "
+                       f"activando ya (¿relojes sin sincronizar?)")
+        actuador.activate(confianza, track_id)
+    elif retraso <= 0:
+        logger.warning(f"⚠ Detección llegó {-retraso*1000:.0f}ms tarde - activando ya")
+        actuador.activate(confianza, track_id)
+    else:
+        temporizador.call_at(time.monotonic() + retraso, actuador.activate, confianza, track_id)
+        logger.info(f"⏲ [{actuador.name}] Activación programada en {retraso*1000:.0f}ms "
+                    f"(pendientes: {temporizador.pending()})")
+
 def on_message(client, userdata, msg):
     """Callback cuando llega un mensaje MQTT"""
-    global last_detection_time, last_movement_time
+    procesar_mensaje(msg.topic, msg.payload)
+
+def procesar_mensaje(topic, payload, temporizador=scheduler):
+    """Decodifica un mensaje (detección suelta o lote) y procesa cada detección
     
+    Compartido con el controlador asyncio (control_servo_async.py), que
+    pasa su propio temporizador sobre el bucle de eventos.
+    """
     try:
-        payload = msg.payload.decode()
-        logger.debug(f"MQTT recibido: {payload}")
-        
-        # Parsear JSON
-        data = json.loads(payload)
-        
-        if 'objeto' not in data or 'confianza' not in data:
-            logger.warning("Mensaje MQTT sin campos requeridos")
-            return
-        
-        objeto = data['objeto']
-        confianza = float(data['confianza'])
-        
-        logger.info(f"📡 Detección: {objeto} ({confianza:.2%})")
-        
-        # VALIDAR: Solo pistachos con confianza >= 60%
-        if "pistachio" in objeto.lower() and confianza >= CONFIDENCE_THRESHOLD:
-            # Actualizar timestamp de última detección
-            last_detection_time = time.time()
-            
-            # Verificar cooldown de movimiento (no mover muy seguido)
-            time_since_last_move = time.time() - last_movement_time
-            
-            if time_since_last_move >= MOVEMENT_COOLDOWN:
-                logger.info(f"🎯 PISTACHO VÁLIDO ({confianza:.2%}) - Activando servo")
-                if mover_servo_pistacho():
-                    last_movement_time = time.time()
-            else:
-                wait_time = MOVEMENT_COOLDOWN - time_since_last_move
-                logger.info(f"⏳ Cooldown activo. Espera {wait_time:.1f}s más")
-        else:
-            if confianza < CONFIDENCE_THRESHOLD:
-                logger.info(f"⚠ Confianza {confianza:.2%} < {CONFIDENCE_THRESHOLD:.0%} - IGNORADO")
-            else:
-                logger.info(f"⚠ Objeto '{objeto}' no es pistacho - IGNORADO")
+        # JSON o binario (bin1), se detecta por el primer byte
+        detecciones = payload_codec.decode_detections(payload)
+    except ValueError as e:
+        logger.error(f"Error decodificando mensaje: {e}")
+        return
     
-    except json.JSONDecodeError as e:
-        logger.error(f"Error parseando JSON: {e}")
-    except Exception as e:
-        logger.error(f"Error procesando mensaje: {e}")
+    if len(detecciones) > 1:
+        logger.debug(f"Lote de {len(detecciones)} detecciones en {topic}")
+    for data in detecciones:
+        try:
+            procesar_deteccion(topic, data, temporizador)
+        except Exception as e:
+            logger.error(f"Error procesando mensaje: {e}")
 
-def verificar_timeout_deteccion():
-    """Verifica si han pasado 5 segundos sin detección"""
-    global last_detection_time, last_movement_time
+def procesar_deteccion(topic, data, temporizador=scheduler):
+    """Valida una detección y la pasa a sus compuertas sin bloquear"""
+    logger.debug(f"MQTT recibido: {data}")
     
-    if last_detection_time is None:
+    if 'objeto' not in data or 'confianza' not in data:
+        logger.warning("Mensaje MQTT sin campos requeridos")
         return
     
-    tiempo_sin_deteccion = time.time() - last_detection_time
+    objeto = data['objeto']
+    confianza = float(data['confianza'])
     
-    if tiempo_sin_deteccion >= NO_DETECTION_TIMEOUT:
-        # Han pasado 5 segundos sin detección
-        time_since_last_move = time.time() - last_movement_time
-        
-        if time_since_last_move >= MOVEMENT_COOLDOWN:
-            logger.info(f"⏱ {NO_DETECTION_TIMEOUT}s sin detección - Reseteando servo")
-            if mover_servo_default():
-                last_movement_time = time.time()
-                last_detection_time = None  # Reset para no ejecutar repetidamente
+    actuadores = registro.route(topic, data)
+    if not actuadores:
+        logger.debug(f"Mensaje en {topic} sin compuerta asignada - IGNORADO")
+        return
+    
+    if es_track_repetido(data):
+        logger.debug(f"Track #{data['track_id']} repetido - IGNORADO")
+        return
+    
+    logger.info(f"📡 Detección: {objeto} ({confianza:.2%})")
+    
+    # VALIDAR: Solo pistachos con confianza >= 60%
+    if "pistachio" in objeto.lower() and confianza >= CONFIDENCE_THRESHOLD:
+        for actuador in actuadores:
+            # Actualizar timestamp de última detección
+            actuador.detection()
+            
+            if 'llegada_ts' in data:
+                programar_activacion(actuador, float(data['llegada_ts']), confianza,
+                                     data.get('track_id'), temporizador)
+            else:
+                actuador.activate(confianza, data.get('track_id'))
+    else:
+        if confianza < CONFIDENCE_THRESHOLD:
+            logger.info(f"⚠ Confianza {confianza:.2%} < {CONFIDENCE_THRESHOLD:.0%} - IGNORADO")
+        else:
+            logger.info(f"⚠ Objeto '{objeto}' no es pistacho - IGNORADO")
 
 # ============ MAIN ============
 
 def main():
     """Función principal"""
-    global arduino_serial
-    
     logger.info("="*60)
     logger.info("Control Directo Servo - RPi5 → Arduino")
     logger.info(f"Broker MQTT: {BROKER}:{PORT}")
-    logger.info(f"Arduino: {SERIAL_PORT} @ {BAUDRATE}")
+    for config in ACTUADORES:
+        logger.info(f"Compuerta {config['nombre']}: {config['puerto']} servo {config.get('servo', 0)} "
+                    f"@ {BAUDRATE} (protocolo: {PROTOCOLO})")
     logger.info(f"Umbral confianza: {CONFIDENCE_THRESHOLD:.0%}")
     logger.info(f"Timeout sin detección: {NO_DETECTION_TIMEOUT}s")
     logger.info("="*60)
     
-    # 1. Conectar Arduino
-    if not conectar_arduino():
+    # 1. Conectar Arduinos y registrar compuertas
+    if not crear_actuadores():
         logger.error("No se pudo conectar con Arduino. Abortando.")
         logger.error("\nSOLUCIONES:")
         logger.error("1. Verifica que Arduino esté conectado: ls -l /dev/ttyUSB*")
         logger.error("2. Verifica permisos: groups | grep dialout")
         logger.error("3. Si no estás en dialout: sudo usermod -a -G dialout $USER")
         logger.error("4. Prueba con otro puerto: SERIAL_PORT = '/dev/ttyACM0'")
+        cerrar_actuadores()
         return
     
-    # 2. Conectar MQTT
+    # 2. Temporizador de actuaciones programadas y vueltas a reposo
+    scheduler.start()
+    
+    # 3. Conectar MQTT
     try:
-        client = mqtt.Client(client_id=f"rpi5_control_{int(time.time())}")
+        client = mqtt.Client(client_id=ID_CLIENTE)
+        client.will_set(topic_formatos(), b"", qos=1, retain=True)
         client.on_connect = on_connect
         client.on_message = on_message
         
@@ -259,22 +393,23 @@ def main():
         logger.error("\nSOLUCIONES:")
         logger.error("1. Verifica que Mosquitto esté corriendo: sudo docker ps | grep mosquitto")
         logger.error("2. Inicia el broker: sudo docker start mosquitto")
-        arduino_serial.close()
+        scheduler.stop()
+        cerrar_actuadores()
         return
     
-    # 3. Loop principal
+    # 4. Loop principal
     logger.info("\n🚀 Sistema iniciado. Presiona Ctrl+C para salir.\n")
     
     try:
         # Posición inicial
         time.sleep(1)
-        logger.info("Posicionando servo en estado inicial (0°)...")
-        mover_servo_default()
+        logger.info("Posicionando compuertas en estado inicial (0°)...")
+        for actuador in registro:
+            actuador.reset()
         
-        while True:
-            # Verificar timeout de detección cada segundo
-            verificar_timeout_deteccion()
-            time.sleep(1)
+        # Todo ocurre en los hilos de MQTT, del temporizador y de los canales
+        # serie: el hilo principal solo espera (sin despertares periódicos)
+        detener.wait()
             
     except KeyboardInterrupt:
         logger.info("\n\n⚠ Interrupción por usuario (Ctrl+C)")
@@ -282,14 +417,22 @@ def main():
     finally:
         # Limpieza
         logger.info("Cerrando conexiones...")
+        scheduler.stop()
+        logger.info(f"Actuaciones programadas ejecutadas: {scheduler.executed} "
+                    f"(retraso máximo {scheduler.max_lateness*1000:.1f}ms)")
         
-        if arduino_serial and arduino_serial.is_open:
-            logger.info("Reseteando servo a posición inicial...")
-            enviar_comando(CMD_RESET)
-            time.sleep(1)
-            arduino_serial.close()
-            logger.info("✓ Arduino desconectado")
+        for actuador in registro:
+            logger.info(f"Compuerta {actuador.name}: {actuador.summary()}")
+        
+        logger.info("Reseteando compuertas a posición inicial...")
+        cerrar_actuadores()
+        logger.info("✓ Arduino desconectado")
         
+        try:
+            # Borrar el anuncio de formatos (un cierre limpio no dispara el last will)
+            client.publish(topic_formatos(), b"", qos=1, retain=True).wait_for_publish(timeout=1)
+        except Exception:
+            pass
         client.loop_stop()
         client.disconnect()
         logger.info("✓ MQTT desconectado")
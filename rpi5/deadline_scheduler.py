@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+"""
+deadline_scheduler.py
+Cola de temporizadores sobre time.monotonic()
+
+Un único hilo duerme exactamente hasta el próximo vencimiento (o
+indefinidamente si no hay nada programado: cero despertares en reposo) y
+ejecuta los callbacks en orden. Se usa para programar actuaciones del servo
+en el instante previsto de llegada del pistacho.
+"""
+
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduledCall:
+    """Llamada programada; cancel() evita que se ejecute"""
+
+    __slots__ = ('deadline', 'callback', 'args', 'cancelled')
+
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class DeadlineScheduler:
+    """Ejecuta callbacks en instantes absolutos de time.monotonic()"""
+
+    def __init__(self, name="temporizador"):
+        self.name = name
+        self._heap = []
+        self._counter = itertools.count()  # Desempate estable entre vencimientos iguales
+        self._cond = threading.Condition()
+        self._running = False
+        self._thread = None
+
+        # Estadísticas: retraso real respecto al vencimiento
+        self.executed = 0
+        self.max_lateness = 0.0
+
+    def start(self):
+        """Arranca el hilo del planificador"""
+        if self._running:
+            return self
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+        return self
+
+    def call_at(self, deadline, callback, *args):
+        """Programa callback(*args) en el instante `deadline` (time.monotonic())"""
+        call = ScheduledCall(deadline, callback, args)
+        with self._cond:
+            heapq.heappush(self._heap, (deadline, next(self._counter), call))
+            # Solo hace falta despertar al hilo si este es el nuevo primero
+            if self._heap[0][2] is call:
+                self._cond.notify()
+        return call
+
+    def call_later(self, delay, callback, *args):
+        """Programa callback(*args) dentro de `delay` segundos"""
+        return self.call_at(time.monotonic() + delay, callback, *args)
+
+    def pending(self):
+        """Número de llamadas pendientes (sin contar las canceladas)"""
+        with self._cond:
+            return sum(1 for _, _, call in self._heap if not call.cancelled)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running:
+                    # Descartar canceladas en cabeza para no despertar por ellas
+                    while self._heap and self._heap[0][2].cancelled:
+                        heapq.heappop(self._heap)
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    delay = self._heap[0][0] - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+
+                if not self._running:
+                    return
+                _, _, call = heapq.heappop(self._heap)
+
+            lateness = time.monotonic() - call.deadline
+            self.executed += 1
+            self.max_lateness = max(self.max_lateness, lateness)
+            try:
+                call.callback(*call.args)
+            except Exception as e:
+                logger.error(f"Error en llamada programada: {e}", exc_info=True)
+
+    def stop(self):
+        """Detiene el hilo (las llamadas pendientes no se ejecutan)"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=2)
+            self._thread = None
@@ -20,6 +20,8 @@ import time
 import serial
 import serial.tools.list_ports
 
+from serial_config import BAUDRATE, STOPBITS
+
 # Colores para terminal
 class Color:
     GREEN = '\033[92m'
@@ -180,7 +182,7 @@ def check_port_permissions(port_name):
         print_error(f"Error verificando permisos: {e}")
         return False
 
-def test_serial_communication(port_name, baudrate=9600):
+def test_serial_communication(port_name, baudrate=BAUDRATE):
     """Prueba la comunicación serial con el Arduino"""
     print_header("5. PRUEBA DE COMUNICACIÓN SERIAL")
     
@@ -196,7 +198,7 @@ def test_serial_communication(port_name, baudrate=9600):
             baudrate=baudrate,
             bytesize=serial.EIGHTBITS,
             parity=serial.PARITY_NONE,
-            stopbits=serial.STOPBITS_TWO,
+            stopbits=serial.STOPBITS_TWO if STOPBITS == 2 else serial.STOPBITS_ONE,
             timeout=2
         )
         
@@ -245,7 +247,7 @@ def test_serial_communication(port_name, baudrate=9600):
         print_warn("\n⚠ El puerto se abre, pero la comunicación no es clara")
         print_info("Posibles causas:")
         print("  - Arduino no tiene el sketch correcto cargado")
-        print("  - Baudrate incorrecto (verifica que sea 9600)")
+        print(f"  - Baudrate incorrecto (verifica que sea {BAUDRATE})")
         print("  - Arduino necesita tiempo adicional para iniciar")
         
         return True  # El puerto funciona, aunque no hay comunicación clara
@@ -365,7 +367,7 @@ def main():
         print_info("\nEl sistema debería funcionar correctamente")
         print_info(f"Puerto Arduino detectado: {arduino_port}")
         print_info("\nUsa este puerto en tu código Python:")
-        print(f"  ser = serial.Serial('{arduino_port}', 9600)")
+        print(f"  ser = serial.Serial('{arduino_port}', {BAUDRATE})")
     else:
         print_error("═══ ALGUNOS DIAGNÓSTICOS FALLARON ═══")
         print_info("\nRevisa los mensajes anteriores para solucionar los problemas")
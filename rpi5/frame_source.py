@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+frame_source.py
+Fuentes de frames que entregan siempre el frame más reciente
+
+Con V4L2, si la inferencia va más lenta que la cámara, el buffer del driver
+se llena y cap.read() devuelve frames de hace cientos de ms. FrameSource
+lee la cámara en un hilo propio, se queda solo con el último frame y lo
+entrega con su número de secuencia y el instante de captura, para poder
+medir la latencia de extremo a extremo (fotón → servo).
+
+VideoFileSource e ImageDirSource reproducen un vídeo grabado o un
+directorio de imágenes con la misma interfaz (ver replay.py): al ritmo
+grabado, como una cámara, o lo más rápido posible sin perder frames.
+"""
+
+import abc
+import logging
+import os
+import threading
+import time
+from collections import namedtuple
+
+import cv2
+
+logger = logging.getLogger(__name__)
+
+
+class CapturedFrame(namedtuple('CapturedFrame', ['image', 'seq', 'timestamp', 'wall_time'])):
+    """Frame capturado
+
+    Attributes:
+        image: Imagen BGR (numpy array)
+        seq: Número de secuencia de captura (empieza en 1)
+        timestamp: Instante de captura en time.monotonic()
+        wall_time: Instante de captura en time.time() (para enviar a otras máquinas)
+    """
+    __slots__ = ()
+
+    def age(self, now=None):
+        """Edad del frame en segundos"""
+        if now is None:
+            now = time.monotonic()
+        return now - self.timestamp
+
+
+class LatestFrameSource(abc.ABC):
+    """Base de las fuentes que entregan solo el frame más reciente
+
+    Un hilo productor (_produce) publica cada frame con _publish(); read()
+    espera uno más nuevo que el último entregado. Los frames que nunca
+    llegan a entregarse se cuentan como descartados.
+    """
+
+    thread_prefix = "fuente"
+
+    def __init__(self, name, stats=None):
+        """
+        Args:
+            name: Nombre para logs e hilos
+            stats: StageStats opcional donde registrar el tiempo de captura
+        """
+        self.name = name
+        self.stats = stats
+        self._cond = threading.Condition()
+        self._latest = None
+        self._last_delivered = 0
+        self._listeners = []  # threading.Event avisados con cada frame nuevo
+        self._running = False
+        self._thread = None
+
+        # Estadísticas
+        self.captured = 0
+        self.delivered = 0
+        self.errors = 0
+
+    @abc.abstractmethod
+    def _produce(self):
+        """Bucle del hilo productor: publica frames mientras _running"""
+
+    def _close(self):
+        """Libera el origen de los frames (cámara, vídeo...)"""
+
+    def start(self):
+        """Arranca el hilo productor"""
+        if self._running:
+            return self
+        self._running = True
+        self._thread = threading.Thread(target=self._produce,
+                                        name=f"{self.thread_prefix}-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def _publish(self, image, timestamp, wall_time):
+        """Sustituye el último frame y avisa a read() y a los listeners"""
+        with self._cond:
+            self.captured += 1
+            self._latest = CapturedFrame(image, self.captured, timestamp, wall_time)
+            self._cond.notify_all()
+        for event in self._listeners:
+            event.set()
+
+    def read(self, timeout=1.0):
+        """Espera un frame más nuevo que el último entregado
+
+        Returns:
+            CapturedFrame o None si no llegó ninguno en `timeout` segundos
+        """
+        with self._cond:
+            ready = self._cond.wait_for(
+                lambda: (self._latest is not None and self._latest.seq > self._last_delivered)
+                or not self._running,
+                timeout)
+            if not ready or not self._running:
+                return None
+
+            frame = self._latest
+            self._last_delivered = frame.seq
+            self.delivered += 1
+            return frame
+
+    def add_listener(self, event):
+        """Activa `event` (threading.Event) cada vez que hay un frame nuevo
+
+        Permite esperar a la primera de varias fuentes sin sondearlas.
+        """
+        self._listeners.append(event)
+
+    @property
+    def dropped(self):
+        """Frames capturados que nunca se entregaron por llegar uno más nuevo"""
+        return self.captured - self.delivered
+
+    def stop(self):
+        """Detiene el hilo productor (no libera el origen)"""
+        self._running = False
+        with self._cond:
+            self._cond.notify_all()
+        if self._thread:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def release(self):
+        """Detiene el hilo productor y libera el origen"""
+        self.stop()
+        self._close()
+
+
+class FrameSource(LatestFrameSource):
+    """Captura la cámara en segundo plano y entrega solo el frame más reciente"""
+
+    thread_prefix = "captura"
+
+    def __init__(self, cap, name="camara", stats=None):
+        """
+        Args:
+            cap: cv2.VideoCapture ya abierto (ver initialize_camera)
+            name: Nombre para logs e hilos
+            stats: StageStats opcional donde registrar el tiempo de captura
+        """
+        super().__init__(name, stats)
+        self.cap = cap
+
+    def start(self):
+        """Arranca el hilo de captura"""
+        if not self._running:
+            super().start()
+            logger.info(f"✓ Captura en segundo plano iniciada ({self.name})")
+        return self
+
+    def _produce(self):
+        while self._running:
+            start = time.perf_counter()
+            # grab() vuelve en cuanto el driver tiene el frame: es el mejor
+            # instante disponible para estampar la captura
+            if not self.cap.grab():
+                self.errors += 1
+                logger.error(f"Error leyendo frame de cámara ({self.name})")
+                time.sleep(0.1)
+                continue
+            timestamp = time.monotonic()
+            wall_time = time.time()
+
+            ret, image = self.cap.retrieve()
+            if not ret:
+                self.errors += 1
+                logger.error(f"Error decodificando frame de cámara ({self.name})")
+                time.sleep(0.1)
+                continue
+
+            if self.stats is not None:
+                self.stats.record('captura', time.perf_counter() - start)
+
+            self._publish(image, timestamp, wall_time)
+
+    def _close(self):
+        self.cap.release()
+
+
+# ============ FUENTES GRABADAS ============
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+
+
+class ReplaySource(LatestFrameSource):
+    """Base de las fuentes grabadas, con la interfaz de FrameSource
+
+    realtime=True: un hilo entrega los frames al ritmo grabado (fps) y,
+    como con la cámara, solo se queda con el último; los que la inferencia
+    no alcanza se cuentan como descartados. realtime=False: read() devuelve
+    el siguiente frame en el acto, sin esperas ni descartes (todos los
+    frames, en orden: resultados reproducibles). En ese modo read() debe
+    llamarse desde un único hilo.
+
+    captura se estampa al entregar el frame (tiempo real) o al leerlo
+    (rápido), para que las latencias se midan igual que con la cámara.
+    Las subclases implementan _next_image() y _rewind().
+    """
+
+    thread_prefix = "replay"
+
+    def __init__(self, name, fps, realtime=True, loop=False, stats=None):
+        """
+        Args:
+            name: Nombre para logs e hilos
+            fps: Ritmo de reproducción en tiempo real
+            realtime: True = al ritmo grabado; False = lo más rápido posible
+            loop: Volver a empezar al terminar (solo tiempo real)
+            stats: StageStats opcional donde registrar el tiempo de decodificación
+        """
+        super().__init__(name, stats)
+        self.fps = fps
+        self.realtime = realtime
+        self.loop = loop
+        self._exhausted = False
+
+    @abc.abstractmethod
+    def _next_image(self):
+        """Siguiente imagen BGR, o None al final de la grabación"""
+
+    @abc.abstractmethod
+    def _rewind(self):
+        """Vuelve al principio de la grabación"""
+
+    def _decode(self):
+        start = time.perf_counter()
+        image = self._next_image()
+        if image is None and self.loop and self.realtime and self.captured:
+            self._rewind()
+            image = self._next_image()
+        if image is not None and self.stats is not None:
+            self.stats.record('captura', time.perf_counter() - start)
+        return image
+
+    def start(self):
+        """Arranca la reproducción (en tiempo real, el hilo que marca el ritmo)"""
+        if self._running:
+            return self
+        if self.realtime:
+            super().start()
+        else:
+            self._running = True
+        logger.info(f"✓ Reproducción iniciada ({self.name}, "
+                    f"{f'{self.fps:.1f} fps' if self.realtime else 'lo más rápido posible'})")
+        return self
+
+    def _produce(self):
+        period = 1.0 / self.fps
+        next_due = time.monotonic()
+        while self._running:
+            image = self._decode()
+            if image is None:
+                break
+
+            # Decodificar antes y esperar al instante que marca la grabación
+            delay = next_due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            next_due = max(next_due + period, time.monotonic() - period)
+
+            self._publish(image, time.monotonic(), time.time())
+
+        with self._cond:
+            self._exhausted = True
+
+    def read(self, timeout=1.0):
+        """Siguiente frame (tiempo real: espera uno más nuevo que el último entregado)
+
+        Returns:
+            CapturedFrame o None si no llegó ninguno en `timeout` segundos o
+            la grabación terminó (ver finished)
+        """
+        if self.realtime:
+            return super().read(timeout)
+
+        if not self._running or self._exhausted:
+            return None
+        image = self._decode()
+        if image is None:
+            self._exhausted = True
+            return None
+        self.captured += 1
+        self.delivered += 1
+        return CapturedFrame(image, self.captured, time.monotonic(), time.time())
+
+    @property
+    def finished(self):
+        """La grabación terminó y ya se entregó el último frame"""
+        with self._cond:
+            return self._exhausted and (self._latest is None
+                                        or self._latest.seq <= self._last_delivered)
+
+
+class VideoFileSource(ReplaySource):
+    """Reproduce un vídeo grabado (cualquier formato que abra OpenCV)"""
+
+    def __init__(self, path, realtime=True, loop=False, stats=None, fps=None):
+        """
+        Args:
+            path: Ruta del vídeo
+            fps: Ritmo de reproducción (None = el del vídeo, 30 si no lo indica)
+            Resto: ver ReplaySource
+        """
+        self.path = path
+        self.cap = cv2.VideoCapture(path)
+        if not self.cap.isOpened():
+            raise RuntimeError(f"No se pudo abrir el vídeo: {path}")
+        fps = fps or self.cap.get(cv2.CAP_PROP_FPS) or 30.0
+        super().__init__(os.path.basename(path), fps, realtime, loop, stats)
+        self.frame_count = int(self.cap.get(cv2.CAP_PROP_FRAME_COUNT))
+
+    def _next_image(self):
+        ret, image = self.cap.read()
+        return image if ret else None
+
+    def _rewind(self):
+        self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def _close(self):
+        self.cap.release()
+
+
+class ImageDirSource(ReplaySource):
+    """Reproduce las imágenes de un directorio en orden alfabético"""
+
+    def __init__(self, path, fps=10.0, realtime=True, loop=False, stats=None):
+        """
+        Args:
+            path: Directorio con imágenes (IMAGE_EXTENSIONS)
+            fps: Ritmo de reproducción en tiempo real
+            Resto: ver ReplaySource
+        """
+        self.path = path
+        self.files = sorted(
+            os.path.join(path, name) for name in os.listdir(path)
+            if name.lower().endswith(IMAGE_EXTENSIONS))
+        if not self.files:
+            raise RuntimeError(f"No hay imágenes en {path}")
+        super().__init__(os.path.basename(os.path.normpath(path)), fps, realtime, loop, stats)
+        self.frame_count = len(self.files)
+        self._index = 0
+
+    def _next_image(self):
+        while self._index < len(self.files):
+            path = self.files[self._index]
+            self._index += 1
+            image = cv2.imread(path)
+            if image is not None:
+                return image
+            self.errors += 1
+            logger.warning(f"Imagen ilegible: {path}")
+        return None
+
+    def _rewind(self):
+        self._index = 0
+
+
+def open_replay_source(path, realtime=True, loop=False, stats=None, fps=None):
+    """VideoFileSource o ImageDirSource según la ruta sea un archivo o un directorio"""
+    if os.path.isdir(path):
+        return ImageDirSource(path, fps or 10.0, realtime, loop, stats)
+    return VideoFileSource(path, realtime, loop, stats, fps)
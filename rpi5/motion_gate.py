@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+"""
+motion_gate.py
+Filtro de movimiento previo a YOLO
+
+Entre lotes la cinta está vacía y YOLO procesa frames idénticos. MotionGate
+compara una versión reducida en escala de grises del frame (o de la ROI)
+con un fondo aprendido y solo deja pasar a inferencia los frames donde algo
+cambió. Opcionalmente devuelve la zona de los tiles que cambiaron para
+inferir solo ese recorte.
+
+Métodos:
+- diff: media móvil del fondo (cv2.accumulateWeighted) + diferencia absoluta
+- mog2: cv2.createBackgroundSubtractorMOG2 sobre la imagen reducida
+"""
+
+import logging
+import threading
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from roi import RegionOfInterest
+
+logger = logging.getLogger(__name__)
+
+MotionResult = namedtuple('MotionResult', ['changed', 'region', 'fraction'])
+MotionResult.__doc__ = """Resultado del filtro
+
+Attributes:
+    changed: True si hay que ejecutar la inferencia
+    region: RegionOfInterest con los tiles cambiados (coordenadas de la
+        imagen evaluada) o None para inferir la imagen completa
+    fraction: Fracción de tiles con cambios
+"""
+
+
+class _GateState:
+    """Fondo aprendido para una fuente concreta"""
+
+    def __init__(self):
+        self.background = None
+        self.subtractor = None
+        self.hold = 0
+
+
+class MotionGate:
+    """Decide si un frame merece pasar por YOLO"""
+
+    def __init__(self, method="diff", scale=0.25, pixel_threshold=25, tile_size=16,
+                 tile_threshold=0.05, hold_frames=3, learning_rate=0.5, tiles_only=False,
+                 max_region_fraction=0.7):
+        """
+        Args:
+            method: "diff" o "mog2"
+            scale: Factor de reducción antes de comparar (0.25 = 160x120 para 640x480)
+            pixel_threshold: Diferencia de gris mínima para marcar un píxel (método diff)
+            tile_size: Lado del tile en píxeles de la imagen reducida
+            tile_threshold: Fracción de píxeles cambiados para marcar un tile
+            hold_frames: Frames que se sigue infiriendo tras el último cambio
+                (un pistacho que se detiene en la cinta sigue detectándose)
+            learning_rate: Velocidad de adaptación del fondo
+            tiles_only: Devolver la región de los tiles cambiados
+            max_region_fraction: Si la región supera esta fracción del área,
+                se infiere la imagen completa
+        """
+        if method not in ("diff", "mog2"):
+            raise ValueError(f"Método de movimiento desconocido: {method}")
+        self.method = method
+        self.scale = scale
+        self.pixel_threshold = pixel_threshold
+        self.tile_size = tile_size
+        self.tile_threshold = tile_threshold
+        self.hold_frames = hold_frames
+        self.learning_rate = learning_rate
+        self.tiles_only = tiles_only
+        self.max_region_fraction = max_region_fraction
+
+        self._states = {}
+        self._lock = threading.Lock()
+
+        # Contadores
+        self.evaluated = 0
+        self.skipped = 0
+        self.partial = 0
+
+    def _state(self, key):
+        with self._lock:
+            state = self._states.get(key)
+            if state is None:
+                state = self._states[key] = _GateState()
+            return state
+
+    def _foreground(self, state, gray):
+        """Máscara float32 (0/1) de píxeles que difieren del fondo"""
+        if self.method == "mog2":
+            if state.subtractor is None:
+                state.subtractor = cv2.createBackgroundSubtractorMOG2(
+                    history=200, varThreshold=16, detectShadows=False)
+            mask = state.subtractor.apply(gray, learningRate=self.learning_rate * 0.02)
+            return (mask > 127).astype(np.float32)
+
+        if state.background is None or state.background.shape != gray.shape:
+            state.background = gray.astype(np.float32)
+            return np.ones(gray.shape, dtype=np.float32)
+
+        diff = cv2.absdiff(gray, cv2.convertScaleAbs(state.background))
+        cv2.accumulateWeighted(gray, state.background, self.learning_rate)
+        return (diff > self.pixel_threshold).astype(np.float32)
+
+    def check(self, image, key=None):
+        """Evalúa un frame (o recorte) BGR
+
+        Args:
+            image: Imagen a evaluar
+            key: Identificador de la fuente (un fondo independiente por cámara)
+
+        Returns:
+            MotionResult
+        """
+        state = self._state(key)
+        small = cv2.resize(image, None, fx=self.scale, fy=self.scale,
+                           interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+        mask = self._foreground(state, gray)
+
+        # Fracción de píxeles cambiados por tile (INTER_AREA promedia cada bloque)
+        height, width = mask.shape
+        tiles_x = max(1, -(-width // self.tile_size))
+        tiles_y = max(1, -(-height // self.tile_size))
+        tiles = cv2.resize(mask, (tiles_x, tiles_y), interpolation=cv2.INTER_AREA)
+        changed_tiles = tiles > self.tile_threshold
+        fraction = float(changed_tiles.mean())
+
+        self.evaluated += 1
+        if changed_tiles.any():
+            state.hold = self.hold_frames
+            region = self._region(changed_tiles, image.shape) if self.tiles_only else None
+            if region is not None:
+                self.partial += 1
+            return MotionResult(True, region, fraction)
+
+        if state.hold > 0:
+            state.hold -= 1
+            return MotionResult(True, None, fraction)
+
+        self.skipped += 1
+        return MotionResult(False, None, fraction)
+
+    def _region(self, changed_tiles, shape):
+        """Rectángulo envolvente de los tiles cambiados (+1 tile de margen) a escala real"""
+        rows, cols = np.nonzero(changed_tiles)
+        tile = self.tile_size / self.scale
+        height, width = shape[:2]
+
+        x1 = int(max(0, (cols.min() - 1) * tile))
+        y1 = int(max(0, (rows.min() - 1) * tile))
+        x2 = int(min(width, (cols.max() + 2) * tile))
+        y2 = int(min(height, (rows.max() + 2) * tile))
+
+        if (x2 - x1) * (y2 - y1) > self.max_region_fraction * width * height:
+            return None
+        return RegionOfInterest.from_rect(x1, y1, x2 - x1, y2 - y1)
+
+    def summary(self):
+        """Contadores de inferencias evaluadas, saltadas y parciales"""
+        ratio = self.skipped / self.evaluated if self.evaluated else 0.0
+        return {
+            'evaluados': self.evaluated,
+            'saltados': self.skipped,
+            'parciales': self.partial,
+            'ahorro': f"{ratio:.0%}",
+        }
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+mqtt_publisher.py
+Publicador MQTT que nunca bloquea el bucle de detección
+
+publish() solo serializa el mensaje y lo deja en un buffer circular; si
+hay conexión se envía en el acto (paho no bloquea al publicar). La
+conexión y las reconexiones las hace el hilo de red de paho en segundo
+plano (connect_async + loop_start) con espera exponencial entre intentos,
+así que una caída del broker no congela la cámara ni la inferencia: los
+FPS de detección se mantienen y los mensajes esperan en el buffer.
+
+Al reconectar, el buffer se vacía en orden (flush_on_reconnect) o se
+descarta si las detecciones viejas ya no sirven. Con el buffer lleno,
+drop_policy decide si se pierde el mensaje más antiguo o el nuevo.
+
+Los mensajes se serializan con payload_codec.py: JSON, binario compacto
+(bin1) o "auto", que elige según los formatos anunciados por los
+consumidores.
+
+publish_batch() agrupa varias detecciones en un solo mensaje (lote): las
+de un frame, o todas las de una ventana de batch_window segundos por topic.
+Con la cinta llena baja el número de mensajes por segundo y el coste fijo
+de cada uno en el broker y en los consumidores.
+"""
+
+import logging
+import threading
+import time
+from collections import deque
+
+import paho.mqtt.client as mqtt
+
+import payload_codec
+
+logger = logging.getLogger(__name__)
+
+DROP_OLDEST = "oldest"  # Buffer lleno: se descarta el mensaje más antiguo
+DROP_NEWEST = "newest"  # Buffer lleno: se descarta el mensaje nuevo
+
+
+class MQTTPublisher:
+    """Cliente MQTT con buffer de salida y reconexión en segundo plano"""
+
+    def __init__(self, broker, port, topic, qos=1, buffer_size=100, drop_policy=DROP_OLDEST,
+                 flush_on_reconnect=True, reconnect_min_delay=1, reconnect_max_delay=30,
+                 payload_format=payload_codec.FORMAT_JSON, batch_window=0.0):
+        """
+        Args:
+            broker, port: Broker MQTT
+            topic: Topic por defecto de publish()
+            qos: Quality of Service de las publicaciones
+            buffer_size: Mensajes retenidos mientras no hay conexión
+            drop_policy: DROP_OLDEST o DROP_NEWEST con el buffer lleno
+            flush_on_reconnect: Enviar lo retenido al reconectar (False = descartarlo)
+            reconnect_min_delay, reconnect_max_delay: Espera entre reintentos
+                (segundos; se duplica en cada fallo hasta el máximo)
+            payload_format: payload_codec.FORMAT_JSON, FORMAT_BINARY o
+                FORMAT_AUTO (negociado con los anuncios de los consumidores)
+            batch_window: Segundos que publish_batch() acumula detecciones
+                de un topic antes de enviarlas (0 = un lote por llamada)
+        """
+        if drop_policy not in (DROP_OLDEST, DROP_NEWEST):
+            raise ValueError(f"drop_policy desconocida: {drop_policy}")
+        self.broker = broker
+        self.port = port
+        self.topic = topic
+        self.qos = qos
+        self.buffer_size = buffer_size
+        self.drop_policy = drop_policy
+        self.flush_on_reconnect = flush_on_reconnect
+        self.reconnect_min_delay = reconnect_min_delay
+        self.reconnect_max_delay = reconnect_max_delay
+        self.payload_format = payload_format
+        self._negotiator = payload_codec.FormatNegotiator()
+        self.batch_window = batch_window
+        self._batches = {}  # Topic -> (inicio de la ventana, detecciones acumuladas)
+
+        self.client = None
+        self.connected = False
+        self._connected_event = threading.Event()
+        self._buffer = deque()
+        self._lock = threading.Lock()  # Buffer y orden de envío
+
+        # Estadísticas
+        self.sent = 0
+        self.dropped = 0
+        self.max_buffered = 0
+        self.reconnects = 0
+        self.batches_sent = 0
+        self.batched_detections = 0
+
+    def on_connect(self, client, userdata, flags, rc):
+        """Callback cuando se conecta al broker (hilo de red de paho)"""
+        if rc != 0:
+            self.connected = False
+            logger.error(f"✗ Error de conexión MQTT. Código: {rc}")
+            return
+
+        if self._connected_event.is_set():
+            self.reconnects += 1
+        self._connected_event.set()
+        logger.info(f"✓ Conectado al broker MQTT en {self.broker}:{self.port}")
+
+        if self.payload_format == payload_codec.FORMAT_AUTO:
+            client.subscribe(f"{payload_codec.FORMATS_TOPIC}/+", qos=1)
+
+        with self._lock:
+            self.connected = True
+            if self._buffer and not self.flush_on_reconnect:
+                logger.warning(f"⚠ Descartando {len(self._buffer)} mensajes retenidos "
+                               f"durante la desconexión")
+                self.dropped += len(self._buffer)
+                self._buffer.clear()
+            elif self._buffer:
+                logger.info(f"📤 Enviando {len(self._buffer)} mensajes retenidos")
+            self._drain()
+
+    def on_message(self, client, userdata, msg):
+        """Anuncio de formatos de un consumidor (modo auto)"""
+        if self._negotiator.update(msg.topic, msg.payload):
+            logger.info(f"Formato de publicación negociado: {self._negotiator.choose()} "
+                        f"({self._negotiator.count()} consumidores anunciados)")
+
+    def current_format(self):
+        """Formato con el que se serializa el próximo mensaje"""
+        if self.payload_format == payload_codec.FORMAT_AUTO:
+            return self._negotiator.choose()
+        return self.payload_format
+
+    def on_disconnect(self, client, userdata, rc):
+        """Callback cuando se desconecta del broker"""
+        self.connected = False
+        if rc != 0:
+            logger.warning(f"⚠ Desconectado inesperadamente. Código: {rc}. "
+                           f"Reconectando en segundo plano...")
+
+    def connect(self, timeout=5.0):
+        """Arranca la conexión en segundo plano
+
+        Args:
+            timeout: Segundos que se espera a la primera conexión (solo al
+                     arrancar; si vence se sigue reintentando en segundo plano)
+
+        Returns:
+            bool: True si ya hay conexión
+        """
+        self.client = mqtt.Client(client_id=f"rpi5_detector_{int(time.time())}")
+        self.client.on_connect = self.on_connect
+        self.client.on_disconnect = self.on_disconnect
+        self.client.on_message = self.on_message
+        self.client.reconnect_delay_set(self.reconnect_min_delay, self.reconnect_max_delay)
+
+        logger.info(f"Conectando a MQTT broker {self.broker}:{self.port} en segundo plano...")
+        self.client.connect_async(self.broker, self.port, keepalive=60)
+        self.client.loop_start()  # Conexión, reconexiones y envío en el hilo de paho
+        return self._connected_event.wait(timeout)
+
+    def publish(self, payload, topic=None):
+        """Encola un mensaje y lo envía si hay conexión (nunca bloquea)
+
+        Args:
+            payload: Dict de detección, o lista de dicts (un lote)
+            topic: Topic del mensaje (None = topic por defecto)
+
+        Returns:
+            bool: False si el mensaje se descartó por tener el buffer lleno
+        """
+        message = (topic or self.topic, payload_codec.encode(payload, self.current_format()))
+        with self._lock:
+            accepted = True
+            if len(self._buffer) >= self.buffer_size:
+                self.dropped += 1
+                if self.drop_policy == DROP_NEWEST:
+                    accepted = False
+                else:
+                    self._buffer.popleft()
+            if accepted:
+                self._buffer.append(message)
+                self.max_buffered = max(self.max_buffered, len(self._buffer))
+            if self.connected:
+                self._drain()
+
+        if not accepted:
+            logger.warning("Buffer MQTT lleno: mensaje descartado")
+        elif not self.connected:
+            logger.debug(f"Sin conexión MQTT: mensaje retenido ({self.buffered()} en buffer)")
+        return accepted
+
+    def publish_batch(self, payloads, topic=None):
+        """Publica varias detecciones en un único mensaje (nunca bloquea)
+
+        Con batch_window > 0 las detecciones se acumulan por topic y el lote
+        sale en la primera llamada tras vencer la ventana; conviene llamar en
+        cada frame, aunque sea con la lista vacía, para que ninguna ventana
+        se quede esperando.
+
+        Returns:
+            int: Detecciones aceptadas (enviadas, retenidas o en ventana)
+        """
+        topic = topic or self.topic
+        now = time.monotonic()
+        accepted = 0
+        if self.batch_window <= 0:
+            if payloads:
+                accepted = self._publish_batch_now(payloads, topic)
+        else:
+            if payloads:
+                start, pending = self._batches.setdefault(topic, (now, []))
+                pending.extend(payloads)
+                accepted = len(payloads)
+            for key, (start, pending) in list(self._batches.items()):
+                if now - start >= self.batch_window:
+                    del self._batches[key]
+                    self._publish_batch_now(pending, key)
+        return accepted
+
+    def flush_batches(self):
+        """Envía los lotes con ventana abierta (al salir)"""
+        batches, self._batches = self._batches, {}
+        for topic, (_, pending) in batches.items():
+            self._publish_batch_now(pending, topic)
+
+    def _publish_batch_now(self, payloads, topic):
+        accepted = 0
+        for i in range(0, len(payloads), payload_codec.BATCH_MAX):
+            chunk = payloads[i:i + payload_codec.BATCH_MAX]
+            if self.publish(chunk, topic):
+                accepted += len(chunk)
+                self.batches_sent += 1
+                self.batched_detections += len(chunk)
+        return accepted
+
+    def _drain(self):
+        """Envía lo retenido en orden (llamar con _lock tomado)"""
+        while self._buffer:
+            topic, data = self._buffer[0]
+            try:
+                result = self.client.publish(topic, data, qos=self.qos)
+            except Exception as e:
+                logger.error(f"Excepción publicando: {e}")
+                return
+            if result.rc == mqtt.MQTT_ERR_NO_CONN:
+                # La conexión cayó antes de on_disconnect: retener lo que
+                # queda. Con QoS > 0 paho ya guardó este mensaje y lo
+                # reenviará al reconectar; con QoS 0 se reintenta desde aquí
+                self.connected = False
+                if self.qos == 0:
+                    return
+            self._buffer.popleft()
+            if result.rc in (mqtt.MQTT_ERR_SUCCESS, mqtt.MQTT_ERR_NO_CONN):
+                self.sent += 1
+                logger.info(f"📤 MQTT publicado ({len(data)} bytes)")
+                if not self.connected:
+                    return
+            else:
+                self.dropped += 1
+                logger.error(f"Error publicando. Código: {result.rc}")
+
+    def buffered(self):
+        """Mensajes a la espera de conexión"""
+        with self._lock:
+            return len(self._buffer)
+
+    def summary(self):
+        return {
+            'enviados': self.sent,
+            'descartados': self.dropped,
+            'en_buffer': self.buffered(),
+            'buffer_max': self.max_buffered,
+            'reconexiones': self.reconnects,
+            'lotes': self.batches_sent,
+            'detecciones_por_lote': (round(self.batched_detections / self.batches_sent, 2)
+                                     if self.batches_sent else 0),
+        }
+
+    def disconnect(self):
+        """Desconecta del broker"""
+        if self.client:
+            self.flush_batches()
+            logger.info(f"MQTT: {self.summary()}")
+            self.client.disconnect()
+            self.client.loop_stop()
+            logger.info("Desconectado de MQTT")
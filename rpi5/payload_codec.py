@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+payload_codec.py
+Formato de los mensajes de detección: binario compacto versionado o JSON
+
+El JSON de cada detección ocupa ~250 bytes (con la hora ISO como texto) y
+cada consumidor lo vuelve a parsear. El formato binario "bin1" empaqueta
+los mismos datos con struct en 40 bytes de cabecera fija, más el nombre de
+la cámara al final:
+
+    MAGIC (0xD7) | VERSIÓN (1) | FLAGS u8 | CLASE u8 | CONFIANZA u16 (x10000)
+    | SEQ u32 | TRACK u32 | CAPTURA_MS u64 | LLEGADA_MS u64 | VELOCIDAD i16 (px/s)
+    | BBOX 4 x u16 | CÁMARA (utf-8, resto del mensaje)
+
+Todo little-endian. FLAGS indica qué campos opcionales son válidos y si la
+clase es un pistacho (los consumidores no necesitan la tabla de clases del
+modelo). Un JSON empieza por '{', así que decode() acepta ambos formatos
+sin más información: los consumidores entienden siempre los dos.
+
+Lotes: el detector puede agrupar todas las detecciones de un frame (o de
+una ventana de N ms) en un único mensaje. En JSON es {"detecciones": [...]}
+con un dict completo por detección; en binario, MAGIC_LOTE (0xD8) | VERSIÓN
+| N u8 | N cabeceras bin1 de 40 bytes | CÁMARA (común a todo el lote).
+decode_detections() devuelve siempre una lista, sea lote o detección suelta.
+
+Negociación: cada consumidor publica (retenido) en FORMATS_TOPIC/<cliente>
+los formatos que entiende, y lo borra con su last will al desconectarse.
+El publicador en modo "auto" usa bin1 solo si todos los consumidores
+anunciados lo entienden; si alguno no, o no hay ninguno, JSON. Los
+consumidores antiguos que no anuncian nada no se ven: con ellos en la red
+configurar el publicador en "json".
+
+Compatible con MicroPython (ver picow/payload_codec.py, solo decodificación).
+"""
+
+import json
+import struct
+import threading
+
+MAGIC = 0xD7
+MAGIC_LOTE = 0xD8
+VERSION = 1
+
+FORMAT_JSON = "json"
+FORMAT_BINARY = "bin1"
+FORMAT_AUTO = "auto"
+SUPPORTED_FORMATS = (FORMAT_BINARY, FORMAT_JSON)  # Preferencia de mayor a menor
+
+FORMATS_TOPIC = "robot/formatos"  # Anuncios retenidos: FORMATS_TOPIC/<cliente>
+
+HEADER = '<BBBBHIIQQh4H'
+HEADER_SIZE = struct.calcsize(HEADER)  # 40 bytes
+BATCH_HEADER = '<BBB'
+BATCH_HEADER_SIZE = struct.calcsize(BATCH_HEADER)
+BATCH_MAX = 255  # Detecciones por lote binario (N es u8)
+BATCH_KEY = "detecciones"  # Clave de la lista en un lote JSON
+
+FLAG_PISTACHIO = 0x01
+FLAG_TRACK = 0x02
+FLAG_LLEGADA = 0x04
+FLAG_VELOCIDAD = 0x08
+FLAG_BBOX = 0x10
+
+
+def _clamp(value, low, high):
+    return max(low, min(high, int(value)))
+
+
+def _pack_record(payload):
+    """Cabecera bin1 de 40 bytes de una detección (sin la cámara)"""
+    flags = FLAG_PISTACHIO if "pistachio" in payload.get("objeto", "").lower() else 0
+    track_id = payload.get("track_id")
+    llegada = payload.get("llegada_ts")
+    velocidad = payload.get("velocidad_px_s")
+    bbox = payload.get("bbox")
+    if track_id is not None:
+        flags |= FLAG_TRACK
+    if llegada is not None:
+        flags |= FLAG_LLEGADA
+    if velocidad is not None:
+        flags |= FLAG_VELOCIDAD
+    if bbox is not None:
+        flags |= FLAG_BBOX
+    else:
+        bbox = (0, 0, 0, 0)
+
+    return struct.pack(
+        HEADER, MAGIC, VERSION, flags,
+        _clamp(payload.get("clase_id", 0), 0, 255),
+        _clamp(round(float(payload["confianza"]) * 10000), 0, 10000),
+        _clamp(payload.get("seq", 0), 0, 0xFFFFFFFF),
+        _clamp(track_id or 0, 0, 0xFFFFFFFF),
+        _clamp(round(float(payload.get("captura_ts", 0)) * 1000), 0, 2**64 - 1),
+        _clamp(round(float(llegada) * 1000), 0, 2**64 - 1) if llegada is not None else 0,
+        _clamp(velocidad or 0, -32768, 32767),
+        *(_clamp(value, 0, 0xFFFF) for value in bbox))
+
+
+def _unpack_record(data, offset=0):
+    """Cabecera bin1 en `offset` -> dict con las claves del JSON (sin la cámara)"""
+    (magic, version, flags, class_id, confidence, seq, track_id, captura_ms, llegada_ms,
+     velocidad, x1, y1, x2, y2) = struct.unpack_from(HEADER, data, offset)
+    if magic != MAGIC:
+        raise ValueError("MAGIC desconocido: 0x%02X" % magic)
+    if version != VERSION:
+        raise ValueError("Versión de formato no soportada: %d" % version)
+
+    payload = {
+        "objeto": "pistachio" if flags & FLAG_PISTACHIO else "clase_%d" % class_id,
+        "clase_id": class_id,
+        "confianza": confidence / 10000,
+        "captura_ts": captura_ms / 1000,
+        "seq": seq,
+    }
+    if flags & FLAG_TRACK:
+        payload["track_id"] = track_id
+    if flags & FLAG_LLEGADA:
+        payload["llegada_ts"] = llegada_ms / 1000
+    if flags & FLAG_VELOCIDAD:
+        payload["velocidad_px_s"] = velocidad
+    if flags & FLAG_BBOX:
+        payload["bbox"] = [x1, y1, x2, y2]
+    return payload
+
+
+def encode_binary(payload):
+    """Dict de detección (mismas claves que el JSON) -> bytes bin1"""
+    return _pack_record(payload) + payload.get("camara", "").encode("utf-8")
+
+
+def decode_binary(data):
+    """bytes bin1 -> dict con las claves del JSON
+
+    Raises:
+        ValueError: Mensaje corto, MAGIC incorrecto o versión desconocida
+    """
+    if len(data) < HEADER_SIZE:
+        raise ValueError("Mensaje binario incompleto: %d bytes" % len(data))
+    payload = _unpack_record(data)
+    if len(data) > HEADER_SIZE:
+        payload["camara"] = bytes(data[HEADER_SIZE:]).decode("utf-8")
+    return payload
+
+
+def encode_binary_batch(payloads):
+    """Lista de dicts de detección -> bytes de un lote binario
+
+    La cámara se toma de la primera detección (un lote es de una sola cámara).
+    """
+    if len(payloads) > BATCH_MAX:
+        raise ValueError("Lote binario de más de %d detecciones" % BATCH_MAX)
+    camera = payloads[0].get("camara", "") if payloads else ""
+    return b"".join((struct.pack(BATCH_HEADER, MAGIC_LOTE, VERSION, len(payloads)),
+                     *(_pack_record(payload) for payload in payloads),
+                     camera.encode("utf-8")))
+
+
+def decode_binary_batch(data):
+    """bytes de un lote binario -> lista de dicts
+
+    Raises:
+        ValueError: Mensaje corto, MAGIC incorrecto o versión desconocida
+    """
+    if len(data) < BATCH_HEADER_SIZE:
+        raise ValueError("Lote binario incompleto: %d bytes" % len(data))
+    magic, version, count = struct.unpack_from(BATCH_HEADER, data)
+    if magic != MAGIC_LOTE:
+        raise ValueError("MAGIC desconocido: 0x%02X" % magic)
+    if version != VERSION:
+        raise ValueError("Versión de formato no soportada: %d" % version)
+    end = BATCH_HEADER_SIZE + count * HEADER_SIZE
+    if len(data) < end:
+        raise ValueError("Lote binario incompleto: %d bytes para %d detecciones"
+                         % (len(data), count))
+
+    payloads = [_unpack_record(data, offset)
+                for offset in range(BATCH_HEADER_SIZE, end, HEADER_SIZE)]
+    if len(data) > end:
+        camera = bytes(data[end:]).decode("utf-8")
+        for payload in payloads:
+            payload["camara"] = camera
+    return payloads
+
+
+def encode(payload, fmt=FORMAT_JSON):
+    """Serializa un dict de detección, o una lista (lote), en el formato indicado"""
+    if isinstance(payload, list):
+        if fmt == FORMAT_BINARY:
+            return encode_binary_batch(payload)
+        return json.dumps({BATCH_KEY: payload}, separators=(',', ':'))
+    if fmt == FORMAT_BINARY:
+        return encode_binary(payload)
+    return json.dumps(payload, separators=(',', ':'))
+
+
+def decode(data):
+    """Mensaje recibido (bytes, JSON o bin1) -> dict
+
+    Un lote JSON se devuelve tal cual ({"detecciones": [...]}); un lote
+    binario, con la misma forma. Los consumidores que aceptan lotes deben
+    usar decode_detections().
+
+    Raises:
+        ValueError: Mensaje que no es JSON ni bin1 válido
+    """
+    if isinstance(data, str):
+        return json.loads(data)
+    if data[:1] == b'{':
+        return json.loads(data.decode("utf-8"))
+    if data[:1] == bytes((MAGIC,)):
+        return decode_binary(data)
+    if data[:1] == bytes((MAGIC_LOTE,)):
+        return {BATCH_KEY: decode_binary_batch(data)}
+    raise ValueError("Formato de mensaje desconocido")
+
+
+def decode_detections(data):
+    """Mensaje recibido (detección suelta o lote, JSON o bin1) -> lista de dicts
+
+    Raises:
+        ValueError: Mensaje que no es JSON ni bin1 válido
+    """
+    if data[:1] == bytes((MAGIC_LOTE,)):
+        return decode_binary_batch(data)
+    payload = decode(data)
+    if isinstance(payload, dict) and BATCH_KEY in payload:
+        return payload[BATCH_KEY]
+    return [payload]
+
+
+def formats_announcement():
+    """Payload del anuncio de formatos de un consumidor"""
+    return ",".join(SUPPORTED_FORMATS)
+
+
+class FormatNegotiator:
+    """Elige el formato de publicación a partir de los anuncios retenidos
+
+    update() llega desde el hilo de red de MQTT y choose() desde el de
+    detección: el formato se recalcula bajo el lock en cada anuncio y
+    choose() solo devuelve el valor ya calculado.
+    """
+
+    def __init__(self):
+        self.consumers = {}  # Cliente -> formatos anunciados
+        self._lock = threading.Lock()
+        self._chosen = FORMAT_JSON
+
+    def update(self, topic, payload):
+        """Procesa un mensaje de FORMATS_TOPIC/<cliente>
+
+        Returns:
+            bool: True si cambió el formato elegido
+        """
+        client = topic.rsplit("/", 1)[-1]
+        text = payload.decode("utf-8", "ignore") if isinstance(payload, bytes) else payload
+        with self._lock:
+            before = self._chosen
+            if text:
+                self.consumers[client] = set(text.split(","))
+            else:
+                self.consumers.pop(client, None)  # Anuncio borrado (last will o cierre)
+            if self.consumers and all(FORMAT_BINARY in formats
+                                      for formats in self.consumers.values()):
+                self._chosen = FORMAT_BINARY
+            else:
+                self._chosen = FORMAT_JSON
+            return self._chosen != before
+
+    def choose(self):
+        return self._chosen
+
+    def count(self):
+        """Consumidores con anuncio vigente"""
+        with self._lock:
+            return len(self.consumers)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+"""
+pipeline.py
+Pipeline de captura / inferencia / display en hilos separados
+
+Las etapas se conectan con colas acotadas "latest-frame-wins": si una etapa
+va más lenta que la anterior, el elemento pendiente se reemplaza por el más
+nuevo en vez de acumularse. Así el modelo siempre trabaja sobre el frame más
+reciente y nunca espera a la cámara ni a la GUI.
+
+Etapas:
+- Captura: FrameSource (frame_source.py), hilo que lee la cámara continuamente
+- Inferencia: hilo que ejecuta YOLO sobre el último frame disponible
+- Display/publicación: se ejecuta en el hilo principal (cv2.imshow lo exige)
+"""
+
+import collections
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+
+# ============ COLA LATEST-FRAME-WINS ============
+class LatestQueue:
+    """Cola acotada donde el elemento más nuevo desplaza al más antiguo"""
+
+    def __init__(self, maxsize=1):
+        self._items = collections.deque(maxlen=maxsize)
+        self._cond = threading.Condition()
+        self._closed = False
+        self.dropped = 0  # Elementos descartados por llegar uno más nuevo
+
+    def put(self, item):
+        """Encola sin bloquear; si está llena descarta el más antiguo"""
+        with self._cond:
+            if len(self._items) == self._items.maxlen:
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Devuelve el siguiente elemento, o None si hay timeout o la cola se cerró"""
+        with self._cond:
+            self._cond.wait_for(lambda: self._items or self._closed, timeout)
+            if self._items:
+                return self._items.popleft()
+            return None
+
+    def close(self):
+        """Despierta a los consumidores bloqueados en get()"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+
+# ============ TIEMPOS POR ETAPA ============
+class StageStats:
+    """Acumula tiempos por etapa para identificar el cuello de botella
+
+    Las métricas con prefijo 'edad_' son latencias (edad del frame en un
+    punto del pipeline), no etapas: se reportan pero no compiten como
+    cuello de botella.
+    """
+
+    AGE_PREFIX = 'edad_'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+
+    def record(self, stage, seconds):
+        """Registra una muestra de duración (segundos) para una etapa"""
+        with self._lock:
+            count, total, peak = self._stages.get(stage, (0, 0.0, 0.0))
+            self._stages[stage] = (count + 1, total + seconds, max(peak, seconds))
+
+    @contextmanager
+    def measure(self, stage):
+        """Context manager que mide la duración del bloque"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def snapshot(self, reset=False):
+        """Devuelve {etapa: {'n', 'media_ms', 'max_ms'}}"""
+        with self._lock:
+            stages = dict(self._stages)
+            if reset:
+                self._stages.clear()
+
+        return {
+            stage: {
+                'n': count,
+                'media_ms': 1000.0 * total / count if count else 0.0,
+                'max_ms': 1000.0 * peak,
+            }
+            for stage, (count, total, peak) in stages.items()
+        }
+
+    def bottleneck(self):
+        """Nombre de la etapa con mayor tiempo medio (o None)"""
+        snapshot = self.snapshot()
+        stages = [stage for stage in snapshot if not stage.startswith(self.AGE_PREFIX)]
+        if not stages:
+            return None
+        return max(stages, key=lambda stage: snapshot[stage]['media_ms'])
+
+    def log_summary(self, reset=True):
+        """Escribe en el log un resumen por etapa"""
+        snapshot = self.snapshot(reset=reset)
+        if not snapshot:
+            return
+
+        stages = [stage for stage in snapshot if not stage.startswith(self.AGE_PREFIX)]
+        slowest = max(stages, key=lambda stage: snapshot[stage]['media_ms']) if stages else None
+        parts = [
+            f"{stage}: {s['media_ms']:.1f}ms (max {s['max_ms']:.1f}ms, n={s['n']})"
+            for stage, s in snapshot.items()
+        ]
+        logger.info(f"⏱ Etapas → {' | '.join(parts)} | cuello de botella: {slowest}")
+
+
+# ============ PIPELINE ============
+class DetectionPipeline:
+    """Ejecuta la inferencia en un hilo propio alimentado por un FrameSource
+
+    El consumidor (display/publicación) llama a get_result() desde el hilo
+    principal y recibe tuplas (CapturedFrame, detecciones) siempre del frame
+    más nuevo.
+    """
+
+    def __init__(self, source, detect, stats=None, queue_size=1):
+        """
+        Args:
+            source: FrameSource (o cualquier objeto con read(timeout) -> CapturedFrame)
+            detect: Callable imagen -> detecciones
+            stats: StageStats compartido (se crea uno si es None)
+            queue_size: Capacidad de la cola de resultados
+        """
+        self.source = source
+        self.detect = detect
+        self.stats = stats or StageStats()
+        self.results = LatestQueue(queue_size)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Arranca el hilo de inferencia"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._inference_loop, name="inferencia",
+                                        daemon=True)
+        self._thread.start()
+        logger.info("✓ Pipeline iniciado (captura + inferencia en paralelo)")
+
+    def _inference_loop(self):
+        while not self._stop.is_set():
+            frame = self.source.read(timeout=0.5)
+            if frame is None:
+                continue
+
+            # Edad del frame al entrar al modelo
+            self.stats.record('edad_frame', frame.age())
+
+            try:
+                with self.stats.measure('inferencia'):
+                    detections = self.detect(frame.image)
+            except Exception as e:
+                logger.error(f"Error en inferencia: {e}", exc_info=True)
+                continue
+
+            self.results.put((frame, detections))
+
+    def get_result(self, timeout=0.5):
+        """Devuelve (CapturedFrame, detecciones) más reciente o None si hay timeout"""
+        return self.results.get(timeout=timeout)
+
+    def dropped_counts(self):
+        """Frames/resultados descartados por llegar uno más nuevo"""
+        return {'frames': getattr(self.source, 'dropped', 0),
+                'resultados': self.results.dropped}
+
+    def stop(self):
+        """Detiene el hilo de inferencia y espera a que termine"""
+        self._stop.set()
+        self.results.close()
+        if self._thread:
+            self._thread.join(timeout=2)
+            self._thread = None
+
+
+class MultiSourcePipeline(DetectionPipeline):
+    """Agrupa el último frame de N fuentes en una única llamada batch al modelo
+
+    Cada resultado es una lista [(índice de fuente, CapturedFrame, detecciones)]
+    para que el consumidor enrute las detecciones a la cámara que corresponde.
+    """
+
+    def __init__(self, sources, detect_batch, stats=None, queue_size=1, gather_timeout=0.005):
+        """
+        Args:
+            sources: Lista de FrameSource
+            detect_batch: Callable (lista de imágenes, lista de índices de fuente)
+                -> lista de detecciones. El índice permite mantener estado por
+                cámara (p. ej. el fondo del filtro de movimiento)
+            gather_timeout: Segundos máximos esperando a que el resto de
+                cámaras entreguen frame una vez que hay al menos uno
+        """
+        super().__init__(None, None, stats, queue_size)
+        self.sources = list(sources)
+        self.detect_batch = detect_batch
+        self.gather_timeout = gather_timeout
+
+        # Las fuentes avisan aquí de cada frame nuevo: _gather duerme hasta entonces
+        self._frame_ready = threading.Event()
+        for source in self.sources:
+            source.add_listener(self._frame_ready)
+
+    def _gather(self):
+        """Recoge un frame nuevo de cada fuente que lo tenga disponible"""
+        batch = []
+        pending = list(enumerate(self.sources))
+        deadline = None
+
+        while pending and not self._stop.is_set():
+            # Limpiar antes de consultar: un frame que llegue durante la ronda
+            # deja el evento activado y la espera siguiente vuelve al instante
+            self._frame_ready.clear()
+            waiting = []
+            for index, source in pending:
+                frame = source.read(timeout=0)
+                if frame is None:
+                    waiting.append((index, source))
+                else:
+                    batch.append((index, frame))
+            pending = waiting
+
+            if batch and deadline is None:
+                deadline = time.monotonic() + self.gather_timeout
+            if not pending:
+                break
+            if deadline is None:
+                timeout = 0.1  # Sin frames aún: revisar _stop de vez en cuando
+            else:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+            self._frame_ready.wait(timeout)
+
+        return batch
+
+    def _inference_loop(self):
+        while not self._stop.is_set():
+            batch = self._gather()
+            if not batch:
+                continue
+
+            for _, frame in batch:
+                self.stats.record('edad_frame', frame.age())
+
+            try:
+                start = time.perf_counter()
+                detections = self.detect_batch([frame.image for _, frame in batch],
+                                               [index for index, _ in batch])
+                elapsed = time.perf_counter() - start
+            except Exception as e:
+                logger.error(f"Error en inferencia batch: {e}", exc_info=True)
+                continue
+
+            self.stats.record('inferencia', elapsed)
+            self.stats.record('inferencia_por_frame', elapsed / len(batch))
+
+            self.results.put([
+                (index, frame, dets) for (index, frame), dets in zip(batch, detections)
+            ])
+
+    def stop(self):
+        self._stop.set()
+        self._frame_ready.set()  # Despertar a _gather sin esperar su timeout
+        super().stop()
+
+    def dropped_counts(self):
+        """Frames/resultados descartados por llegar uno más nuevo"""
+        return {'frames': sum(source.dropped for source in self.sources),
+                'resultados': self.results.dropped}
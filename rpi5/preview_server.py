@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+preview_server.py
+Vista previa MJPEG por HTTP de los frames anotados del detector
+
+El detector solo dibuja un frame anotado cuando hay alguien mirando y ha
+pasado 1/fps del cliente más rápido (wants_frame), y submit() solo guarda
+la referencia. Un hilo codificador aparte comprime a JPEG el último frame
+de cada cámara, una vez por cada calidad de los clientes a los que les
+toca frame según su propio ritmo. Cada cliente HTTP envía desde su propio
+hilo el último JPEG disponible. Sin clientes no se anota ni se codifica
+nada.
+
+Ritmo adaptativo por cliente: si enviar un frame tarda más de la mitad de
+su intervalo (red lenta, navegador saturado), a ese cliente se le baja la
+calidad JPEG y, ya en el mínimo, los fps; cuando vuelve a ir holgado se
+recuperan poco a poco. Un cliente lento solo se pierde frames intermedios:
+nunca frena al codificador, a los demás clientes ni a la inferencia.
+
+Rutas:
+    /                  Índice con una vista por cámara
+    /stream/<cámara>   Flujo MJPEG (multipart/x-mixed-replace)
+    /snapshot/<cámara> Último frame en JPEG (calidad máxima)
+
+Uso (ver videoPublicTopic_mejorado.py, PREVIEW_PORT):
+    preview = PreviewServer(8080, fps=5).start()
+    if preview.wants_frame("cam0"):
+        preview.submit("cam0", annotated_frame)
+"""
+
+import html
+import logging
+import socket
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote
+
+import cv2
+
+logger = logging.getLogger(__name__)
+
+BOUNDARY = b"frame"
+
+# Adaptación por cliente
+SLOW_SEND_RATIO = 0.5  # Envío más lento que esta fracción del intervalo = cliente lento
+FAST_SEND_RATIO = 0.1  # Envío más rápido que esta fracción = hay margen para subir
+RECOVER_FRAMES = 10  # Frames holgados seguidos antes de subir un escalón
+QUALITY_STEP = 10  # Escalón de calidad JPEG (también agrupa clientes por calidad)
+FPS_FACTOR = 0.7  # Factor de fps al bajar (y su inverso al subir)
+# Buffer de envío del socket: pequeño para que un cliente lento se note en el
+# tiempo de write() en vez de acumular segundos de vídeo en el kernel
+SEND_BUFFER = 64 * 1024
+
+
+class PreviewClient:
+    """Estado de un cliente de la vista previa: ritmo y calidad propios"""
+
+    def __init__(self, stream, fps, quality, address=None):
+        self.stream = stream
+        self.fps = fps
+        self.quality = quality
+        self.address = address
+        self.sent = 0
+        self.bytes_sent = 0
+        self.fast_streak = 0
+        self.next_due = 0.0  # time.monotonic() en que le toca el siguiente frame
+
+    def adapt(self, send_time, max_fps, max_quality, min_fps, min_quality):
+        """Ajusta fps y calidad según lo que tardó el último envío
+
+        Returns:
+            bool: True si cambió algo
+        """
+        interval = 1.0 / self.fps
+        if send_time > interval * SLOW_SEND_RATIO:
+            self.fast_streak = 0
+            before = (self.fps, self.quality)
+            at_min_quality = self.quality <= min_quality
+            self.quality = max(min_quality, self.quality - QUALITY_STEP)
+            # Sin margen de calidad, o si ni siquiera cabe un frame por intervalo,
+            # bajar también los fps (como mucho a los que permite este envío)
+            if at_min_quality or send_time > interval:
+                self.fps = max(min_fps, min(self.fps * FPS_FACTOR, 1.0 / send_time))
+            return (self.fps, self.quality) != before
+        if send_time < interval * FAST_SEND_RATIO:
+            self.fast_streak += 1
+            if self.fast_streak < RECOVER_FRAMES:
+                return False
+            self.fast_streak = 0
+            # Primero recuperar fps (fluidez), después calidad
+            if self.fps < max_fps:
+                self.fps = min(max_fps, self.fps / FPS_FACTOR)
+            elif self.quality < max_quality:
+                self.quality = min(max_quality, self.quality + QUALITY_STEP)
+            else:
+                return False
+            return True
+        self.fast_streak = 0
+        return False
+
+    def __repr__(self):
+        return f"{self.address or '?'} {self.fps:.1f}fps q{self.quality}"
+
+
+class PreviewServer:
+    """Servidor MJPEG con una ruta por cámara, codificador y HTTP en sus propios hilos"""
+
+    def __init__(self, port=8080, fps=5.0, quality=70, host="127.0.0.1",
+                 min_fps=1.0, min_quality=30):
+        """
+        Args:
+            port: Puerto HTTP
+            fps: Frames por segundo máximos por cliente
+            quality: Calidad JPEG máxima (0-100)
+            host: Interfaz de escucha ("0.0.0.0" = toda la red, sin autenticación)
+            min_fps: fps mínimos de un cliente lento
+            min_quality: Calidad JPEG mínima de un cliente lento
+        """
+        self.port = port
+        self.fps = fps
+        self.quality = quality
+        self.host = host
+        self.min_fps = min(min_fps, fps)
+        self.min_quality = min(min_quality, quality)
+        self._cond = threading.Condition()
+        self._streams = set()
+        self._pending = {}  # Cámara -> (número de frame, imagen) aún sin codificar
+        self._encoded = {}  # (cámara, calidad) -> (número de frame, JPEG)
+        self._last_submit = {}  # Cámara -> time.monotonic() del último submit
+        self._clients = {}  # Cámara -> set(PreviewClient)
+        self._numbers = {}  # Cámara -> número del último frame recibido
+        self._running = False
+        self._server = None
+        self._threads = []
+
+        # Estadísticas
+        self.submitted = 0
+        self.encoded = 0
+        self.skipped = 0  # Frames reemplazados antes de codificarse
+        self.encode_time = 0.0
+        self.sent = 0
+
+    def start(self):
+        """Arranca el servidor HTTP y el codificador en segundo plano"""
+        preview = self
+
+        class Handler(_PreviewHandler):
+            server_preview = preview
+
+        self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+        self._server.daemon_threads = True
+        self._running = True
+        self._threads = [
+            threading.Thread(target=self._server.serve_forever, name="preview-http", daemon=True),
+            threading.Thread(target=self._encode_loop, name="preview-encoder", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        logger.info(f"✓ Vista previa MJPEG en http://{self.host}:{self.port}/ "
+                    f"(hasta {self.fps} fps, calidad {self.min_quality}-{self.quality})")
+        return self
+
+    # ---- Lado del detector ----
+
+    def wants_frame(self, stream):
+        """True si alguien mira `stream` y toca un frame nuevo (ritmo del cliente más rápido)"""
+        clients = self._clients.get(stream)
+        if not clients:
+            return False
+        with self._cond:
+            fps = max((client.fps for client in clients), default=0)
+        if not fps:
+            return False
+        return time.monotonic() - self._last_submit.get(stream, 0.0) >= 1.0 / fps
+
+    def submit(self, stream, image):
+        """Entrega un frame anotado (solo guarda la referencia: ni copia ni codifica)"""
+        with self._cond:
+            if stream in self._pending:
+                self.skipped += 1
+            number = self._numbers.get(stream, 0) + 1
+            self._numbers[stream] = number
+            self._pending[stream] = (number, image)
+            self._last_submit[stream] = time.monotonic()
+            self.submitted += 1
+            self._cond.notify_all()
+
+    def register(self, stream):
+        """Declara una cámara para el índice aunque aún no tenga frames"""
+        with self._cond:
+            self._streams.add(stream)
+
+    def streams(self):
+        with self._cond:
+            return sorted(self._streams)
+
+    def clients(self, stream=None):
+        """Clientes conectados a una cámara (o a todas)"""
+        with self._cond:
+            if stream is not None:
+                return len(self._clients.get(stream, ()))
+            return sum(len(clients) for clients in self._clients.values())
+
+    def summary(self):
+        """Resumen de codificación y clientes para el log periódico"""
+        with self._cond:
+            clients = [client for group in self._clients.values() for client in group]
+            encoded = self.encoded
+            encode_ms = self.encode_time / encoded * 1000 if encoded else 0.0
+            return (f"{len(clients)} clientes {clients}, {encoded} JPEG "
+                    f"({encode_ms:.1f}ms/JPEG), {self.skipped} frames sin codificar, "
+                    f"{self.sent} enviados")
+
+    # ---- Codificador ----
+
+    def _encode_loop(self):
+        """Hilo codificador: último frame de cada cámara, una vez por calidad pendiente"""
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or not self._running)
+                if not self._running:
+                    return
+                pending, self._pending = self._pending, {}
+                # Solo las calidades de clientes a los que les toca frame: uno lento a
+                # 1 fps no obliga a codificar su calidad en cada frame del resto
+                due = time.monotonic() + self._slack()
+                jobs = [(stream, number, image,
+                         sorted({client.quality for client in self._clients.get(stream, ())
+                                 if client.next_due <= due}))
+                        for stream, (number, image) in pending.items()]
+
+            for stream, number, image, qualities in jobs:
+                for quality in qualities:
+                    start = time.perf_counter()
+                    data = self.encode(image, quality)
+                    elapsed = time.perf_counter() - start
+                    if data is None:
+                        continue
+                    with self._cond:
+                        self._encoded[(stream, quality)] = (number, data)
+                        self.encoded += 1
+                        self.encode_time += elapsed
+                        self._cond.notify_all()
+
+    def _slack(self):
+        """Adelanto con el que se atiende a un cliente (medio intervalo a fps máximos)"""
+        return 0.5 / self.fps
+
+    def encode(self, image, quality=None):
+        ok, data = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY,
+                                                int(quality or self.quality)])
+        return data.tobytes() if ok else None
+
+    # ---- Lado de los clientes HTTP ----
+
+    def _attach(self, client):
+        with self._cond:
+            self._clients.setdefault(client.stream, set()).add(client)
+
+    def _detach(self, client):
+        with self._cond:
+            self._clients.get(client.stream, set()).discard(client)
+
+    def _wait_jpeg(self, client, after, timeout):
+        """Espera un JPEG de la cámara y calidad del cliente posterior a `after`
+
+        Returns:
+            tuple: (número de frame, JPEG) o None si no llegó a tiempo
+        """
+        key = (client.stream, client.quality)
+        with self._cond:
+            ready = self._cond.wait_for(
+                lambda: not self._running or self._encoded.get(key, (0, None))[0] > after,
+                timeout)
+            entry = self._encoded.get(key)
+            if not ready or entry is None or entry[0] <= after:
+                return None
+            return entry
+
+    def _sent(self, client, size, start, send_time):
+        """Registra un envío, adapta el cliente y devuelve cuánto debe esperar"""
+        with self._cond:
+            client.sent += 1
+            client.bytes_sent += size
+            self.sent += 1
+            if client.adapt(send_time, self.fps, self.quality, self.min_fps, self.min_quality):
+                logger.debug(f"Vista previa: cliente {client} (envío {send_time*1000:.0f}ms)")
+            client.next_due = start + 1.0 / client.fps
+            return client.next_due - self._slack() - time.monotonic()
+
+    def stop(self):
+        """Cierra el servidor, el codificador y desconecta a los clientes"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        logger.info(f"Vista previa: {self.submitted} frames anotados, {self.encoded} JPEG, "
+                    f"{self.sent} enviados")
+
+
+class _PreviewHandler(BaseHTTPRequestHandler):
+    server_preview = None  # PreviewServer (lo fija PreviewServer.start)
+
+    def log_message(self, format, *args):
+        logger.debug(f"Vista previa {self.client_address[0]}: {format % args}")
+
+    def do_GET(self):
+        parts = [unquote(part) for part in self.path.split("?")[0].split("/") if part]
+        if not parts:
+            self._index()
+        elif len(parts) == 2 and parts[0] == "stream":
+            self._stream(parts[1])
+        elif len(parts) == 2 and parts[0] == "snapshot":
+            self._snapshot(parts[1])
+        else:
+            self.send_error(404)
+
+    def _index(self):
+        preview = self.server_preview
+        views = "".join(f'<h2>{html.escape(name)}</h2>'
+                        f'<img src="/stream/{html.escape(quote(name, safe=""))}">'
+                        for name in preview.streams())
+        body = (f"<html><head><title>Detección pistachos</title></head>"
+                f"<body>{views or 'Sin cámaras'}</body></html>").encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _snapshot(self, stream):
+        preview = self.server_preview
+        # Cliente de un solo frame: pide al detector un frame anotado
+        client = PreviewClient(stream, preview.fps, preview.quality, self.client_address[0])
+        preview._attach(client)
+        try:
+            entry = preview._wait_jpeg(client, 0, timeout=2.0)
+        finally:
+            preview._detach(client)
+        if entry is None:
+            self.send_error(503, "Sin frames")
+            return
+        data = entry[1]
+        self.send_response(200)
+        self.send_header("Content-Type", "image/jpeg")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _stream(self, stream):
+        preview = self.server_preview
+        self.send_response(200)
+        self.send_header("Content-Type", f"multipart/x-mixed-replace; boundary={BOUNDARY.decode()}")
+        self.send_header("Cache-Control", "no-cache")
+        self.end_headers()
+
+        self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, SEND_BUFFER)
+        client = PreviewClient(stream, preview.fps, preview.quality, self.client_address[0])
+        preview._attach(client)
+        logger.info(f"Vista previa: cliente {client.address} conectado a {stream}")
+        last = 0
+        try:
+            while preview._running:
+                entry = preview._wait_jpeg(client, last, timeout=1.0)
+                if entry is None:
+                    continue
+                last, data = entry
+
+                start = time.monotonic()
+                self.wfile.write(b"--" + BOUNDARY + b"\r\nContent-Type: image/jpeg\r\n"
+                                 b"Content-Length: " + str(len(data)).encode() + b"\r\n\r\n"
+                                 + data + b"\r\n")
+                self.wfile.flush()
+                send_time = time.monotonic() - start
+
+                # Respetar el ritmo propio del cliente (los frames intermedios se pierden)
+                remaining = preview._sent(client, len(data), start, send_time)
+                if remaining > 0:
+                    time.sleep(remaining)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            preview._detach(client)
+            logger.info(f"Vista previa: cliente {client} desconectado de {stream} "
+                        f"({client.sent} frames, {client.bytes_sent / 1024:.0f} KiB)")
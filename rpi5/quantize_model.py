@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+quantize_model.py
+Cuantización del modelo (INT8 / FP16) y reporte precisión vs velocidad
+
+Subcomandos:
+- calibrar: genera best_640_int8.onnx (o best_640_fp16.onnx) a partir de best.pt.
+  La cuantización INT8 es estática: se calibra con una carpeta de frames
+  capturados de la cinta real, para que los rangos de activación
+  correspondan a las imágenes de producción.
+- reporte: compara el modelo cuantizado contra FP32 en la misma carpeta de
+  frames: precisión, recall y mAP@0.5 con CONFIDENCE_THRESHOLD, y latencia
+  por frame. Si se indica --labels (formato YOLO .txt) se evalúa contra las
+  etiquetas; si no, contra las detecciones de FP32 (concordancia).
+
+Uso:
+    python3 quantize_model.py calibrar --frames capturas/ --precision int8
+    python3 quantize_model.py reporte --frames validacion/ --labels validacion/labels
+    # Luego en videoPublicTopic_mejorado.py:
+    #   INFERENCE_BACKEND = "onnx"; INFERENCE_PRECISION = "int8"
+"""
+
+import argparse
+import glob
+import logging
+import os
+import re
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from backends import (
+    OnnxRuntimeBackend, export_model, preprocess_image, quantized_model_path,
+)
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_MODEL = os.path.join(SCRIPT_DIR, "best.pt")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+CONFIDENCE_THRESHOLD = 0.6  # Mismo umbral que videoPublicTopic_mejorado.py
+IOU_MATCH = 0.5  # IoU mínimo para considerar una detección correcta
+MAX_CALIBRATION_FRAMES = 300
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def list_images(folder):
+    """Imágenes legibles de la carpeta en orden reproducible
+
+    Las que OpenCV no puede abrir (corruptas, a medio copiar) se descartan
+    aquí, una vez, para que calibración y reporte usen la misma lista.
+    """
+    paths = [p for p in sorted(glob.glob(os.path.join(folder, "*")))
+             if p.lower().endswith(IMAGE_EXTENSIONS)]
+    readable = [p for p in paths if cv2.imread(p) is not None]
+    if len(readable) < len(paths):
+        skipped = sorted(set(paths) - set(readable))
+        logger.warning(f"⚠ {len(skipped)} imágenes ilegibles ignoradas: "
+                       f"{', '.join(os.path.basename(p) for p in skipped[:5])}"
+                       f"{'...' if len(skipped) > 5 else ''}")
+    if not readable:
+        raise FileNotFoundError(f"No hay imágenes legibles en {folder}")
+    return readable
+
+
+# ============ CALIBRACIÓN ============
+class FrameCalibrationReader:
+    """CalibrationDataReader de ONNX Runtime sobre una carpeta de frames"""
+
+    def __init__(self, image_paths, input_name, imgsz):
+        self.image_paths = list(image_paths)
+        self.input_name = input_name
+        self.imgsz = imgsz
+        self._index = 0
+
+    def get_next(self):
+        if self._index >= len(self.image_paths):
+            return None
+        image = cv2.imread(self.image_paths[self._index])
+        self._index += 1
+        blob, _, _ = preprocess_image(image, self.imgsz)
+        return {self.input_name: blob}
+
+    def rewind(self):
+        self._index = 0
+
+
+def head_nodes(onnx_model):
+    """Nodos del último bloque (cabeza de detección) del grafo exportado
+
+    La cabeza (DFL + concatenación de cajas y scores) es muy sensible a INT8;
+    dejarla en FP32 cuesta poco tiempo y evita perder recall.
+    """
+    indices = [int(m.group(1)) for node in onnx_model.graph.node
+               for m in [re.match(r"/model\.(\d+)/", node.name)] if m]
+    if not indices:
+        return []
+    last = f"/model.{max(indices)}/"
+    return [node.name for node in onnx_model.graph.node if node.name.startswith(last)]
+
+
+def calibrate_int8(fp32_path, output_path, image_paths, imgsz, quantize_head=False):
+    """Cuantización estática INT8 (QDQ, pesos por canal) calibrada con frames reales"""
+    import onnx
+    from onnxruntime.quantization import (
+        CalibrationMethod, QuantFormat, QuantType, quantize_static,
+    )
+
+    model = onnx.load(fp32_path)
+    input_name = model.graph.input[0].name
+    excluded = [] if quantize_head else head_nodes(model)
+    if excluded:
+        logger.info(f"Cabeza de detección en FP32 ({len(excluded)} nodos)")
+
+    reader = FrameCalibrationReader(image_paths, input_name, imgsz)
+    logger.info(f"Calibrando con {len(reader.image_paths)} frames...")
+    quantize_static(
+        fp32_path, output_path, reader,
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+        calibrate_method=CalibrationMethod.MinMax,
+        nodes_to_exclude=excluded,
+    )
+
+
+def convert_fp16(fp32_path, output_path):
+    """Conversión a FP16 manteniendo entradas/salidas en FP32"""
+    import onnx
+    try:
+        from onnxconverter_common import float16
+    except ImportError as e:
+        raise ImportError("FP16 requiere onnxconverter-common: pip install onnxconverter-common") from e
+
+    model = onnx.load(fp32_path)
+    onnx.save(float16.convert_float_to_float16(model, keep_io_types=True), output_path)
+
+
+def cmd_calibrar(args):
+    imgsz = (args.imgsz, args.imgsz)
+    fp32_path = export_model(args.model, "onnx", args.imgsz)
+    output_path = quantized_model_path(args.model, args.precision, args.imgsz)
+
+    start = time.time()
+    if args.precision == "int8":
+        image_paths = list_images(args.frames)
+        if len(image_paths) > args.max_frames:
+            # Muestreo uniforme para cubrir toda la grabación
+            step = len(image_paths) / args.max_frames
+            image_paths = [image_paths[int(i * step)] for i in range(args.max_frames)]
+        calibrate_int8(fp32_path, output_path, image_paths, imgsz, args.quantize_head)
+    else:
+        convert_fp16(fp32_path, output_path)
+
+    size_fp32 = os.path.getsize(fp32_path) / 1e6
+    size_out = os.path.getsize(output_path) / 1e6
+    logger.info(f"✓ Modelo {args.precision} generado en {time.time() - start:.1f}s: {output_path}")
+    logger.info(f"  Tamaño: {size_fp32:.1f} MB (fp32) → {size_out:.1f} MB ({args.precision})")
+    return 0
+
+
+# ============ REPORTE ============
+def load_labels(label_dir, image_path, shape):
+    """Etiquetas YOLO (cls cx cy w h normalizados) -> array (N, 5) [x1, y1, x2, y2, cls]"""
+    stem = os.path.splitext(os.path.basename(image_path))[0]
+    path = os.path.join(label_dir, stem + ".txt")
+    if not os.path.exists(path):
+        return np.empty((0, 5), dtype=np.float32)
+
+    rows = np.loadtxt(path, ndmin=2, dtype=np.float32)
+    if rows.size == 0:
+        return np.empty((0, 5), dtype=np.float32)
+    height, width = shape[:2]
+    cx, cy, w, h = rows[:, 1] * width, rows[:, 2] * height, rows[:, 3] * width, rows[:, 4] * height
+    return np.column_stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2, rows[:, 0]])
+
+
+def box_iou(a, b):
+    """IoU entre cada caja de a (N, 4) y de b (M, 4)"""
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:4], b[None, :, 2:4])
+    inter = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:4] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:4] - b[:, :2], axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def match_predictions(predictions, targets):
+    """Marca cada predicción como TP/FP (emparejamiento voraz por confianza)"""
+    tp = np.zeros(len(predictions), dtype=bool)
+    if len(predictions) == 0 or len(targets) == 0:
+        return tp
+
+    order = np.argsort(-predictions[:, 4])
+    ious = box_iou(predictions[:, :4], targets[:, :4])
+    used = np.zeros(len(targets), dtype=bool)
+    for i in order:
+        candidates = (ious[i] >= IOU_MATCH) & ~used & (targets[:, 4] == predictions[i, 5])
+        if candidates.any():
+            j = np.argmax(np.where(candidates, ious[i], -1))
+            used[j] = True
+            tp[i] = True
+    return tp
+
+
+def average_precision(confidences, tp, n_targets):
+    """AP@0.5 (interpolación de todos los puntos, como COCO/ultralytics)"""
+    if n_targets == 0 or len(confidences) == 0:
+        return 0.0
+    order = np.argsort(-confidences)
+    tp_cum = np.cumsum(tp[order])
+    fp_cum = np.cumsum(~tp[order])
+    recall = tp_cum / n_targets
+    precision = tp_cum / (tp_cum + fp_cum)
+
+    recall = np.concatenate([[0.0], recall, [1.0]])
+    precision = np.concatenate([[1.0], precision, [0.0]])
+    precision = np.flip(np.maximum.accumulate(np.flip(precision)))
+    changes = np.where(recall[1:] != recall[:-1])[0]
+    return float(np.sum((recall[changes + 1] - recall[changes]) * precision[changes + 1]))
+
+
+def evaluate(backend, image_paths, references, threshold):
+    """Ejecuta el backend sobre las imágenes y calcula métricas contra `references`
+
+    Args:
+        references: Lista (una por imagen) de arrays (N, 5) [x1, y1, x2, y2, cls]
+    """
+    latencies, all_conf, all_tp, tp_thr, fp_thr = [], [], [], 0, 0
+    n_targets = sum(len(r) for r in references)
+
+    for path, targets in zip(image_paths, references):
+        image = cv2.imread(path)
+        start = time.perf_counter()
+        predictions = backend.predict([image])[0]
+        latencies.append(time.perf_counter() - start)
+
+        tp = match_predictions(predictions, targets)
+        all_conf.append(predictions[:, 4])
+        all_tp.append(tp)
+
+        above = predictions[:, 4] >= threshold
+        hits = int(match_predictions(predictions[above], targets).sum())
+        tp_thr += hits
+        fp_thr += int(above.sum()) - hits
+
+    confidences = np.concatenate(all_conf) if all_conf else np.empty(0)
+    tp = np.concatenate(all_tp) if all_tp else np.empty(0, dtype=bool)
+    latencies = np.array(latencies[1:] or latencies) * 1000  # Sin el primer frame (warm-up)
+    return {
+        "precision": tp_thr / (tp_thr + fp_thr) if tp_thr + fp_thr else 0.0,
+        "recall": tp_thr / n_targets if n_targets else 0.0,
+        "map50": average_precision(confidences, tp, n_targets),
+        "latencia_media_ms": float(latencies.mean()),
+        "latencia_p95_ms": float(np.percentile(latencies, 95)),
+    }
+
+
+def cmd_reporte(args):
+    imgsz = args.imgsz
+    image_paths = list_images(args.frames)
+    fp32 = OnnxRuntimeBackend(export_model(args.model, "onnx", imgsz), imgsz)
+
+    if args.labels:
+        references = [load_labels(args.labels, p, cv2.imread(p).shape) for p in image_paths]
+        reference_name = "etiquetas"
+    else:
+        # Sin etiquetas: las detecciones FP32 por encima del umbral hacen de referencia
+        references = []
+        for path in image_paths:
+            predictions = fp32.predict([cv2.imread(path)])[0]
+            keep = predictions[:, 4] >= args.conf
+            references.append(predictions[keep][:, [0, 1, 2, 3, 5]])
+        reference_name = "detecciones fp32"
+
+    rows = [("fp32", evaluate(fp32, image_paths, references, args.conf))]
+    for precision in args.precisions:
+        path = quantized_model_path(args.model, precision, imgsz)
+        if not os.path.exists(path):
+            logger.warning(f"⚠ {path} no existe. Ejecuta primero: calibrar --precision {precision}")
+            continue
+        rows.append((precision, evaluate(OnnxRuntimeBackend(path, imgsz), image_paths,
+                                         references, args.conf)))
+
+    base = rows[0][1]
+    print()
+    print(f"Referencia: {reference_name} | {len(image_paths)} frames | "
+          f"umbral {args.conf:.2f} | IoU {IOU_MATCH}")
+    print(f"{'Modelo':<7} {'mAP50':>7} {'Prec.':>7} {'Recall':>7} {'ms/frame':>9} {'p95 ms':>8} {'Speedup':>8}")
+    print("-" * 60)
+    for name, m in rows:
+        speedup = base["latencia_media_ms"] / m["latencia_media_ms"] if m["latencia_media_ms"] else 0
+        print(f"{name:<7} {m['map50']:>7.3f} {m['precision']:>7.3f} {m['recall']:>7.3f} "
+              f"{m['latencia_media_ms']:>9.1f} {m['latencia_p95_ms']:>8.1f} {speedup:>7.2f}x")
+
+    for name, m in rows[1:]:
+        print(f"\n{name}: Δrecall {m['recall'] - base['recall']:+.3f}, "
+              f"ΔmAP50 {m['map50'] - base['map50']:+.3f}, "
+              f"{base['latencia_media_ms'] - m['latencia_media_ms']:+.1f} ms/frame ahorrados")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cuantización INT8/FP16 del detector de pistachos")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="Ruta a best.pt")
+    parser.add_argument("--imgsz", type=int, default=640)
+    sub = parser.add_subparsers(dest="comando", required=True)
+
+    cal = sub.add_parser("calibrar", help="Genera el modelo cuantizado")
+    cal.add_argument("--precision", choices=("int8", "fp16"), default="int8")
+    cal.add_argument("--frames", help="Carpeta con frames capturados (necesaria para int8)")
+    cal.add_argument("--max-frames", type=int, default=MAX_CALIBRATION_FRAMES)
+    cal.add_argument("--quantize-head", action="store_true",
+                     help="Cuantizar también la cabeza de detección (más rápido, menos preciso)")
+
+    rep = sub.add_parser("reporte", help="Compara precisión y latencia contra FP32")
+    rep.add_argument("--frames", required=True, help="Carpeta con frames de validación")
+    rep.add_argument("--labels", help="Carpeta con etiquetas YOLO (.txt con el mismo nombre)")
+    rep.add_argument("--precisions", nargs="+", choices=("int8", "fp16"), default=["int8", "fp16"])
+    rep.add_argument("--conf", type=float, default=CONFIDENCE_THRESHOLD)
+
+    args = parser.parse_args()
+    if args.comando == "calibrar":
+        if args.precision == "int8" and not args.frames:
+            parser.error("int8 necesita --frames con imágenes de calibración")
+        return cmd_calibrar(args)
+    return cmd_reporte(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,376 @@
+#!/usr/bin/env python3
+"""
+replay.py
+Reproduce un vídeo grabado o un directorio de imágenes por el sistema completo
+
+Sin cámara, sin pantalla, sin GPU y sin Arduino: la grabación entra por
+PistachioDetector con la configuración de videoPublicTopic_mejorado.py
+(backend, ROI, filtro de movimiento, tracker, agrupación de mensajes), las
+detecciones se publican en un broker local y las recibe el controlador
+real (control_servo_directo.py) conectado a arduino_sim.py. Al terminar
+se imprime un informe de rendimiento y latencia:
+
+- Frames reproducidos, procesados y descartados, y FPS de procesado
+- Tiempo de inferencia y edad del frame al tener el resultado (p50/p95/p99)
+- Detecciones, mensajes MQTT y activaciones del Arduino simulado
+- Latencia captura → ACTIVATE recibido por el Arduino simulado
+
+Modos de reproducción:
+- Tiempo real (por defecto): al ritmo grabado, con el pipeline en hilos
+  de producción; los frames que no da tiempo a inferir se descartan,
+  igual que con la cámara.
+- --rapido: lo más rápido posible, secuencial y sin descartar ningún
+  frame. Mismo vídeo y misma configuración dan las mismas detecciones:
+  sirve para comparar cambios en el mismo equipo.
+
+Por defecto ACTUATOR_DISTANCE_PX = 0 (la compuerta en la línea de
+disparo): el controlador activa en cuanto recibe la detección y la
+latencia medida es la del sistema, sin la espera programada hasta la
+llegada del pistacho. El servo simulado es instantáneo, así que cada
+detección válida produce un ACTIVATE.
+
+Requiere un broker en --broker:--puerto, o --lanzar-broker para arrancar
+`mosquitto -p PUERTO` durante la prueba.
+
+Uso:
+    python3 replay.py clip.mp4
+    python3 replay.py clip.mp4 --rapido --json informe.json
+    python3 replay.py imagenes/ --fps 15 --backend onnx --lanzar-broker
+"""
+
+import argparse
+import bisect
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import threading
+import time
+
+import cv2
+
+import arduino_protocol as proto
+import control_servo_directo as directo
+import videoPublicTopic_mejorado as vp
+from arduino_sim import ArduinoSimulator
+from frame_source import open_replay_source
+from motion_gate import MotionGate
+from mqtt_publisher import MQTTPublisher
+from pipeline import DetectionPipeline, StageStats
+from roi import RegionOfInterest
+
+logger = logging.getLogger("replay")
+
+CONTROLLER_STARTUP_TIMEOUT = 20.0  # Segundos hasta que el controlador resetea la compuerta
+SETTLE_TIME = 1.0  # Segundos sin activaciones nuevas para dar la prueba por terminada
+
+
+def percentiles(values):
+    """{'p50', 'p95', 'p99', 'max'} en ms de una lista en segundos"""
+    if not values:
+        return None
+    ordered = sorted(values)
+
+    def pick(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+    return {'p50': statistics.median(ordered) * 1000, 'p95': pick(0.95), 'p99': pick(0.99),
+            'max': ordered[-1] * 1000}
+
+
+class SimulatedActuator:
+    """Controlador real + Arduino simulado, con la hora de cada ACTIVATE"""
+
+    def __init__(self, broker, port, topic, controller):
+        self.activations = []
+        self._ready = threading.Event()
+        self.sim = ArduinoSimulator(servo_delay=0.0, ready_message=False,
+                                    on_command=self._on_command)
+        self.topic = topic
+        self.controller = controller
+
+        directo.BROKER = broker
+        directo.PORT = port
+        directo.SERVO_ESPERA_MS = 0
+        directo.NO_DETECTION_TIMEOUT = 3600.0
+        directo.ACTUADORES = [
+            {"nombre": "replay", "puerto": self.sim.port, "servo": 0, "topics": [topic],
+             "carril": None},
+        ]
+        self._loop = None
+        self._stop_async = None
+        self._thread = None
+
+    def _on_command(self, op):
+        if op == proto.OP_ACTIVATE:
+            self.activations.append(time.monotonic())
+        elif op == proto.OP_RESET:
+            self._ready.set()  # El controlador posiciona la compuerta al arrancar
+
+    def start(self):
+        """Arranca simulador y controlador; espera a que el controlador esté listo"""
+        self.sim.start()
+        if self.controller == "asyncio":
+            import asyncio
+            import control_servo_async
+
+            def run():
+                self._loop = asyncio.new_event_loop()
+                self._stop_async = asyncio.Event()
+                self._loop.run_until_complete(control_servo_async.main_async(self._stop_async))
+            target = run
+        else:
+            target = directo.main
+        self._thread = threading.Thread(target=target, name="controlador", daemon=True)
+        self._thread.start()
+
+        if not self._ready.wait(CONTROLLER_STARTUP_TIMEOUT):
+            raise RuntimeError("El controlador no arrancó (¿broker en marcha?)")
+        return self
+
+    def wait_settled(self, timeout=10.0):
+        """Espera a que dejen de llegar activaciones"""
+        limit = time.monotonic() + timeout
+        count = -1
+        while count != len(self.activations) and time.monotonic() < limit:
+            count = len(self.activations)
+            time.sleep(SETTLE_TIME)
+
+    def stop(self):
+        if self.controller == "asyncio":
+            if self._loop is not None:
+                self._loop.call_soon_threadsafe(self._stop_async.set)
+        else:
+            directo.detener.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+        self.sim.stop()
+
+
+def create_detector(args):
+    """PistachioDetector con la configuración de videoPublicTopic_mejorado.py"""
+    detector = vp.PistachioDetector(args.modelo, args.umbral, args.backend, args.imgsz,
+                                    args.precision)
+    roi = RegionOfInterest.from_config(vp.ROI)
+    if roi is not None:
+        detector.set_roi(roi)
+    if vp.MOTION_GATE and not args.sin_filtro_movimiento:
+        detector.motion_gate = MotionGate(vp.MOTION_METHOD, tiles_only=vp.MOTION_TILES_ONLY)
+    return detector
+
+
+def replay_fast(source, detector, stats, publish):
+    """Secuencial, todos los frames en orden"""
+    while True:
+        frame = source.read()
+        if frame is None:
+            return
+        with stats.measure('inferencia'):
+            detections = detector.detect(frame.image)
+        publish(frame, detections)
+
+
+def replay_realtime(source, detector, stats, publish):
+    """Pipeline en hilos como en producción (captura, inferencia, publicación)"""
+    pipeline = DetectionPipeline(source, detector.detect, stats, vp.PIPELINE_QUEUE_SIZE)
+    pipeline.start()
+    try:
+        while True:
+            result = pipeline.get_result(timeout=0.5)
+            if result is None:
+                if source.finished:
+                    return
+                continue
+            publish(*result)
+    finally:
+        pipeline.stop()
+
+
+def run(args):
+    vp.ACTUATOR_DISTANCE_PX = args.distancia_px
+    if args.modo_publicacion:
+        vp.PUBLISH_MODE = args.modo_publicacion
+    topic = f"replay/{os.getpid()}"
+
+    actuator = SimulatedActuator(args.broker, args.puerto, topic, args.controlador).start()
+
+    publisher = MQTTPublisher(args.broker, args.puerto, topic, qos=vp.QOS,
+                              buffer_size=vp.MQTT_BUFFER_SIZE, payload_format=args.formato,
+                              batch_window=(vp.PUBLISH_WINDOW_MS / 1000
+                                            if vp.PUBLISH_MODE == "ventana" else 0))
+    if not publisher.connect():
+        raise RuntimeError(f"Sin conexión al broker {args.broker}:{args.puerto}")
+
+    stats = StageStats()
+    detector = create_detector(args)
+    tracker = None if args.sin_tracker else vp.create_tracker()
+    source = open_replay_source(args.fuente, realtime=not args.rapido, stats=stats,
+                                fps=args.fps)
+
+    # Por frame: edad al tener el resultado; por publicación: (instante, captura)
+    ages = []
+    publications = []
+    totals = {'detecciones': 0, 'publicadas': 0, 'procesados': 0}
+
+    def publish(frame, detections):
+        """Publica el resultado de un frame y lo anota para el informe"""
+        now = time.monotonic()
+        ages.append(now - frame.timestamp)
+        published = vp.publish_detections(frame, detections, detector, publisher, stats,
+                                          tracker=tracker)
+        totals['procesados'] += 1
+        totals['detecciones'] += len(detections)
+        if published:
+            totals['publicadas'] += published
+            publications.append((now, frame.timestamp))
+
+    cpu_start = time.process_time()
+    wall_start = time.monotonic()
+    source.start()
+    try:
+        if args.rapido:
+            replay_fast(source, detector, stats, publish)
+        else:
+            replay_realtime(source, detector, stats, publish)
+    finally:
+        duration = time.monotonic() - wall_start
+        source.release()
+
+    publisher.flush_batches()
+    actuator.wait_settled()
+    cpu = time.process_time() - cpu_start
+    mqtt_summary = publisher.summary()
+    publisher.disconnect()
+    actuator.stop()
+
+    # Cada ACTIVATE se atribuye a la última publicación anterior a él
+    publish_times = [published_at for published_at, _ in publications]
+    latencies = []
+    for activated_at in actuator.activations:
+        index = bisect.bisect_right(publish_times, activated_at) - 1
+        if index >= 0:
+            latencies.append(activated_at - publications[index][1])
+
+    snapshot = stats.snapshot()
+    return {
+        'fuente': os.path.abspath(args.fuente),
+        'modo': 'rapido' if args.rapido else 'tiempo_real',
+        'configuracion': {
+            'backend': args.backend,
+            'imgsz': args.imgsz,
+            'precision': args.precision,
+            'umbral': args.umbral,
+            'tracker': tracker is not None,
+            'filtro_movimiento': detector.motion_gate is not None,
+            'publicacion': vp.PUBLISH_MODE,
+            'formato': publisher.current_format(),
+            'controlador': args.controlador,
+            'fps_reproduccion': source.fps if not args.rapido else None,
+        },
+        'entorno': {
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'maquina': platform.machine(),
+            'cpus': os.cpu_count(),
+        },
+        'frames_fuente': source.captured,
+        'frames_procesados': totals['procesados'],
+        'frames_descartados': source.captured - totals['procesados'],
+        'duracion_s': duration,
+        'fps_procesado': totals['procesados'] / duration if duration > 0 else 0.0,
+        'cpu_s': cpu,
+        'inferencia_media_ms': snapshot.get('inferencia', {}).get('media_ms'),
+        'inferencia_max_ms': snapshot.get('inferencia', {}).get('max_ms'),
+        'edad_resultado_ms': percentiles(ages),
+        'detecciones': totals['detecciones'],
+        'detecciones_publicadas': totals['publicadas'],
+        'mensajes_mqtt': mqtt_summary['enviados'],
+        'activaciones': len(actuator.activations),
+        'latencia_captura_activacion_ms': percentiles(latencies),
+    }
+
+
+def print_report(report):
+    config = report['configuracion']
+    print()
+    print(f"Fuente: {report['fuente']} ({report['modo']})")
+    print(f"Backend: {config['backend']} {config['precision']} imgsz={config['imgsz']} | "
+          f"publicación: {config['publicacion']} ({config['formato']}) | "
+          f"controlador: {config['controlador']}")
+    print("-" * 64)
+    print(f"Frames: {report['frames_fuente']} reproducidos, {report['frames_procesados']} "
+          f"procesados, {report['frames_descartados']} descartados")
+    print(f"Duración: {report['duracion_s']:.2f}s | {report['fps_procesado']:.1f} FPS | "
+          f"CPU {report['cpu_s']:.2f}s")
+    if report['inferencia_media_ms'] is not None:
+        print(f"Inferencia: media {report['inferencia_media_ms']:.1f}ms, "
+              f"máx {report['inferencia_max_ms']:.1f}ms")
+    print(f"Detecciones: {report['detecciones']} cajas, {report['detecciones_publicadas']} "
+          f"publicadas en {report['mensajes_mqtt']} mensajes, "
+          f"{report['activaciones']} activaciones")
+    for key, label in (('edad_resultado_ms', 'Captura → resultado'),
+                       ('latencia_captura_activacion_ms', 'Captura → ACTIVATE')):
+        p = report[key]
+        if p:
+            print(f"{label:<20} p50 {p['p50']:7.1f}ms  p95 {p['p95']:7.1f}ms  "
+                  f"p99 {p['p99']:7.1f}ms  máx {p['max']:7.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reproduce una grabación por el sistema completo")
+    parser.add_argument("fuente", help="Vídeo o directorio de imágenes")
+    parser.add_argument("--rapido", action="store_true",
+                        help="Lo más rápido posible y sin descartar frames (reproducible)")
+    parser.add_argument("--fps", type=float,
+                        help="Ritmo en tiempo real (por defecto el del vídeo; 10 con imágenes)")
+    parser.add_argument("--modelo", default=os.path.join(os.path.dirname(
+        os.path.abspath(__file__)), "best.pt"))
+    parser.add_argument("--backend", default=vp.INFERENCE_BACKEND)
+    parser.add_argument("--imgsz", type=int, default=vp.INFERENCE_IMGSZ)
+    parser.add_argument("--precision", default=vp.INFERENCE_PRECISION)
+    parser.add_argument("--umbral", type=float, default=vp.CONFIDENCE_THRESHOLD)
+    parser.add_argument("--sin-tracker", action="store_true")
+    parser.add_argument("--sin-filtro-movimiento", action="store_true")
+    parser.add_argument("--modo-publicacion", choices=("evento", "frame", "ventana"),
+                        help="Por defecto PUBLISH_MODE de videoPublicTopic_mejorado.py")
+    parser.add_argument("--formato", default=vp.PAYLOAD_FORMAT, choices=("json", "bin1", "auto"))
+    parser.add_argument("--distancia-px", type=float, default=0,
+                        help="ACTUATOR_DISTANCE_PX (0 = activar al recibir la detección)")
+    parser.add_argument("--controlador", choices=("hilos", "asyncio"), default="hilos")
+    parser.add_argument("--broker", default="localhost")
+    parser.add_argument("--puerto", type=int, default=1883)
+    parser.add_argument("--lanzar-broker", action="store_true",
+                        help="Arrancar mosquitto en --puerto durante la prueba")
+    parser.add_argument("--json", help="Guardar el informe en este archivo")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Logs de todos los módulos")
+    args = parser.parse_args()
+
+    # videoPublicTopic_mejorado.py configura el logging al importarse
+    logging.getLogger().setLevel(logging.INFO if args.verbose else logging.WARNING)
+    if not args.verbose:
+        logging.getLogger(directo.__name__).setLevel(logging.ERROR)
+
+    broker = None
+    if args.lanzar_broker:
+        broker = subprocess.Popen(["mosquitto", "-p", str(args.puerto)],
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        time.sleep(0.5)
+    try:
+        report = run(args)
+    finally:
+        if broker:
+            broker.terminate()
+
+    print_report(report)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nInforme guardado en {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+#!/usr/bin/env python3
+"""
+roi.py
+Región de interés (ROI) de la cinta transportadora
+
+Los pistachos solo aparecen en la banda de la cinta: recortar esa zona antes
+de la inferencia reduce los píxeles que procesa YOLO (y con INFERENCE_IMGSZ
+más pequeño, el coste por frame). Las cajas se devuelven siempre en
+coordenadas del frame completo.
+
+La ROI puede ser:
+- Un rectángulo (x, y, ancho, alto)
+- Un polígono [(x, y), ...]: se recorta su rectángulo envolvente y se
+  descartan las detecciones cuyo centro cae fuera del polígono
+- Autocalibrada a partir de unos segundos de detecciones en el frame completo
+"""
+
+import logging
+import time
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class RegionOfInterest:
+    """Rectángulo o polígono donde se ejecuta la inferencia"""
+
+    def __init__(self, points):
+        """
+        Args:
+            points: Vértices [(x, y), ...] del polígono (4 vértices alineados = rectángulo)
+        """
+        self.polygon = np.asarray(points, dtype=np.int32).reshape(-1, 2)
+        if len(self.polygon) < 3:
+            raise ValueError(f"La ROI necesita al menos 3 vértices: {points}")
+
+        (self.x, self.y), (x2, y2) = self.polygon.min(axis=0), self.polygon.max(axis=0)
+        self.width, self.height = int(x2 - self.x), int(y2 - self.y)
+        self.x, self.y = int(self.x), int(self.y)
+
+        # Rectángulo alineado a los ejes: 4 vértices, todos en las esquinas
+        xs, ys = self.polygon[:, 0], self.polygon[:, 1]
+        self.is_rect = (len(self.polygon) == 4
+                        and np.isin(xs, (self.x, x2)).all() and np.isin(ys, (self.y, y2)).all())
+
+    @classmethod
+    def from_rect(cls, x, y, width, height):
+        return cls([(x, y), (x + width, y), (x + width, y + height), (x, y + height)])
+
+    @classmethod
+    def from_config(cls, value):
+        """Crea la ROI desde la configuración: None, (x, y, w, h) o [(x, y), ...]"""
+        if value is None:
+            return None
+        if len(value) == 4 and all(isinstance(v, (int, float)) for v in value):
+            return cls.from_rect(*value)
+        return cls(value)
+
+    def translate(self, dx, dy):
+        """Devuelve la ROI desplazada (dx, dy) píxeles"""
+        return RegionOfInterest(self.polygon + np.array([dx, dy], dtype=np.int32))
+
+    def clip(self, frame_shape):
+        """Devuelve una ROI recortada a los límites del frame"""
+        height, width = frame_shape[:2]
+        points = self.polygon.copy()
+        points[:, 0] = points[:, 0].clip(0, width)
+        points[:, 1] = points[:, 1].clip(0, height)
+        return RegionOfInterest(points)
+
+    def crop(self, image):
+        """Vista (sin copia) del rectángulo envolvente de la ROI"""
+        return image[self.y:self.y + self.height, self.x:self.x + self.width]
+
+    def to_frame(self, detections):
+        """Pasa las cajas de coordenadas del recorte a coordenadas del frame
+
+        Args:
+            detections: Array estructurado con campo 'bbox' (x1, y1, x2, y2)
+
+        Returns:
+            Detecciones desplazadas y, si la ROI es un polígono, solo las
+            que tienen el centro dentro de él
+        """
+        if len(detections) == 0:
+            return detections
+
+        detections = detections.copy()
+        detections['bbox'] += np.array([self.x, self.y, self.x, self.y], dtype=np.int32)
+        if self.is_rect:
+            return detections
+        return detections[self.contains(detections['bbox'])]
+
+    def contains(self, boxes):
+        """Máscara de las cajas (N, 4) cuyo centro está dentro del polígono"""
+        centers = np.column_stack([(boxes[:, 0] + boxes[:, 2]) / 2,
+                                   (boxes[:, 1] + boxes[:, 3]) / 2])
+        return np.array([
+            cv2.pointPolygonTest(self.polygon, (float(cx), float(cy)), False) >= 0
+            for cx, cy in centers
+        ], dtype=bool)
+
+    def draw(self, image, color=(255, 200, 0)):
+        """Dibuja el contorno de la ROI sobre la imagen"""
+        cv2.polylines(image, [self.polygon], True, color, 1)
+
+    def __repr__(self):
+        if self.is_rect:
+            return f"ROI(x={self.x}, y={self.y}, w={self.width}, h={self.height})"
+        return f"ROI(polígono {self.polygon.tolist()})"
+
+
+class ROICalibrator:
+    """Calcula la ROI a partir de las detecciones de unos segundos de cinta
+
+    Usa percentiles de los bordes de las cajas (descarta detecciones
+    aisladas fuera de la banda) y añade un margen.
+    """
+
+    def __init__(self, margin=20, percentile=2.0):
+        self.margin = margin
+        self.percentile = percentile
+        self._boxes = []
+
+    def add(self, boxes):
+        """Acumula cajas (N, 4) en coordenadas del frame completo"""
+        if len(boxes):
+            self._boxes.append(np.asarray(boxes, dtype=np.float32).reshape(-1, 4))
+
+    @property
+    def samples(self):
+        return sum(len(b) for b in self._boxes)
+
+    def result(self, frame_shape):
+        """ROI calculada, o None si no hubo detecciones"""
+        if not self._boxes:
+            return None
+
+        boxes = np.concatenate(self._boxes)
+        low, high = self.percentile, 100 - self.percentile
+        x1 = np.percentile(boxes[:, 0], low) - self.margin
+        y1 = np.percentile(boxes[:, 1], low) - self.margin
+        x2 = np.percentile(boxes[:, 2], high) + self.margin
+        y2 = np.percentile(boxes[:, 3], high) + self.margin
+
+        roi = RegionOfInterest.from_rect(int(x1), int(y1), int(x2 - x1), int(y2 - y1))
+        return roi.clip(frame_shape)
+
+
+def calibrate_roi(source, detect, seconds, margin=20):
+    """Ejecuta la detección en frame completo durante `seconds` y devuelve la ROI
+
+    Args:
+        source: FrameSource
+        detect: Callable imagen -> detecciones (array con campo 'bbox')
+        seconds: Duración de la calibración
+
+    Returns:
+        RegionOfInterest o None si no se vio ningún pistacho
+    """
+    logger.info(f"Calibrando ROI durante {seconds:.0f}s (pasa pistachos por la cinta)...")
+    calibrator = ROICalibrator(margin)
+    frame_shape = None
+    deadline = time.monotonic() + seconds
+
+    while time.monotonic() < deadline:
+        frame = source.read(timeout=1.0)
+        if frame is None:
+            continue
+        frame_shape = frame.image.shape
+        calibrator.add(detect(frame.image)['bbox'])
+
+    roi = calibrator.result(frame_shape) if frame_shape is not None else None
+    if roi is None:
+        logger.warning("⚠ Sin detecciones durante la calibración: se usa el frame completo")
+    else:
+        logger.info(f"✓ ROI calibrada con {calibrator.samples} detecciones: {roi}")
+    return roi
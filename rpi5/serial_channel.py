@@ -0,0 +1,566 @@
+#!/usr/bin/env python3
+"""
+serial_channel.py
+Canal serie no bloqueante con el Arduino
+
+Los comandos se encolan y un hilo escritor los envía de uno en uno (el
+sketch descarta lo que llega mientras procesa un comando). Un hilo lector
+bloqueado en read() separa los bytes de respuesta (D/K/E) de las líneas de
+log y completa el comando en curso en cuanto llega su respuesta, sin
+esperas fijas. Cada comando devuelve un Future con su propio timeout.
+
+Formato de la salida del sketch:
+- Líneas de texto terminadas en \\r\\n (CMD_RX: A, SERVO_START, POS: 180...)
+- Bytes de respuesta sueltos al inicio de línea: D (secuencia completada),
+  K (OK), E (error). Una 'E' seguida de 'R' es el comienzo de "ERR: ..."
+
+FramedSerialChannel usa en su lugar el protocolo de tramas de
+arduino_protocol.py: cada respuesta lleva el SEQ de su comando, así que
+pueden estar en vuelo varios comandos a la vez (hasta la cola del sketch).
+Los comandos llevan un carril (el servo del Arduino al que van) y la
+ventana de comandos en vuelo se aplica por carril: un servo ocupado no
+retiene los comandos de los demás.
+"""
+
+import logging
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import arduino_protocol as proto
+import serial_config
+
+logger = logging.getLogger(__name__)
+
+RESP_DONE = b'D'
+RESP_OK = b'K'
+RESP_ERROR = b'E'
+RESPONSES = (RESP_DONE, RESP_OK, RESP_ERROR)
+
+
+class SerialTimeout(Exception):
+    """El Arduino no respondió dentro del plazo del comando"""
+
+
+class SerialCommand:
+    """Comando pendiente de respuesta"""
+
+    __slots__ = ('data', 'expected', 'timeout', 'future', 'sent_at')
+
+    def __init__(self, data, expected, timeout):
+        self.data = data
+        self.expected = expected
+        self.timeout = timeout
+        self.future = Future()
+        self.sent_at = None
+
+
+class ResponseParser:
+    """Separa bytes de respuesta y líneas de log en el flujo del Arduino"""
+
+    def __init__(self, on_response, on_line):
+        self._on_response = on_response
+        self._on_line = on_line
+        self._line = bytearray()
+        self._pending_e = False
+
+    def feed(self, data):
+        for value in data:
+            byte = bytes((value,))
+            if self._pending_e:
+                self._pending_e = False
+                if byte == b'R':
+                    self._line += b'ER'  # "ERR: ...": es una línea de log
+                    continue
+                self._on_response(RESP_ERROR)
+
+            if not self._line:
+                if byte in (RESP_DONE, RESP_OK):
+                    self._on_response(byte)
+                    continue
+                if byte == RESP_ERROR:
+                    self._pending_e = True  # Decidir con el siguiente byte
+                    continue
+                if byte in (b'\r', b'\n'):
+                    continue
+
+            if byte == b'\n':
+                line = self._line.rstrip(b'\r').decode('utf-8', errors='ignore')
+                self._line.clear()
+                if line:
+                    self._on_line(line)
+            else:
+                self._line += byte
+
+    @property
+    def pending_error(self):
+        """True si hay una 'E' a la espera de saber si es respuesta o log"""
+        return self._pending_e
+
+    def idle(self):
+        """El puerto quedó en silencio: una 'E' pendiente era una respuesta"""
+        if self._pending_e:
+            self._pending_e = False
+            self._on_response(RESP_ERROR)
+
+
+class SerialChannel:
+    """Cola de comandos con correlación petición/respuesta sobre un serial.Serial"""
+
+    framed = False
+
+    def __init__(self, port, name="arduino", default_timeout=3.0):
+        """
+        Args:
+            port: serial.Serial ya abierto (su timeout de lectura marca la
+                  granularidad con la que se detectan los silencios)
+            default_timeout: Segundos máximos de espera por respuesta
+        """
+        self.port = port
+        self.name = name
+        self.default_timeout = default_timeout
+
+        self._queue = queue.Queue()
+        self._cond = threading.Condition()
+        self._current = None
+        self._running = False
+        self._threads = []
+        self._parser = ResponseParser(self._on_response, self._on_line)
+
+        # Estadísticas
+        self.completed = 0
+        self.timeouts = 0
+        self.max_latency = 0.0
+
+    def start(self):
+        """Arranca los hilos escritor y lector"""
+        if self._running:
+            return self
+        self._running = True
+        self._threads = [
+            threading.Thread(target=self._writer, name=f"{self.name}-tx", daemon=True),
+            threading.Thread(target=self._reader, name=f"{self.name}-rx", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def submit(self, data, expected=(RESP_DONE, RESP_OK), timeout=None):
+        """Encola un comando sin bloquear
+
+        Args:
+            data: Bytes a enviar (b'A', b'R', b'S')
+            expected: Respuestas que dan el comando por completado con éxito
+            timeout: Segundos de espera desde el envío (None = default_timeout)
+
+        Returns:
+            Future: resultado True/False según la respuesta, o excepción
+                    SerialTimeout si no llegó a tiempo
+        """
+        command = SerialCommand(data, expected, timeout or self.default_timeout)
+        if not self._running:
+            command.future.set_exception(RuntimeError(f"Canal {self.name} detenido"))
+            return command.future
+        self._queue.put(command)
+        return command.future
+
+    def send(self, data, expected=(RESP_DONE, RESP_OK), timeout=None):
+        """Envía y espera la respuesta (para hilos que sí pueden bloquear)"""
+        return self.submit(data, expected, timeout).result()
+
+    def pending(self):
+        """Comandos en cola más el que está en curso"""
+        return self._queue.qsize() + (1 if self._current is not None else 0)
+
+    def _writer(self):
+        while self._running:
+            command = self._queue.get()
+            if command is None:
+                break
+            if not command.future.set_running_or_notify_cancel():
+                continue
+
+            # Los Futures se resuelven fuera del lock: sus callbacks (siguiente
+            # activación, vuelta a reposo) pueden volver a llamar a submit()
+            error = None
+            with self._cond:
+                self._current = command
+                try:
+                    self.port.write(command.data)
+                    self.port.flush()
+                except Exception as e:
+                    self._current = None
+                    error = e
+                else:
+                    command.sent_at = time.monotonic()
+                    logger.debug(f"[{self.name}] Comando enviado: {command.data}")
+
+                    # Esperar a que el lector complete el comando (o vencer el plazo)
+                    deadline = command.sent_at + command.timeout
+                    while self._current is command and self._running:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._current = None
+                            self.timeouts += 1
+                            error = SerialTimeout(f"{self.name}: sin respuesta a {command.data} "
+                                                  f"en {command.timeout:.1f}s")
+                            break
+                        self._cond.wait(remaining)
+            if error is not None:
+                command.future.set_exception(error)
+
+        # Fallar lo que quede pendiente al detener el canal
+        with self._cond:
+            command, self._current = self._current, None
+        if command is not None and not command.future.done():
+            command.future.set_exception(RuntimeError(f"Canal {self.name} detenido"))
+
+    def _reader(self):
+        while self._running:
+            try:
+                data = self.port.read(self.port.in_waiting or 1)
+            except Exception as e:
+                if self._running:
+                    logger.error(f"[{self.name}] Error leyendo del puerto: {e}")
+                    time.sleep(0.1)
+                continue
+            if data:
+                self._parser.feed(data)
+            else:
+                self._parser.idle()
+
+    def _on_response(self, response):
+        with self._cond:
+            command = self._current
+            if command is None:
+                logger.debug(f"[{self.name}] Respuesta {response} sin comando en curso")
+                return
+            self._current = None
+            latency = time.monotonic() - command.sent_at
+            self.completed += 1
+            self.max_latency = max(self.max_latency, latency)
+            self._cond.notify_all()
+        command.future.set_result(response in command.expected)
+        logger.debug(f"[{self.name}] Respuesta {response} a {command.data} "
+                     f"en {latency*1000:.0f}ms")
+
+    def _on_line(self, line):
+        logger.debug(f"[{self.name}] Arduino: {line}")
+
+    def stop(self):
+        """Detiene los hilos; los comandos pendientes fallan con RuntimeError"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        self._queue.put(None)
+        for thread in self._threads:
+            thread.join(timeout=2)
+        self._threads = []
+
+        while True:
+            try:
+                command = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if command is not None and command.future.set_running_or_notify_cancel():
+                command.future.set_exception(RuntimeError(f"Canal {self.name} detenido"))
+
+
+class FramedCommand:
+    """Comando de tramas en vuelo"""
+
+    __slots__ = ('op', 'payload', 'timeout', 'wait_done', 'parse', 'lane', 'future',
+                 'seq', 'sent_at', 'deadline')
+
+    def __init__(self, op, payload, timeout, wait_done, parse=None, lane=None):
+        self.op = op
+        self.lane = lane
+        self.payload = payload
+        self.timeout = timeout
+        self.wait_done = wait_done
+        self.parse = parse
+        self.future = Future()
+        self.seq = None
+        self.sent_at = None
+        self.deadline = None
+
+
+class FramedSerialChannel:
+    """Canal con tramas numeradas: varios comandos en vuelo, logs separados"""
+
+    framed = True
+
+    def __init__(self, port, name="arduino", default_timeout=3.0, max_in_flight=4):
+        """
+        Args:
+            port: serial.Serial ya abierto
+            default_timeout: Segundos máximos desde el envío hasta DONE
+            max_in_flight: Comandos enviados sin completar por carril (no
+                           superar la cola por servo del sketch, COLA_MAX)
+        """
+        self.port = port
+        self.name = name
+        self.default_timeout = default_timeout
+        self.max_in_flight = max_in_flight
+
+        self._pending = deque()
+        self._in_flight = {}
+        self._lane_counts = {}
+        self._cond = threading.Condition()
+        self._seq = 0
+        self._running = False
+        self._threads = []
+        self._decoder = proto.FrameDecoder()
+
+        # Estadísticas
+        self.completed = 0
+        self.timeouts = 0
+        self.nacks = 0
+        self.max_latency = 0.0
+
+    def start(self):
+        """Arranca los hilos escritor y lector"""
+        if self._running:
+            return self
+        self._running = True
+        self._threads = [
+            threading.Thread(target=self._writer, name=f"{self.name}-tx", daemon=True),
+            threading.Thread(target=self._reader, name=f"{self.name}-rx", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def submit(self, op, payload=b'', timeout=None, wait_done=True, parse=None, lane=None):
+        """Encola un comando sin bloquear
+
+        Args:
+            op: Opcode (proto.OP_ACTIVATE, OP_RESET, OP_STATUS)
+            payload: Bytes de parámetros (ver proto.encode_activate)
+            timeout: Segundos desde el envío (None = default_timeout)
+            wait_done: Completar con DONE (movimiento terminado) en vez de con ACK
+            parse: Función payload -> resultado para respuestas con datos
+            lane: Carril para la ventana de comandos en vuelo (p. ej. el servo)
+
+        Returns:
+            Future: True (hecho), False (NACK), resultado de parse, o
+                    excepción SerialTimeout
+        """
+        command = FramedCommand(op, bytes(payload), timeout or self.default_timeout,
+                                wait_done, parse, lane)
+        with self._cond:
+            running = self._running
+            if running:
+                self._pending.append(command)
+                self._cond.notify_all()
+        if not running:
+            command.future.set_exception(RuntimeError(f"Canal {self.name} detenido"))
+        return command.future
+
+    def status(self, timeout=None, servo=0):
+        """Future con el estado de un servo del Arduino (dict de proto.decode_status)"""
+        return self.submit(proto.OP_STATUS, proto.encode_status(servo), timeout=timeout,
+                           wait_done=False, parse=proto.decode_status)
+
+    def negotiate_baudrate(self, candidates, confirm_timeout=0.3,
+                           revert_timeout=serial_config.BAUD_CONFIRM_TIMEOUT):
+        """Sube la velocidad del enlace con SET_BAUD (llamar antes de enviar comandos)
+
+        Para cada candidata mayor que la actual: SET_BAUD a la velocidad
+        actual, ACK, cambio del puerto local y STATUS de confirmación a la
+        nueva velocidad. Si la confirmación falla se vuelve a la velocidad
+        anterior y se espera a que el Arduino haga lo mismo.
+
+        Args:
+            candidates: Velocidades en orden de preferencia
+            confirm_timeout: Espera máxima del STATUS a la nueva velocidad
+            revert_timeout: Tiempo tras el que el Arduino revierte solo
+
+        Returns:
+            int: Velocidad final del enlace
+        """
+        for baudrate in candidates:
+            previous = self.port.baudrate
+            if baudrate <= previous:
+                continue
+            try:
+                accepted = self.submit(proto.OP_SET_BAUD, proto.encode_set_baud(baudrate),
+                                       wait_done=False).result()
+            except SerialTimeout:
+                accepted = False
+            if not accepted:
+                logger.info(f"[{self.name}] {baudrate} baudios rechazados por el Arduino")
+                continue
+
+            self.port.baudrate = baudrate
+            try:
+                self.status(timeout=confirm_timeout).result()
+                logger.info(f"[{self.name}] Enlace a {baudrate} baudios")
+                return baudrate
+            except (SerialTimeout, ValueError):
+                logger.warning(f"[{self.name}] Sin respuesta a {baudrate} baudios: "
+                               f"volviendo a {previous}")
+                self.port.baudrate = previous
+                time.sleep(revert_timeout)
+                with self._cond:
+                    self._decoder = proto.FrameDecoder()  # Descartar basura de la prueba
+
+        return self.port.baudrate
+
+    def pending(self):
+        """Comandos en cola más los que están en vuelo"""
+        with self._cond:
+            return len(self._pending) + len(self._in_flight)
+
+    def _next_seq(self):
+        """Siguiente SEQ libre (1-255; 0 queda para las tramas LOG)"""
+        for _ in range(255):
+            self._seq = self._seq % 255 + 1
+            if self._seq not in self._in_flight:
+                return self._seq
+        raise RuntimeError("Sin números de secuencia libres")
+
+    def _next_command(self):
+        """Primer comando pendiente cuyo carril tiene hueco (llamar con _cond tomado)"""
+        for index, command in enumerate(self._pending):
+            if self._lane_counts.get(command.lane, 0) < self.max_in_flight:
+                del self._pending[index]
+                return command
+        return None
+
+    def _release(self, command):
+        """Saca un comando de vuelo y libera su hueco (llamar con _cond tomado)"""
+        del self._in_flight[command.seq]
+        self._lane_counts[command.lane] -= 1
+        self._cond.notify_all()
+
+        # El sketch ejecuta cada carril en orden: el siguiente empieza ahora y
+        # su plazo cuenta desde aquí, no desde que se envió
+        waiting = [c for c in self._in_flight.values() if c.lane == command.lane]
+        if waiting:
+            head = min(waiting, key=lambda c: c.sent_at)
+            head.deadline = max(head.deadline, time.monotonic() + head.timeout)
+
+    def _writer(self):
+        while True:
+            with self._cond:
+                command = None
+                while self._running:
+                    command = self._next_command()
+                    if command is not None:
+                        break
+                    self._cond.wait()
+                if command is None:
+                    return
+
+                if not command.future.set_running_or_notify_cancel():
+                    continue
+                command.seq = self._next_seq()
+                try:
+                    self.port.write(proto.encode_frame(command.seq, command.op, command.payload))
+                    self.port.flush()
+                except Exception as e:
+                    error = e
+                else:
+                    error = None
+                    command.sent_at = time.monotonic()
+                    command.deadline = command.sent_at + command.timeout
+                    self._in_flight[command.seq] = command
+                    self._lane_counts[command.lane] = self._lane_counts.get(command.lane, 0) + 1
+                    logger.debug(f"[{self.name}] Enviado {proto.OP_NAMES[command.op]} "
+                                 f"#{command.seq}")
+            # Fuera del lock, como todos los Futures del canal (ver _dispatch)
+            if error is not None:
+                command.future.set_exception(error)
+
+    def _reader(self):
+        while self._running:
+            try:
+                data = self.port.read(self.port.in_waiting or 1)
+            except Exception as e:
+                if self._running:
+                    logger.error(f"[{self.name}] Error leyendo del puerto: {e}")
+                    time.sleep(0.1)
+                continue
+            for frame in self._decoder.feed(data):
+                self._dispatch(frame)
+            self._expire()
+
+    def _dispatch(self, frame):
+        if frame.op == proto.OP_LOG:
+            logger.debug(f"[{self.name}] Arduino: "
+                         f"{frame.payload.decode('utf-8', errors='ignore')}")
+            return
+
+        # El Future se resuelve después de soltar _cond: sus callbacks
+        # (ActuationScheduler._on_done, Actuator._on_idle) envían comandos y
+        # toman sus propios locks, y no deben ejecutarse dentro del del canal
+        with self._cond:
+            command = self._in_flight.get(frame.seq)
+            if command is None:
+                logger.debug(f"[{self.name}] {proto.describe(frame)} sin comando en vuelo")
+                return
+
+            result = error = None
+            if frame.op == proto.OP_NACK:
+                self.nacks += 1
+                logger.warning(f"[{self.name}] {proto.describe(frame)}")
+                self._complete(command)
+                result = False
+            elif frame.op == proto.OP_DONE:
+                self._complete(command)
+                result = True
+            elif frame.op == proto.OP_ACK and (not command.wait_done
+                                               or command.op in (proto.OP_STATUS, proto.OP_SET_BAUD)):
+                try:
+                    result = command.parse(frame.payload) if command.parse else True
+                    self._complete(command)
+                except ValueError as e:
+                    self._release(command)
+                    error = e
+            else:
+                return
+
+        if error is not None:
+            command.future.set_exception(error)
+        else:
+            command.future.set_result(result)
+
+    def _complete(self, command):
+        """Cierra un comando en vuelo (con _cond tomado; el Future lo resuelve quien llama)"""
+        self._release(command)
+        latency = time.monotonic() - command.sent_at
+        self.completed += 1
+        self.max_latency = max(self.max_latency, latency)
+
+    def _expire(self):
+        now = time.monotonic()
+        with self._cond:
+            expired = [c for c in self._in_flight.values() if c.deadline <= now]
+            for command in expired:
+                self._release(command)
+                self.timeouts += 1
+        for command in expired:
+            command.future.set_exception(SerialTimeout(
+                f"{self.name}: sin respuesta a {proto.OP_NAMES[command.op]} "
+                f"#{command.seq} en {command.timeout:.1f}s"))
+
+    def stop(self):
+        """Detiene los hilos; los comandos pendientes fallan con RuntimeError"""
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=2)
+        self._threads = []
+
+        with self._cond:
+            leftover = list(self._pending) + list(self._in_flight.values())
+            self._pending.clear()
+            self._in_flight.clear()
+            self._lane_counts.clear()
+        for command in leftover:
+            if not command.future.done():
+                command.future.set_exception(RuntimeError(f"Canal {self.name} detenido"))
@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+serial_channel_async.py
+Canales serie con el Arduino sobre asyncio (pyserial-asyncio)
+
+Equivalentes de SerialChannel y FramedSerialChannel (serial_channel.py)
+para el controlador asyncio: misma interfaz submit() -> Future, mismas
+estadísticas y mismo protocolo, pero sin hilos:
+- La escritura es la del transporte asyncio (con buffer, no bloquea), así
+  que submit() envía en el acto si el carril tiene hueco
+- Una tarea por canal (run()) lee el puerto y completa los Futures
+- Los plazos son temporizadores del bucle (loop.call_at): nada se despierta
+  si no hay comandos en vuelo
+
+submit() no es una corrutina: las compuertas (actuators.py) y el
+planificador de activaciones lo usan igual con ambos tipos de canal.
+
+Instalación:
+    pip install pyserial-asyncio
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+
+import arduino_protocol as proto
+import serial_config
+from serial_channel import RESP_DONE, RESP_OK, ResponseParser, SerialTimeout
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 256
+IDLE_TIMEOUT = 0.1  # Silencio tras una 'E' para darla por respuesta (protocolo de texto)
+
+
+class _AsyncCommand:
+    """Comando pendiente o en vuelo"""
+
+    __slots__ = ('data', 'expected', 'op', 'payload', 'timeout', 'wait_done', 'parse', 'lane',
+                 'future', 'seq', 'sent_at', 'deadline', 'timer')
+
+    def __init__(self, future, timeout, data=None, expected=None, op=None, payload=b'',
+                 wait_done=True, parse=None, lane=None):
+        self.future = future
+        self.timeout = timeout
+        self.data = data
+        self.expected = expected
+        self.op = op
+        self.payload = payload
+        self.wait_done = wait_done
+        self.parse = parse
+        self.lane = lane
+        self.seq = None
+        self.sent_at = None
+        self.deadline = None
+        self.timer = None
+
+
+class _AsyncChannelBase:
+    """Puerto, tarea lectora y estadísticas comunes"""
+
+    def __init__(self, reader, writer, name, default_timeout):
+        """
+        Args:
+            reader, writer: Resultado de serial_asyncio.open_serial_connection()
+            default_timeout: Segundos máximos de espera por respuesta
+        """
+        self.reader = reader
+        self.writer = writer
+        self.name = name
+        self.default_timeout = default_timeout
+        self._loop = asyncio.get_running_loop()
+        self._running = True
+
+        # Estadísticas
+        self.completed = 0
+        self.timeouts = 0
+        self.max_latency = 0.0
+
+    @property
+    def baudrate(self):
+        return self.writer.transport.serial.baudrate
+
+    @baudrate.setter
+    def baudrate(self, value):
+        self.writer.transport.serial.baudrate = value
+
+    def _new_future(self):
+        future = self._loop.create_future()
+        if not self._running:
+            future.set_exception(RuntimeError(f"Canal {self.name} detenido"))
+        return future
+
+    def _arm(self, command, deadline):
+        """(Re)programa el plazo de un comando enviado"""
+        if command.timer is not None:
+            command.timer.cancel()
+        command.deadline = deadline
+        command.timer = self._loop.call_at(
+            self._loop.time() + deadline - time.monotonic(), self._expire, command)
+
+    def _finish(self, command, result=None, error=None):
+        if command.timer is not None:
+            command.timer.cancel()
+            command.timer = None
+        if command.future.done():
+            return
+        if error is not None:
+            command.future.set_exception(error)
+            return
+        latency = time.monotonic() - command.sent_at
+        self.completed += 1
+        self.max_latency = max(self.max_latency, latency)
+        command.future.set_result(result)
+
+    async def run(self):
+        """Tarea lectora: ejecutar dentro del TaskGroup del controlador"""
+        try:
+            while True:
+                data = await self._read()
+                if not data:
+                    if not self._running:
+                        return  # stop() cerró el puerto
+                    raise ConnectionError(f"{self.name}: puerto cerrado")
+                self._feed(data)
+        finally:
+            self.stop()
+
+    async def _read(self):
+        return await self.reader.read(READ_SIZE)
+
+    def stop(self):
+        """Falla los comandos pendientes con RuntimeError y cierra el puerto"""
+        if not self._running:
+            return
+        self._running = False
+        for command in self._drain():
+            self._finish(command, error=RuntimeError(f"Canal {self.name} detenido"))
+        self.writer.close()
+
+
+class AsyncSerialChannel(_AsyncChannelBase):
+    """Protocolo de un carácter: un comando en curso cada vez"""
+
+    framed = False
+
+    def __init__(self, reader, writer, name="arduino", default_timeout=3.0):
+        super().__init__(reader, writer, name, default_timeout)
+        self._queue = deque()
+        self._current = None
+        self._parser = ResponseParser(self._on_response, self._on_line)
+
+    def submit(self, data, expected=(RESP_DONE, RESP_OK), timeout=None):
+        """Encola un comando sin bloquear (ver SerialChannel.submit)"""
+        command = _AsyncCommand(self._new_future(), timeout or self.default_timeout,
+                                data=data, expected=expected)
+        if self._running:
+            self._queue.append(command)
+            self._pump()
+        return command.future
+
+    def pending(self):
+        """Comandos en cola más el que está en curso"""
+        return len(self._queue) + (1 if self._current is not None else 0)
+
+    def _pump(self):
+        """Envía el siguiente comando si no hay ninguno en curso"""
+        while self._current is None and self._queue:
+            command = self._queue.popleft()
+            if command.future.done():
+                continue
+            try:
+                self.writer.write(command.data)
+            except Exception as e:
+                command.future.set_exception(e)
+                continue
+            command.sent_at = time.monotonic()
+            self._current = command
+            self._arm(command, command.sent_at + command.timeout)
+            logger.debug(f"[{self.name}] Comando enviado: {command.data}")
+
+    def _expire(self, command):
+        if self._current is command:
+            self._current = None
+        self.timeouts += 1
+        command.timer = None
+        self._finish(command, error=SerialTimeout(
+            f"{self.name}: sin respuesta a {command.data} en {command.timeout:.1f}s"))
+        self._pump()
+
+    async def _read(self):
+        if not self._parser.pending_error:
+            return await self.reader.read(READ_SIZE)
+        # Solo se espera con plazo cuando una 'E' está pendiente de decidir
+        try:
+            return await asyncio.wait_for(self.reader.read(READ_SIZE), IDLE_TIMEOUT)
+        except asyncio.TimeoutError:
+            self._parser.idle()
+            return await self._read()
+
+    def _feed(self, data):
+        self._parser.feed(data)
+
+    def _on_response(self, response):
+        command = self._current
+        if command is None:
+            logger.debug(f"[{self.name}] Respuesta {response} sin comando en curso")
+            return
+        self._current = None
+        self._finish(command, response in command.expected)
+        self._pump()
+
+    def _on_line(self, line):
+        logger.debug(f"[{self.name}] Arduino: {line}")
+
+    def _drain(self):
+        commands = list(self._queue) + ([self._current] if self._current else [])
+        self._queue.clear()
+        self._current = None
+        return commands
+
+
+class AsyncFramedChannel(_AsyncChannelBase):
+    """Protocolo de tramas: varios comandos en vuelo por carril (ver FramedSerialChannel)"""
+
+    framed = True
+
+    def __init__(self, reader, writer, name="arduino", default_timeout=3.0, max_in_flight=4):
+        super().__init__(reader, writer, name, default_timeout)
+        self.max_in_flight = max_in_flight
+        self._pending = deque()
+        self._in_flight = {}
+        self._lane_counts = {}
+        self._seq = 0
+        self._decoder = proto.FrameDecoder()
+        self.nacks = 0
+
+    def submit(self, op, payload=b'', timeout=None, wait_done=True, parse=None, lane=None):
+        """Encola un comando sin bloquear (ver FramedSerialChannel.submit)"""
+        command = _AsyncCommand(self._new_future(), timeout or self.default_timeout,
+                                op=op, payload=bytes(payload), wait_done=wait_done,
+                                parse=parse, lane=lane)
+        if self._running:
+            self._pending.append(command)
+            self._pump()
+        return command.future
+
+    def status(self, timeout=None, servo=0):
+        """Future con el estado de un servo del Arduino (dict de proto.decode_status)"""
+        return self.submit(proto.OP_STATUS, proto.encode_status(servo), timeout=timeout,
+                           wait_done=False, parse=proto.decode_status)
+
+    async def negotiate_baudrate(self, candidates, confirm_timeout=0.3,
+                                 revert_timeout=serial_config.BAUD_CONFIRM_TIMEOUT):
+        """Sube la velocidad del enlace con SET_BAUD (ver FramedSerialChannel)"""
+        for baudrate in candidates:
+            previous = self.baudrate
+            if baudrate <= previous:
+                continue
+            try:
+                accepted = await self.submit(proto.OP_SET_BAUD, proto.encode_set_baud(baudrate),
+                                             wait_done=False)
+            except SerialTimeout:
+                accepted = False
+            if not accepted:
+                logger.info(f"[{self.name}] {baudrate} baudios rechazados por el Arduino")
+                continue
+
+            # El ACK ya está leído: el transporte no tiene bytes a la velocidad anterior
+            self.baudrate = baudrate
+            try:
+                await self.status(timeout=confirm_timeout)
+                logger.info(f"[{self.name}] Enlace a {baudrate} baudios")
+                return baudrate
+            except (SerialTimeout, ValueError):
+                logger.warning(f"[{self.name}] Sin respuesta a {baudrate} baudios: "
+                               f"volviendo a {previous}")
+                self.baudrate = previous
+                await asyncio.sleep(revert_timeout)
+                self._decoder = proto.FrameDecoder()  # Descartar basura de la prueba
+
+        return self.baudrate
+
+    def pending(self):
+        """Comandos en cola más los que están en vuelo"""
+        return len(self._pending) + len(self._in_flight)
+
+    def _next_seq(self):
+        """Siguiente SEQ libre (1-255; 0 queda para las tramas LOG)"""
+        for _ in range(255):
+            self._seq = self._seq % 255 + 1
+            if self._seq not in self._in_flight:
+                return self._seq
+        raise RuntimeError("Sin números de secuencia libres")
+
+    def _pump(self):
+        """Envía los comandos pendientes cuyo carril tiene hueco"""
+        index = 0
+        while index < len(self._pending):
+            command = self._pending[index]
+            if self._lane_counts.get(command.lane, 0) >= self.max_in_flight:
+                index += 1
+                continue
+            del self._pending[index]
+            if command.future.done():
+                continue
+
+            command.seq = self._next_seq()
+            try:
+                self.writer.write(proto.encode_frame(command.seq, command.op, command.payload))
+            except Exception as e:
+                command.future.set_exception(e)
+                continue
+            command.sent_at = time.monotonic()
+            self._arm(command, command.sent_at + command.timeout)
+            self._in_flight[command.seq] = command
+            self._lane_counts[command.lane] = self._lane_counts.get(command.lane, 0) + 1
+            logger.debug(f"[{self.name}] Enviado {proto.OP_NAMES[command.op]} #{command.seq}")
+
+    def _release(self, command):
+        """Saca un comando de vuelo y envía los que esperaban hueco"""
+        del self._in_flight[command.seq]
+        self._lane_counts[command.lane] -= 1
+
+        # El sketch ejecuta cada carril en orden: el plazo del siguiente cuenta desde aquí
+        waiting = [c for c in self._in_flight.values() if c.lane == command.lane]
+        if waiting:
+            head = min(waiting, key=lambda c: c.sent_at)
+            deadline = time.monotonic() + head.timeout
+            if deadline > head.deadline:
+                self._arm(head, deadline)
+        self._pump()
+
+    def _expire(self, command):
+        command.timer = None
+        if self._in_flight.get(command.seq) is not command:
+            return
+        self.timeouts += 1
+        self._finish(command, error=SerialTimeout(
+            f"{self.name}: sin respuesta a {proto.OP_NAMES[command.op]} "
+            f"#{command.seq} en {command.timeout:.1f}s"))
+        self._release(command)
+
+    def _feed(self, data):
+        for frame in self._decoder.feed(data):
+            self._dispatch(frame)
+
+    def _dispatch(self, frame):
+        if frame.op == proto.OP_LOG:
+            logger.debug(f"[{self.name}] Arduino: "
+                         f"{frame.payload.decode('utf-8', errors='ignore')}")
+            return
+
+        command = self._in_flight.get(frame.seq)
+        if command is None:
+            logger.debug(f"[{self.name}] {proto.describe(frame)} sin comando en vuelo")
+            return
+
+        if frame.op == proto.OP_NACK:
+            self.nacks += 1
+            logger.warning(f"[{self.name}] {proto.describe(frame)}")
+            self._finish(command, False)
+        elif frame.op == proto.OP_DONE:
+            self._finish(command, True)
+        elif frame.op == proto.OP_ACK and (not command.wait_done
+                                           or command.op in (proto.OP_STATUS, proto.OP_SET_BAUD)):
+            try:
+                result = command.parse(frame.payload) if command.parse else True
+            except ValueError as e:
+                self._finish(command, error=e)
+            else:
+                self._finish(command, result)
+        else:
+            return
+        self._release(command)
+
+    def _drain(self):
+        commands = list(self._pending) + list(self._in_flight.values())
+        self._pending.clear()
+        self._in_flight.clear()
+        self._lane_counts.clear()
+        return commands
@@ -0,0 +1,24 @@
+#!/usr/bin/env python3
+"""
+serial_config.py
+Parámetros del enlace serie RPi5 <-> Arduino
+
+Compartidos por control_servo_directo.py, diagnostico_arduino.py,
+arduino_sim.py y benchmark_serial.py. BAUDRATE debe coincidir con
+BAUD_INICIAL del sketch (y con UART_BAUDRATE de picow/main_mejorado.py si la
+Pico habla con el mismo Arduino).
+
+Tras conectar a BAUDRATE, el host puede negociar una velocidad mayor con
+SET_BAUD (protocolo de tramas). El sketch vuelve solo a la velocidad
+anterior si no recibe una trama válida en BAUD_CONFIRM_TIMEOUT, así que un
+cable que no aguanta la velocidad nueva nunca deja el enlace mudo.
+"""
+
+BAUDRATE = 9600   # Velocidad de arranque del sketch (tras el reset por DTR)
+STOPBITS = 2      # Bits de stop del host (como la Pico); el sketch a 8N1 los acepta
+
+# Candidatas en orden de preferencia (ATmega328P a 16 MHz: 1M es exacta con
+# U2X; 115200 tiene ~2% de error pero es fiable con cables cortos)
+BAUDRATES_NEGOCIABLES = (1000000, 115200)
+
+BAUD_CONFIRM_TIMEOUT = 1.0  # Segundos (igual que BAUD_CONFIRM_TIMEOUT del sketch)
@@ -1,36 +1,43 @@
 # subscriber.py (actualizado para ambos topics)
 import paho.mqtt.client as mqtt
-import json
+import time
+
+import payload_codec
 
 BROKER_IP = "localhost"
 BROKER_PORT = 1883
 TOPIC_PICO = "robot/pico/estado"
 TOPIC_IA = "robot/deteccion/ia"
+CLIENT_ID = f"suscriber_{int(time.time())}"
+TOPIC_FORMATOS = f"{payload_codec.FORMATS_TOPIC}/{CLIENT_ID}"
 
 
 def on_connect(client, userdata, flags, rc):
     print(f"Conectado al broker con código: {rc}")
     client.subscribe([(TOPIC_PICO, 0), (TOPIC_IA, 0)])
     print(f"Suscrito a: {TOPIC_PICO} y {TOPIC_IA}")
+    # Anunciar que este cliente entiende JSON y binario (payload_codec.py)
+    client.publish(TOPIC_FORMATOS, payload_codec.formats_announcement(), qos=1, retain=True)
 
 
 def on_message(client, userdata, msg):
     topic = msg.topic
-    payload = msg.payload.decode()
-    print(f"\n[{topic}] Recibido: {payload}")
+    print(f"\n[{topic}] Recibido: {len(msg.payload)} bytes")
 
     try:
-        data = json.loads(payload)
-        if topic == TOPIC_IA:
-            print(
-                f" DETECCIÓN AI: {data['objeto']} con {data['confianza']*100}% confianza")
-        elif topic == TOPIC_PICO:
-            print(f" Pico W: {data}")
-    except json.JSONDecodeError:
-        print(f" No es JSON válido")
-
-
-client = mqtt.Client()
+        # Una detección o un lote, JSON o binario: se detecta por el primer byte
+        for data in payload_codec.decode_detections(msg.payload):
+            if topic == TOPIC_IA:
+                print(
+                    f" DETECCIÓN AI: {data['objeto']} con {data['confianza']*100}% confianza")
+            elif topic == TOPIC_PICO:
+                print(f" Pico W: {data}")
+    except ValueError:
+        print(f" No es JSON ni binario válido: {msg.payload!r}")
+
+
+client = mqtt.Client(client_id=CLIENT_ID)
+client.will_set(TOPIC_FORMATOS, b"", qos=1, retain=True)
 client.on_connect = on_connect
 client.on_message = on_message
 
@@ -41,4 +48,5 @@ try:
     client.loop_forever()
 except KeyboardInterrupt:
     print("\nDesconectando...")
+    client.publish(TOPIC_FORMATOS, b"", qos=1, retain=True)
     client.disconnect()
\ No newline at end of file
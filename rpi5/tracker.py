@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+"""
+tracker.py
+Seguimiento multi-objeto de pistachos (estilo SORT)
+
+Cada detección se asocia a un track persistente con ID propio. Un track
+genera exactamente un evento cuando su centro cruza la línea de disparo, de
+modo que un pistacho lento no se publica varias veces y dos pistachos
+seguidos no se pierden por un cooldown.
+
+Asociación por frame:
+1. Se predice la caja de cada track con su velocidad (modelo de velocidad constante)
+2. Emparejamiento voraz por IoU (>= iou_threshold)
+3. Los que quedan se emparejan por distancia entre centros (<= max_distance)
+4. Detecciones sin pareja -> tracks nuevos; tracks sin pareja acumulan fallos
+"""
+
+import itertools
+
+import numpy as np
+
+
+class Track:
+    """Pistacho seguido a lo largo de varios frames"""
+
+    def __init__(self, track_id, bbox, confidence, class_id, timestamp):
+        self.id = track_id
+        self.bbox = np.asarray(bbox, dtype=np.float32)
+        self.confidence = float(confidence)
+        self.class_id = int(class_id)
+        self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.first_center = self.center
+        self.velocity = np.zeros(2, dtype=np.float32)  # px/s (x, y)
+        self.hits = 1
+        self.misses = 0
+        self.triggered = False
+
+    @property
+    def center(self):
+        return np.array([(self.bbox[0] + self.bbox[2]) / 2,
+                         (self.bbox[1] + self.bbox[3]) / 2], dtype=np.float32)
+
+    def predict(self, timestamp):
+        """Caja prevista en `timestamp` según la velocidad estimada"""
+        dt = timestamp - self.last_seen
+        dx, dy = self.velocity * dt
+        return self.bbox + np.array([dx, dy, dx, dy], dtype=np.float32)
+
+    def update(self, bbox, confidence, timestamp, smoothing=0.5):
+        """Incorpora una nueva observación y actualiza la velocidad (media exponencial)"""
+        previous = self.center
+        dt = timestamp - self.last_seen
+        self.bbox = np.asarray(bbox, dtype=np.float32)
+        if dt > 0:
+            measured = (self.center - previous) / dt
+            self.velocity = measured if self.hits == 1 else (
+                smoothing * measured + (1 - smoothing) * self.velocity)
+        self.confidence = float(confidence)
+        self.last_seen = timestamp
+        self.hits += 1
+        self.misses = 0
+
+
+def iou_matrix(a, b):
+    """IoU entre cada caja de a (N, 4) y de b (M, 4)"""
+    top_left = np.maximum(a[:, None, :2], b[None, :, :2])
+    bottom_right = np.minimum(a[:, None, 2:], b[None, :, 2:])
+    inter = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(a[:, 2:] - a[:, :2], axis=1)
+    area_b = np.prod(b[:, 2:] - b[:, :2], axis=1)
+    return inter / (area_a[:, None] + area_b[None, :] - inter + 1e-9)
+
+
+def greedy_match(score, threshold, higher_is_better=True):
+    """Emparejamiento voraz sobre una matriz de puntuaciones (tracks x detecciones)
+
+    Returns:
+        list: Pares (índice de track, índice de detección)
+    """
+    if score.size == 0:
+        return []
+    order = np.argsort(-score if higher_is_better else score, axis=None)
+    used_rows, used_cols, pairs = set(), set(), []
+    for flat in order:
+        row, col = divmod(int(flat), score.shape[1])
+        value = score[row, col]
+        if (value < threshold) if higher_is_better else (value > threshold):
+            break
+        if row in used_rows or col in used_cols:
+            continue
+        used_rows.add(row)
+        used_cols.add(col)
+        pairs.append((row, col))
+    return pairs
+
+
+class PistachioTracker:
+    """Tracker IoU/centroide con línea de disparo"""
+
+    def __init__(self, trigger_line, axis="y", direction=1, iou_threshold=0.3,
+                 max_distance=80, max_misses=5, min_hits=2):
+        """
+        Args:
+            trigger_line: Coordenada (px) de la línea de disparo en el eje `axis`
+            axis: Eje de avance de la cinta ("x" o "y")
+            direction: +1 si los pistachos avanzan hacia coordenadas crecientes, -1 si no
+            iou_threshold: IoU mínimo para asociar detección y track
+            max_distance: Distancia máxima (px) entre centros en la segunda pasada
+            max_misses: Frames sin observar antes de eliminar un track
+            min_hits: Observaciones mínimas para que un track pueda disparar
+        """
+        if axis not in ("x", "y"):
+            raise ValueError(f"Eje de disparo inválido: {axis}")
+        self.trigger_line = trigger_line
+        self.axis = 0 if axis == "x" else 1
+        self.direction = 1 if direction >= 0 else -1
+        self.iou_threshold = iou_threshold
+        self.max_distance = max_distance
+        self.max_misses = max_misses
+        self.min_hits = min_hits
+
+        self.tracks = []
+        self._ids = itertools.count(1)
+        self.triggered_count = 0
+
+    def _side(self, center):
+        """Distancia con signo a la línea (> 0 = ya la cruzó)"""
+        return (center[self.axis] - self.trigger_line) * self.direction
+
+    def update(self, detections, timestamp):
+        """Asocia las detecciones de un frame y devuelve los tracks que cruzaron la línea
+
+        Args:
+            detections: Array estructurado con campos 'bbox', 'confidence', 'class_id'
+            timestamp: Instante de captura del frame (segundos, monotónico)
+
+        Returns:
+            list: Tracks que cruzaron la línea de disparo en este frame
+        """
+        boxes = np.asarray(detections['bbox'], dtype=np.float32).reshape(-1, 4)
+        unmatched_dets = set(range(len(boxes)))
+        unmatched_tracks = set(range(len(self.tracks)))
+        pairs = []
+
+        if self.tracks and len(boxes):
+            predicted = np.stack([track.predict(timestamp) for track in self.tracks])
+
+            # 1) IoU con la caja prevista
+            for row, col in greedy_match(iou_matrix(predicted, boxes), self.iou_threshold):
+                pairs.append((row, col))
+                unmatched_tracks.discard(row)
+                unmatched_dets.discard(col)
+
+            # 2) Distancia entre centros para los restantes (movimientos rápidos)
+            if unmatched_tracks and unmatched_dets:
+                rows, cols = sorted(unmatched_tracks), sorted(unmatched_dets)
+                pred_centers = (predicted[rows, :2] + predicted[rows, 2:]) / 2
+                det_centers = (boxes[cols, :2] + boxes[cols, 2:]) / 2
+                distance = np.linalg.norm(pred_centers[:, None] - det_centers[None], axis=2)
+                for r, c in greedy_match(distance, self.max_distance, higher_is_better=False):
+                    pairs.append((rows[r], cols[c]))
+                    unmatched_tracks.discard(rows[r])
+                    unmatched_dets.discard(cols[c])
+
+        events = []
+        for row, col in pairs:
+            track = self.tracks[row]
+            track.update(boxes[col], detections['confidence'][col], timestamp)
+            # Dispara una vez: apareció antes de la línea y ya está al otro lado
+            crossed = self._side(track.first_center) < 0 <= self._side(track.center)
+            if crossed and not track.triggered and track.hits >= self.min_hits:
+                track.triggered = True
+                self.triggered_count += 1
+                events.append(track)
+
+        for row in unmatched_tracks:
+            self.tracks[row].misses += 1
+
+        for col in sorted(unmatched_dets):
+            self.tracks.append(Track(next(self._ids), boxes[col], detections['confidence'][col],
+                                     detections['class_id'][col], timestamp))
+
+        self.tracks = [track for track in self.tracks if track.misses <= self.max_misses]
+        return events
+
+    def time_to_reach(self, track, position, min_speed=1.0):
+        """Segundos (desde la última observación) hasta que el track llegue a `position`
+
+        Args:
+            position: Coordenada (px) en el eje de avance; puede estar fuera
+                      de la imagen (actuador aguas abajo de la cámara)
+            min_speed: Velocidad mínima (px/s) para considerar la estimación válida
+
+        Returns:
+            float o None si el track no avanza hacia `position`
+        """
+        speed = float(track.velocity[self.axis]) * self.direction
+        remaining = (position - float(track.center[self.axis])) * self.direction
+        if speed < min_speed or remaining < 0:
+            return None
+        return remaining / speed
+
+    def active_tracks(self):
+        """Tracks observados en el último frame"""
+        return [track for track in self.tracks if track.misses == 0]
@@ -6,32 +6,72 @@ Soluciona problemas de conexión MQTT y comunicación con Arduino
 
 Características:
 - Detección con umbral configurable (>= 0.6 por defecto)
-- Reconexión automática MQTT
-- Publicación solo cuando hay detección válida
+- Publicación MQTT sin bloqueos: buffer de salida y reconexión en segundo
+  plano (mqtt_publisher.py), los FPS no caen si el broker se cae
+- Publicación solo cuando hay detección válida, un mensaje por frame (o
+  por ventana de tiempo) con todas las detecciones (PUBLISH_MODE)
 - Manejo robusto de errores de cámara
 - Logs detallados para debugging
+- Modo pipeline: captura, inferencia y display en hilos separados
+- Modo sin pantalla (HEADLESS): sin copia, dibujo ni ventana por frame,
+  parada limpia con SIGTERM
+- Vista previa MJPEG por HTTP bajo demanda (preview_server.py): codificación
+  en un hilo aparte, nada si no hay clientes, fps y calidad por cliente
 """
 
 import cv2
 import numpy as np
-import paho.mqtt.client as mqtt
-import json
 import os
+import signal
+import threading
 import time
 import logging
-from ultralytics import YOLO
 from datetime import datetime
 
+from backends import create_backend
+from frame_source import FrameSource
+from pipeline import DetectionPipeline, MultiSourcePipeline, StageStats
+from motion_gate import MotionGate
+from mqtt_publisher import MQTTPublisher
+from preview_server import PreviewServer
+from roi import RegionOfInterest, calibrate_roi
+from tracker import PistachioTracker
+
 # ============ CONFIGURACIÓN ============
 # MQTT
 BROKER = "localhost"  # Usa la IP del RPi5 si es desde otra máquina
 PORT = 1883
 TOPIC_DETECCION = "robot/pico/estado"  # Topic para enviar detecciones
 QOS = 1  # Quality of Service: 0, 1 o 2
+MQTT_BUFFER_SIZE = 100  # Mensajes retenidos mientras el broker no responde
+MQTT_DROP_POLICY = "oldest"  # Buffer lleno: "oldest" (perder el más antiguo) o "newest"
+MQTT_FLUSH_ON_RECONNECT = True  # Enviar lo retenido al reconectar (False = descartarlo)
+MQTT_RECONNECT_MAX_DELAY = 30  # Segundos máximos entre reintentos (espera exponencial desde 1s)
+# Formato de los mensajes (payload_codec.py): "json", "bin1" (binario compacto)
+# o "auto" (bin1 si todos los consumidores anunciados lo entienden)
+PAYLOAD_FORMAT = "auto"
+# Agrupación de detecciones: "evento" (un mensaje por pistacho), "frame" (un
+# mensaje con todas las del frame) o "ventana" (todas las de PUBLISH_WINDOW_MS)
+PUBLISH_MODE = "frame"
+PUBLISH_WINDOW_MS = 100
 
 # Detección
+INFERENCE_BACKEND = "pytorch"  # "pytorch", "onnx", "openvino" o "ncnn" (ver backends.py)
+INFERENCE_IMGSZ = 640  # Resolución de inferencia (y de exportación)
+INFERENCE_PRECISION = "fp32"  # "fp32", "fp16" o "int8" (solo backend onnx, ver quantize_model.py)
 CONFIDENCE_THRESHOLD = 0.6  # Umbral mínimo de confianza (60%)
-PUB_COOLDOWN = 1.0  # Segundos entre publicaciones (evita spam)
+PUB_COOLDOWN = 1.0  # Segundos entre publicaciones (solo sin tracker; por lote si se agrupa)
+
+# Tracking: un evento por pistacho (con track_id) cuando cruza la línea de disparo.
+# Sustituye al cooldown: ni publica dos veces el mismo pistacho ni pierde el siguiente
+TRACKER_ENABLED = True
+TRIGGER_LINE = 240  # Coordenada (px) de la línea de disparo
+TRIGGER_AXIS = "y"  # Eje de avance de la cinta en la imagen: "x" o "y"
+TRIGGER_DIRECTION = 1  # +1 si los pistachos avanzan hacia coordenadas crecientes, -1 si no
+# Posición de la compuerta medida desde la línea de disparo, en píxeles de imagen
+# a lo largo del eje de avance (puede caer fuera del frame). Con la velocidad del
+# track se publica la hora prevista de llegada ("llegada_ts")
+ACTUATOR_DISTANCE_PX = 400
 
 # Cámara
 CAMERA_INDEX = 0
@@ -39,6 +79,45 @@ FRAME_WIDTH = 640
 FRAME_HEIGHT = 480
 FPS_TARGET = 15
 
+# Región de interés: solo se ejecuta YOLO sobre la banda de la cinta.
+# None (frame completo), rectángulo (x, y, ancho, alto) o polígono [(x, y), ...].
+# Con una ROI pequeña conviene bajar INFERENCE_IMGSZ (p. ej. 320)
+ROI = None
+ROI_AUTO_CALIBRATE = False  # Si ROI es None, calcularla con unos segundos de detecciones
+ROI_CALIBRATION_SECONDS = 5.0
+ROI_MARGIN = 20  # Píxeles de margen alrededor de las detecciones de calibración
+
+# Filtro de movimiento: no ejecutar YOLO cuando la cinta (o la ROI) no cambia
+MOTION_GATE = True
+MOTION_METHOD = "diff"  # "diff" (fondo por media móvil) o "mog2"
+MOTION_TILES_ONLY = False  # Inferir solo el recorte de los tiles que cambiaron
+
+# Multi-cámara: lista de (índice de cámara, topic MQTT). Con más de una entrada
+# los frames de todas las cámaras se agrupan en una sola llamada batch a YOLO
+CAMERAS = [
+    (CAMERA_INDEX, TOPIC_DETECCION),
+]
+
+# Pipeline (captura, inferencia y display en hilos separados)
+PIPELINE_MODE = True  # False = loop secuencial clásico
+PIPELINE_QUEUE_SIZE = 1  # Capacidad de las colas entre etapas (1 = solo el último frame)
+STATS_INTERVAL = 10.0  # Segundos entre resúmenes de tiempos por etapa
+
+# Modo sin pantalla (producción): ni ventana ni dibujo por frame, se para con
+# SIGTERM/Ctrl+C. Por defecto se activa si no hay servidor gráfico
+HEADLESS = not (os.environ.get("DISPLAY") or os.environ.get("WAYLAND_DISPLAY"))
+# Vista previa MJPEG en http://127.0.0.1:PREVIEW_PORT/ (p. ej. 8080; None = desactivada),
+# con o sin pantalla. Sin autenticación: por defecto solo escucha en la propia
+# RPi5 (desde fuera: ssh -L 8080:localhost:8080). Solo se anota un frame cuando
+# hay un cliente mirando, a PREVIEW_FPS como máximo; a los clientes lentos se les
+# baja la calidad y luego los fps
+PREVIEW_PORT = None
+PREVIEW_HOST = "127.0.0.1"  # "0.0.0.0" = accesible desde toda la red (sin contraseña)
+PREVIEW_FPS = 5
+PREVIEW_QUALITY = 70
+PREVIEW_MIN_FPS = 1
+PREVIEW_MIN_QUALITY = 30
+
 # Logging
 LOG_LEVEL = logging.INFO
 LOG_FILE = "deteccion_pistachos.log"
@@ -54,140 +133,182 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-
-# ============ CLASE MQTT CON RECONEXIÓN ============
-class MQTTPublisher:
-    """Cliente MQTT con reconexión automática"""
-    
-    def __init__(self, broker, port, topic):
-        self.broker = broker
-        self.port = port
-        self.topic = topic
-        self.client = None
-        self.connected = False
-        self.reconnect_delay = 5  # segundos
-        
-    def on_connect(self, client, userdata, flags, rc):
-        """Callback cuando se conecta al broker"""
-        if rc == 0:
-            self.connected = True
-            logger.info(f"✓ Conectado al broker MQTT en {self.broker}:{self.port}")
-        else:
-            self.connected = False
-            logger.error(f"✗ Error de conexión MQTT. Código: {rc}")
-            
-    def on_disconnect(self, client, userdata, rc):
-        """Callback cuando se desconecta del broker"""
-        self.connected = False
-        if rc != 0:
-            logger.warning(f"⚠ Desconectado inesperadamente. Código: {rc}")
-            
-    def connect(self):
-        """Conecta al broker MQTT con reintentos"""
-        try:
-            self.client = mqtt.Client(client_id=f"rpi5_detector_{int(time.time())}")
-            self.client.on_connect = self.on_connect
-            self.client.on_disconnect = self.on_disconnect
-            
-            logger.info(f"Intentando conectar a MQTT broker {self.broker}:{self.port}...")
-            self.client.connect(self.broker, self.port, keepalive=60)
-            self.client.loop_start()  # Loop en background
-            
-            # Esperar conexión con timeout
-            timeout = 10
-            start = time.time()
-            while not self.connected and (time.time() - start) < timeout:
-                time.sleep(0.5)
-                
-            if not self.connected:
-                raise ConnectionError("Timeout esperando conexión MQTT")
-                
-            return True
-            
-        except Exception as e:
-            logger.error(f"Error conectando a MQTT: {e}")
-            return False
-            
-    def publish(self, payload):
-        """Publica un mensaje en el topic con validación"""
-        if not self.connected:
-            logger.warning("No conectado a MQTT. Intentando reconectar...")
-            if not self.connect():
-                return False
-                
-        try:
-            result = self.client.publish(self.topic, json.dumps(payload), qos=QOS)
-            
-            if result.rc == mqtt.MQTT_ERR_SUCCESS:
-                logger.info(f"📤 MQTT publicado: {payload}")
-                return True
-            else:
-                logger.error(f"Error publicando. Código: {result.rc}")
-                return False
-                
-        except Exception as e:
-            logger.error(f"Excepción publicando: {e}")
-            return False
-            
-    def disconnect(self):
-        """Desconecta del broker"""
-        if self.client:
-            self.client.loop_stop()
-            self.client.disconnect()
-            logger.info("Desconectado de MQTT")
+# Señal de parada (SIGTERM en modo sin pantalla, ver main)
+detener = threading.Event()
 
 
 # ============ CLASE DETECTOR DE PISTACHOS ============
+# Detecciones como array estructurado compacto (una fila por caja)
+DETECTION_DTYPE = np.dtype([
+    ('class_id', np.int16),
+    ('confidence', np.float32),
+    ('bbox', np.int32, (4,)),  # x1, y1, x2, y2 en píxeles
+])
+
+_SKIPPED = object()  # Marca de frame descartado por el filtro de movimiento
+
+
 class PistachioDetector:
     """Detector de pistachos usando YOLO"""
     
-    def __init__(self, model_path, confidence_threshold=0.6):
+    def __init__(self, model_path, confidence_threshold=0.6, backend="pytorch", imgsz=640,
+                 precision="fp32"):
+        """
+        Args:
+            model_path: Ruta a best.pt (los backends exportados se generan a partir de él)
+            confidence_threshold: Umbral mínimo de confianza
+            backend: Backend de inferencia (ver backends.BACKENDS)
+            imgsz: Resolución de inferencia
+            precision: "fp32", "fp16" o "int8" (ver backends.PRECISIONS)
+        """
         self.confidence_threshold = confidence_threshold
-        self.model = None
-        self.last_publish_time = 0
+        self.backend = None
+        self.roi = None  # RegionOfInterest (None = frame completo)
+        self.motion_gate = None  # MotionGate (None = inferir siempre)
+        self.last_publish_times = {}  # Última publicación por clave de cooldown
         
         # Cargar modelo
         if not os.path.exists(model_path):
             raise FileNotFoundError(f"Modelo no encontrado: {model_path}")
             
-        logger.info(f"Cargando modelo YOLO desde {model_path}...")
-        self.model = YOLO(model_path)
-        logger.info("✓ Modelo YOLO cargado correctamente")
+        self.backend = create_backend(backend, model_path, imgsz, precision)
+        logger.info(f"✓ Modelo YOLO cargado correctamente (backend: {backend}, {precision})")
+        
+        # Resolver una sola vez qué class ids son pistachos
+        self.class_names = self.backend.names
+        self.pistachio_ids = np.array(
+            [cid for cid, name in self.class_names.items() if "pistachio" in name.lower()],
+            dtype=np.int64)
+        if len(self.pistachio_ids) == 0:
+            logger.warning(f"⚠ El modelo no tiene clases 'pistachio': {self.class_names}")
+        else:
+            logger.info(f"Clases pistacho: {[self.class_names[c] for c in self.pistachio_ids]}")
         
     def detect(self, frame):
         """
         Detecta pistachos en un frame
         
         Returns:
-            list: Lista de detecciones [{'class': str, 'confidence': float, 'bbox': tuple}]
+            np.ndarray: Detecciones con dtype DETECTION_DTYPE
         """
-        results = self.model(frame, verbose=False)
-        detections = []
-        
-        for result in results:
-            boxes = result.boxes
-            for box in boxes:
-                class_id = int(box.cls)
-                class_name = result.names[class_id]
-                confidence = float(box.conf)
-                
-                # Filtrar por clase y confianza
-                if "pistachio" in class_name.lower() and confidence >= self.confidence_threshold:
-                    x1, y1, x2, y2 = map(int, box.xyxy[0])
-                    
-                    detections.append({
-                        'class': class_name,
-                        'confidence': confidence,
-                        'bbox': (x1, y1, x2, y2)
-                    })
-                    
+        return self.detect_batch([frame])[0]
+        
+    def detect_batch(self, frames, keys=None):
+        """
+        Detecta pistachos en varios frames con una única llamada al modelo
+        
+        Agrupar los frames de varias cámaras en un batch amortiza el coste fijo
+        de cada llamada a YOLO (preprocesado, overhead de PyTorch).
+        
+        Args:
+            frames: Lista de imágenes BGR
+            keys: Identificador de fuente de cada frame (el filtro de movimiento
+                  guarda un fondo por fuente); por defecto la posición en la lista
+        
+        Returns:
+            list: Un array de detecciones (DETECTION_DTYPE) por frame, en el mismo orden
+        """
+        frames = list(frames)
+        if keys is None:
+            keys = range(len(frames))
+            
+        # Región a inferir por frame: ROI, tiles con movimiento, o _SKIPPED
+        regions = [self._inference_region(frame, key) for frame, key in zip(frames, keys)]
+        detections = [np.empty(0, dtype=DETECTION_DTYPE) for _ in frames]
+        pending = [i for i, region in enumerate(regions) if region is not _SKIPPED]
+        if not pending:
+            return detections
+            
+        # Con región solo se infiere el recorte (vista sin copia del frame)
+        images = [frames[i] if regions[i] is None else regions[i].crop(frames[i])
+                  for i in pending]
+        
+        # El backend entrega un array (N, 6) por frame: una sola copia tensor -> numpy
+        outputs = self.backend.predict(images)
+        for i, data in zip(pending, outputs):
+            dets = self.postprocess(data)
+            region = regions[i]
+            if region is not None:
+                dets = region.to_frame(dets)
+                # Recorte por movimiento dentro de una ROI poligonal
+                if region is not self.roi and self.roi is not None and not self.roi.is_rect:
+                    dets = dets[self.roi.contains(dets['bbox'])]
+            detections[i] = dets
         return detections
         
-    def should_publish(self, cooldown=1.0):
-        """Verifica si ha pasado suficiente tiempo desde la última publicación"""
+    def _inference_region(self, frame, key):
+        """Región del frame que hay que pasar al modelo (None = completo)"""
+        region = self.roi
+        if self.motion_gate is None:
+            return region
+            
+        area = region.crop(frame) if region is not None else frame
+        motion = self.motion_gate.check(area, key)
+        if not motion.changed:
+            return _SKIPPED
+        if motion.region is not None:
+            # Coordenadas de los tiles relativas a la ROI -> frame
+            return motion.region if region is None else motion.region.translate(region.x, region.y)
+        return region
+        
+    def set_roi(self, roi, frame_shape=None):
+        """Limita la inferencia a una región de interés (None = frame completo)"""
+        if roi is not None and frame_shape is not None:
+            roi = roi.clip(frame_shape)
+        self.roi = roi
+        logger.info(f"Región de inferencia: {roi if roi is not None else 'frame completo'}")
+        
+    def postprocess(self, data):
+        """
+        Filtra por clase y confianza con máscaras sobre el array completo
+        
+        Args:
+            data: Array (N, 6) [x1, y1, x2, y2, conf, cls] (con tracking
+                  YOLO añade una columna de id antes de conf; se usan las
+                  dos últimas columnas para conf y cls)
+        
+        Returns:
+            np.ndarray: Detecciones con dtype DETECTION_DTYPE
+        """
+        data = np.asarray(data)
+        if data.size == 0:
+            return np.empty(0, dtype=DETECTION_DTYPE)
+            
+        confidences = data[:, -2]
+        class_ids = data[:, -1].astype(np.int64)
+        mask = (confidences >= self.confidence_threshold) & np.isin(class_ids, self.pistachio_ids)
+        
+        detections = np.empty(int(mask.sum()), dtype=DETECTION_DTYPE)
+        detections['class_id'] = class_ids[mask]
+        detections['confidence'] = confidences[mask]
+        detections['bbox'] = data[mask, :4]  # Trunca a int igual que int(x)
+        return detections
+        
+    def class_name(self, class_id):
+        """Nombre de la clase para un class id"""
+        return self.class_names[int(class_id)]
+        
+    def to_dicts(self, detections):
+        """Convierte detecciones al formato antiguo [{'class', 'confidence', 'bbox'}]"""
+        return [
+            {
+                'class': self.class_name(det['class_id']),
+                'confidence': float(det['confidence']),
+                'bbox': tuple(det['bbox'].tolist())
+            }
+            for det in detections
+        ]
+        
+    def should_publish(self, cooldown=1.0, key=None):
+        """Verifica si ha pasado suficiente tiempo desde la última publicación
+        
+        Args:
+            cooldown: Segundos mínimos entre publicaciones
+            key: Clave de cooldown independiente (p. ej. una por cámara)
+        """
         current_time = time.time()
-        if current_time - self.last_publish_time >= cooldown:
-            self.last_publish_time = current_time
+        if current_time - self.last_publish_times.get(key, 0) >= cooldown:
+            self.last_publish_times[key] = current_time
             return True
         return False
 
@@ -204,6 +325,8 @@ def initialize_camera(index, width, height):
             cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
             cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
             cap.set(cv2.CAP_PROP_FPS, FPS_TARGET)
+            # Buffer mínimo en el driver: FrameSource ya se queda con el último frame
+            cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)
             
             # Verificar lectura
             ret, frame = cap.read()
@@ -219,103 +342,409 @@ def initialize_camera(index, width, height):
     raise RuntimeError("No se pudo inicializar la cámara después de 3 intentos")
 
 
+# ============ DIBUJO Y PUBLICACIÓN ============
+def publish_detections(frame, detections, detector, mqtt_publisher, stats=None,
+                       topic=None, camera=None, tracker=None):
+    """Publica en MQTT las detecciones de un frame (sin dibujar: sirve sin pantalla)
+
+    Args:
+        frame: CapturedFrame (ver frame_source.py)
+        detections: Array DETECTION_DTYPE devuelto por PistachioDetector.detect
+        stats: StageStats opcional donde registrar la edad del frame al publicar
+        topic: Topic MQTT de la cámara (None = topic por defecto del publisher)
+        camera: Nombre de la cámara; se incluye en el payload y separa el cooldown
+        tracker: PistachioTracker de la cámara. Con tracker se publica un
+                 evento por pistacho al cruzar la línea de disparo; sin él,
+                 cada PUB_COOLDOWN segundos una detección ("evento") o
+                 todas las del frame (modos agrupados)
+
+    Returns:
+        int: Número de detecciones publicadas
+    """
+    # Qué publicar en este frame: (class_id, confianza, bbox, track o None)
+    if tracker is not None:
+        to_publish = [(track.class_id, track.confidence, track.bbox, track)
+                      for track in tracker.update(detections, frame.timestamp)]
+    else:
+        limit = 1 if PUBLISH_MODE == "evento" else None
+        to_publish = [(det['class_id'], float(det['confidence']), det['bbox'], None)
+                      for det in detections[:limit]]
+        if to_publish and not detector.should_publish(PUB_COOLDOWN, key=camera):
+            to_publish = []
+    
+    payloads = []
+    for class_id, confidence, bbox, track in to_publish:
+        payload = {
+            "objeto": detector.class_name(class_id),
+            "clase_id": int(class_id),
+            "confianza": round(confidence, 3),
+            "timestamp": datetime.now().isoformat(),
+            "captura_ts": round(frame.wall_time, 4),  # Epoch de captura (latencia fotón → servo)
+            "seq": frame.seq,
+            "bbox": [int(value) for value in bbox],
+        }
+        if track is not None:
+            payload["track_id"] = track.id
+            actuator_position = tracker.trigger_line + tracker.direction * ACTUATOR_DISTANCE_PX
+            eta = tracker.time_to_reach(track, actuator_position)
+            if eta is not None:
+                # El track se acaba de actualizar con este frame: eta cuenta desde la captura
+                payload["llegada_ts"] = round(frame.wall_time + eta, 4)
+                payload["velocidad_px_s"] = round(float(track.velocity[tracker.axis]), 1)
+        if camera is not None:
+            payload["camara"] = camera
+        payloads.append(payload)
+    
+    if PUBLISH_MODE == "evento":
+        published = sum(1 for payload in payloads if mqtt_publisher.publish(payload, topic))
+    else:
+        # Se llama también sin detecciones: cierra las ventanas vencidas
+        published = mqtt_publisher.publish_batch(payloads, topic)
+    if published:
+        age = frame.age()
+        if stats is not None:
+            stats.record('edad_publicacion', age)
+        for payload in payloads[:published]:
+            track_text = f" track #{payload['track_id']}" if 'track_id' in payload else ""
+            logger.info(f"🎯 Detección publicada: {payload['objeto']} "
+                        f"({payload['confianza']:.2%}){track_text} "
+                        f"frame #{frame.seq}, edad {age*1000:.0f}ms")
+    return published
+
+
+def annotate_frame(frame, detections, detector, tracker=None):
+    """Copia del frame con ROI, línea de disparo, cajas y tracks dibujados"""
+    annotated_frame = frame.image.copy()
+    if detector.roi is not None:
+        detector.roi.draw(annotated_frame)
+    if tracker is not None:
+        draw_trigger_line(annotated_frame, tracker)
+        
+    for det in detections:
+        x1, y1, x2, y2 = det['bbox'].tolist()
+        confidence = float(det['confidence'])
+        class_name = detector.class_name(det['class_id'])
+        
+        # Dibujar bounding box
+        color = (0, 255, 0)  # Verde para detección válida
+        cv2.rectangle(annotated_frame, (x1, y1), (x2, y2), color, 2)
+        
+        # Texto con confianza
+        label = f"{class_name}: {confidence:.2f}"
+        cv2.putText(annotated_frame, label, (x1, y1 - 10),
+                   cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
+        
+    if tracker is not None:
+        for track in tracker.active_tracks():
+            cx, cy = track.center.astype(int).tolist()
+            color = (0, 0, 255) if track.triggered else (0, 255, 255)
+            cv2.putText(annotated_frame, f"#{track.id}", (cx - 10, cy + 5),
+                       cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 2)
+                
+    return annotated_frame
+
+
+def draw_trigger_line(annotated_frame, tracker):
+    """Dibuja la línea de disparo del tracker"""
+    height, width = annotated_frame.shape[:2]
+    line = int(tracker.trigger_line)
+    if tracker.axis == 0:
+        start, end = (line, 0), (line, height)
+    else:
+        start, end = (0, line), (width, line)
+    cv2.line(annotated_frame, start, end, (0, 0, 255), 1)
+
+
+def create_tracker():
+    """Tracker por cámara según la configuración (None si está desactivado)"""
+    if not TRACKER_ENABLED:
+        return None
+    return PistachioTracker(TRIGGER_LINE, TRIGGER_AXIS, TRIGGER_DIRECTION)
+
+
+def draw_stats(annotated_frame, fps, detection_count, bottleneck=None):
+    """Superpone FPS, contador de detecciones y etapa más lenta"""
+    stats_text = f"FPS: {fps:.1f} | Detecciones: {detection_count}"
+    if bottleneck:
+        stats_text += f" | Lento: {bottleneck}"
+    cv2.putText(annotated_frame, stats_text, (10, 30),
+               cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
+
+
+def show_frame(window, stream, frame, detections, detector, tracker, fps, detection_count,
+               bottleneck=None, preview=None):
+    """Muestra el frame anotado en la ventana y/o en la vista previa si alguien mira
+
+    En modo sin pantalla no se copia ni se dibuja nada salvo que un cliente
+    de la vista previa pida frame (a PREVIEW_FPS como máximo).
+    """
+    to_preview = preview is not None and preview.wants_frame(stream)
+    if HEADLESS and not to_preview:
+        return
+    annotated_frame = annotate_frame(frame, detections, detector, tracker)
+    draw_stats(annotated_frame, fps, detection_count, bottleneck)
+    if to_preview:
+        preview.submit(stream, annotated_frame)
+    if not HEADLESS:
+        cv2.imshow(window, annotated_frame)
+
+
+def should_quit():
+    """True al pulsar 'q' en la ventana o al recibir SIGTERM
+
+    Con ventana también mantiene vivo su event loop (cv2.waitKey).
+    """
+    if not HEADLESS and cv2.waitKey(1) & 0xFF == ord('q'):
+        detener.set()
+    if detener.is_set():
+        logger.info("\n👋 Saliendo del sistema...")
+        return True
+    return False
+
+
+def log_periodic_stats(stats, pipeline, detector, preview=None):
+    """Resumen de tiempos por etapa, descartes, filtro de movimiento y vista previa"""
+    stats.log_summary()
+    logger.info(f"Descartados (latest-frame-wins): {pipeline.dropped_counts()}")
+    if detector.motion_gate is not None:
+        logger.info(f"Filtro de movimiento: {detector.motion_gate.summary()}")
+    if preview is not None and preview.clients():
+        logger.info(f"Vista previa: {preview.summary()}")
+
+
+# ============ LOOPS DE DETECCIÓN ============
+def run_sequential(source, detector, mqtt_publisher, window_name, preview=None):
+    """Loop clásico: inferencia y display en serie sobre el último frame"""
+    tracker = create_tracker()
+    frame_count = 0
+    detection_count = 0
+    start_time = time.time()
+    
+    while True:
+        frame = source.read(timeout=1.0)
+        if frame is None:
+            logger.warning("Sin frames nuevos de la cámara")
+            if should_quit():
+                break
+            continue
+            
+        frame_count += 1
+        
+        # Detectar pistachos
+        detections = detector.detect(frame.image)
+        
+        # Publicar
+        detection_count += publish_detections(
+            frame, detections, detector, mqtt_publisher, tracker=tracker)
+        
+        # Mostrar frame con FPS y estadísticas
+        elapsed = time.time() - start_time
+        fps = frame_count / elapsed if elapsed > 0 else 0
+        show_frame(window_name, source.name, frame, detections, detector, tracker,
+                   fps, detection_count, preview=preview)
+        
+        # Salir con 'q' o SIGTERM
+        if should_quit():
+            break
+
+
+def run_pipelined(source, detector, mqtt_publisher, window_name, stats, preview=None):
+    """Loop en pipeline: captura e inferencia en hilos, display aquí
+
+    El FPS mostrado es el de inferencia (resultados procesados por segundo).
+    """
+    pipeline = DetectionPipeline(source, detector.detect, stats, PIPELINE_QUEUE_SIZE)
+    pipeline.start()
+    
+    tracker = create_tracker()
+    frame_count = 0
+    detection_count = 0
+    start_time = time.time()
+    last_stats_log = start_time
+    bottleneck = None
+    
+    try:
+        while True:
+            result = pipeline.get_result(timeout=0.5)
+            if result is None:
+                # Mantener la ventana respondiendo aunque no haya resultados
+                if should_quit():
+                    break
+                continue
+                
+            frame, detections = result
+            frame_count += 1
+            
+            with stats.measure('display'):
+                detection_count += publish_detections(
+                    frame, detections, detector, mqtt_publisher, stats, tracker=tracker)
+                
+                elapsed = time.time() - start_time
+                fps = frame_count / elapsed if elapsed > 0 else 0
+                show_frame(window_name, source.name, frame, detections, detector, tracker,
+                           fps, detection_count, bottleneck, preview)
+                quit_requested = should_quit()
+                
+            if quit_requested:
+                break
+                
+            # Resumen periódico de tiempos por etapa
+            if time.time() - last_stats_log >= STATS_INTERVAL:
+                bottleneck = stats.bottleneck()
+                log_periodic_stats(stats, pipeline, detector, preview)
+                last_stats_log = time.time()
+                
+    finally:
+        pipeline.stop()
+
+
+def run_multi_camera(sources, topics, detector, mqtt_publisher, window_name, stats,
+                     preview=None):
+    """Loop multi-cámara: un único batch de YOLO por iteración para todas las cámaras
+
+    Cada cámara tiene su ventana, su topic MQTT y su propio cooldown.
+    """
+    pipeline = MultiSourcePipeline(sources, detector.detect_batch, stats, PIPELINE_QUEUE_SIZE)
+    pipeline.start()
+    
+    trackers = [create_tracker() for _ in sources]
+    frame_counts = [0] * len(sources)
+    detection_count = 0
+    start_time = time.time()
+    last_stats_log = start_time
+    bottleneck = None
+    
+    try:
+        while True:
+            result = pipeline.get_result(timeout=0.5)
+            if should_quit():
+                break
+            if result is None:
+                continue
+                
+            elapsed = time.time() - start_time
+            with stats.measure('display'):
+                for index, frame, detections in result:
+                    frame_counts[index] += 1
+                    name = sources[index].name
+                    detection_count += publish_detections(
+                        frame, detections, detector, mqtt_publisher, stats,
+                        topic=topics[index], camera=name, tracker=trackers[index])
+                    
+                    fps = frame_counts[index] / elapsed if elapsed > 0 else 0
+                    show_frame(f"{window_name} - {name}", name, frame, detections, detector,
+                               trackers[index], fps, detection_count, bottleneck, preview)
+                    
+            # Resumen periódico: tiempos por etapa y FPS por cámara
+            if time.time() - last_stats_log >= STATS_INTERVAL:
+                bottleneck = stats.bottleneck()
+                log_periodic_stats(stats, pipeline, detector, preview)
+                fps_text = ", ".join(
+                    f"{source.name}: {count / elapsed:.1f}"
+                    for source, count in zip(sources, frame_counts))
+                logger.info(f"FPS por cámara → {fps_text} | "
+                            f"total: {sum(frame_counts) / elapsed:.1f}")
+                last_stats_log = time.time()
+                
+    finally:
+        pipeline.stop()
+
+
 # ============ LOOP PRINCIPAL ============
 def main():
     logger.info("="*60)
     logger.info("Sistema de Detección de Pistachos - RPi5")
     logger.info(f"Umbral de confianza: {CONFIDENCE_THRESHOLD*100}%")
+    logger.info(f"Backend de inferencia: {INFERENCE_BACKEND} {INFERENCE_PRECISION} "
+                f"(imgsz={INFERENCE_IMGSZ})")
     logger.info(f"Broker MQTT: {BROKER}:{PORT}")
-    logger.info(f"Topic: {TOPIC_DETECCION}")
+    logger.info(f"Topic: {TOPIC_DETECCION} (publicación: {PUBLISH_MODE})")
+    logger.info(f"Modo: {'pipeline' if PIPELINE_MODE else 'secuencial'}"
+                f"{', sin pantalla' if HEADLESS else ''}")
+    if TRACKER_ENABLED:
+        logger.info(f"Tracking: línea de disparo {TRIGGER_AXIS}={TRIGGER_LINE}")
+    if len(CAMERAS) > 1:
+        logger.info(f"Cámaras: {', '.join(f'{index} → {topic}' for index, topic in CAMERAS)}")
     logger.info("="*60)
     
     # Inicializar componentes
     mqtt_publisher = None
-    cap = None
+    sources = []
     detector = None
+    preview = None
+    
+    # systemd/docker paran el servicio con SIGTERM: salir como con 'q'
+    signal.signal(signal.SIGTERM, lambda signum, stack: detener.set())
     
     try:
         # Cargar modelo
         script_dir = os.path.dirname(os.path.abspath(__file__))
         model_path = os.path.join(script_dir, "best.pt")
-        detector = PistachioDetector(model_path, CONFIDENCE_THRESHOLD)
+        detector = PistachioDetector(model_path, CONFIDENCE_THRESHOLD,
+                                     INFERENCE_BACKEND, INFERENCE_IMGSZ, INFERENCE_PRECISION)
         
         # Conectar MQTT
-        mqtt_publisher = MQTTPublisher(BROKER, PORT, TOPIC_DETECCION)
+        mqtt_publisher = MQTTPublisher(BROKER, PORT, TOPIC_DETECCION, qos=QOS,
+                                       buffer_size=MQTT_BUFFER_SIZE,
+                                       drop_policy=MQTT_DROP_POLICY,
+                                       flush_on_reconnect=MQTT_FLUSH_ON_RECONNECT,
+                                       reconnect_max_delay=MQTT_RECONNECT_MAX_DELAY,
+                                       payload_format=PAYLOAD_FORMAT,
+                                       batch_window=(PUBLISH_WINDOW_MS / 1000
+                                                     if PUBLISH_MODE == "ventana" else 0))
         if not mqtt_publisher.connect():
-            logger.error("No se pudo conectar a MQTT. Verifica que el broker esté corriendo:")
-            logger.error("  sudo docker ps  # Verificar contenedor mosquitto")
-            return
+            logger.warning("Broker MQTT sin respuesta: se sigue detectando y se reintenta "
+                           "en segundo plano. Verifica que el broker esté corriendo:")
+            logger.warning("  sudo docker ps  # Verificar contenedor mosquitto")
         
-        # Inicializar cámara
-        cap = initialize_camera(CAMERA_INDEX, FRAME_WIDTH, FRAME_HEIGHT)
+        # Inicializar cámaras
+        stats = StageStats()
+        for index, _ in CAMERAS:
+            cap = initialize_camera(index, FRAME_WIDTH, FRAME_HEIGHT)
+            sources.append(FrameSource(cap, f"cam{index}", stats).start())
         
-        # Crear ventana
-        window_name = f"Detección Pistachos (>= {int(CONFIDENCE_THRESHOLD*100)}%)"
-        cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
+        # Región de interés (configurada o autocalibrada)
+        roi = RegionOfInterest.from_config(ROI)
+        if roi is None and ROI_AUTO_CALIBRATE:
+            roi = calibrate_roi(sources[0], detector.detect, ROI_CALIBRATION_SECONDS, ROI_MARGIN)
+        if roi is not None:
+            cap = sources[0].cap
+            frame_shape = (int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+                           int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)))
+            detector.set_roi(roi, frame_shape)
+            
+        # Filtro de movimiento (después de calibrar la ROI, que necesita inferir siempre)
+        if MOTION_GATE:
+            detector.motion_gate = MotionGate(MOTION_METHOD, tiles_only=MOTION_TILES_ONLY)
+            logger.info(f"Filtro de movimiento activo ({MOTION_METHOD}"
+                        f"{', solo tiles cambiados' if MOTION_TILES_ONLY else ''})")
         
-        logger.info("\n🚀 Sistema iniciado. Presiona 'q' para salir.\n")
+        # Vista previa MJPEG por HTTP
+        if PREVIEW_PORT:
+            try:
+                preview = PreviewServer(PREVIEW_PORT, PREVIEW_FPS, PREVIEW_QUALITY, PREVIEW_HOST,
+                                        PREVIEW_MIN_FPS, PREVIEW_MIN_QUALITY).start()
+                for source in sources:
+                    preview.register(source.name)
+            except OSError as e:
+                logger.warning(f"⚠ Vista previa desactivada (puerto {PREVIEW_PORT}): {e}")
         
-        # Estadísticas
-        frame_count = 0
-        detection_count = 0
-        start_time = time.time()
+        # Crear ventana
+        window_name = f"Detección Pistachos (>= {int(CONFIDENCE_THRESHOLD*100)}%)"
+        if not HEADLESS:
+            cv2.namedWindow(window_name, cv2.WINDOW_NORMAL)
+            logger.info("\n🚀 Sistema iniciado. Presiona 'q' para salir.\n")
+        else:
+            logger.info("\n🚀 Sistema iniciado sin pantalla. Para salir: Ctrl+C o SIGTERM.\n")
         
-        # Loop de detección
-        while True:
-            ret, frame = cap.read()
-            if not ret:
-                logger.error("Error leyendo frame de cámara")
-                time.sleep(0.1)
-                continue
-                
-            frame_count += 1
-            
-            # Detectar pistachos
-            detections = detector.detect(frame)
-            
-            # Dibujar detecciones
-            annotated_frame = frame.copy()
-            for det in detections:
-                x1, y1, x2, y2 = det['bbox']
-                confidence = det['confidence']
-                class_name = det['class']
-                
-                # Dibujar bounding box
-                color = (0, 255, 0)  # Verde para detección válida
-                cv2.rectangle(annotated_frame, (x1, y1), (x2, y2), color, 2)
-                
-                # Texto con confianza
-                label = f"{class_name}: {confidence:.2f}"
-                cv2.putText(annotated_frame, label, (x1, y1 - 10),
-                           cv2.FONT_HERSHEY_SIMPLEX, 0.6, color, 2)
-                
-                # Publicar en MQTT (con cooldown)
-                if detector.should_publish(PUB_COOLDOWN):
-                    payload = {
-                        "objeto": class_name,
-                        "confianza": round(confidence, 3),
-                        "timestamp": datetime.now().isoformat()
-                    }
-                    
-                    if mqtt_publisher.publish(payload):
-                        detection_count += 1
-                        logger.info(f"🎯 Detección #{detection_count}: {class_name} ({confidence:.2%})")
-            
-            # Mostrar FPS y estadísticas
-            elapsed = time.time() - start_time
-            fps = frame_count / elapsed if elapsed > 0 else 0
-            
-            stats_text = f"FPS: {fps:.1f} | Detecciones: {detection_count}"
-            cv2.putText(annotated_frame, stats_text, (10, 30),
-                       cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 255), 2)
-            
-            # Mostrar frame
-            cv2.imshow(window_name, annotated_frame)
-            
-            # Salir con 'q'
-            if cv2.waitKey(1) & 0xFF == ord('q'):
-                logger.info("\n👋 Saliendo del sistema...")
-                break
+        if len(sources) > 1:
+            topics = [topic for _, topic in CAMERAS]
+            run_multi_camera(sources, topics, detector, mqtt_publisher, window_name, stats,
+                             preview)
+        elif PIPELINE_MODE:
+            run_pipelined(sources[0], detector, mqtt_publisher, window_name, stats, preview)
+        else:
+            run_sequential(sources[0], detector, mqtt_publisher, window_name, preview)
                 
     except KeyboardInterrupt:
         logger.info("\n⚠ Interrupción por usuario (Ctrl+C)")
@@ -325,14 +754,18 @@ def main():
         
     finally:
         # Limpiar recursos
-        if cap:
-            cap.release()
-            logger.info("Cámara liberada")
+        for source in sources:
+            source.release()
+            logger.info(f"Cámara {source.name} liberada ({source.dropped} frames viejos descartados)")
             
         if mqtt_publisher:
             mqtt_publisher.disconnect()
             
-        cv2.destroyAllWindows()
+        if preview:
+            preview.stop()
+            
+        if not HEADLESS:
+            cv2.destroyAllWindows()
         
         logger.info("Sistema detenido correctamente")
 
@@ -47,6 +47,8 @@ echo -e "${GREEN}✓ Dependencias instaladas${NC}"
 echo -e "\n${BLUE}[3/7] Instalando paquetes Python...${NC}"
 pip3 install --upgrade pip
 pip3 install pyserial paho-mqtt numpy ultralytics opencv-python
+# Controlador asyncio (control_servo_async.py)
+pip3 install aiomqtt pyserial-asyncio
 
 echo -e "${GREEN}✓ Paquetes Python instalados${NC}"
 